@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from telemetry import log_event
+from config_state import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_PATH,
+)
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    answer: str
+    embedding: np.ndarray
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed on query embeddings.
+
+    A lookup is a hit when the closest stored query has cosine similarity
+    >= threshold. Embeddings are expected to be normalized, so the
+    similarity is a plain dot product. Entries are evicted in LRU order
+    once max_entries is reached and expire after ttl_seconds.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 512, ttl_seconds: float = 86400,
+                 persist_path: Optional[str] = None, enabled: bool = True):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.enabled = enabled
+        self.index_version = None
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._next_key = 0
+        self._matrix = None  # stacked embeddings, rebuilt lazily after changes
+        self._matrix_keys: list[int] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Bumped on invalidate, so answers generated from the old index aren't stored afterwards
+        self.generation = 0
+
+    # --- lookups and inserts ---
+
+    def lookup(self, embedding) -> Optional[CacheEntry]:
+        """Return the best matching entry above the threshold, or None."""
+        if not self.enabled:
+            return None
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._drop_expired()
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([self._entries[k].embedding for k in self._matrix_keys])
+            scores = self._matrix @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def store(self, query: str, embedding, answer: str, generation: Optional[int] = None):
+        """
+        Add an answer. Pass the `generation` read before the answer was
+        generated: if the cache was invalidated since (the index was swapped
+        mid-request), the answer is dropped.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[self._next_key] = CacheEntry(
+                query=query,
+                answer=answer,
+                embedding=np.asarray(embedding, dtype=np.float32),
+                created_at=time.time(),
+            )
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self, index_version: Optional[str] = None):
+        """Drop every entry, e.g. because the guideline index was rebuilt."""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self.generation += 1
+            if index_version is not None:
+                self.index_version = index_version
+        log_event("answer_cache_invalidated", index_version=self.index_version)
+
+    def _drop_expired(self):
+        # Caller holds the lock. Entries are in LRU order, not insertion order,
+        # so every entry has to be checked.
+        cutoff = time.time() - self.ttl_seconds
+        expired = [k for k, entry in self._entries.items() if entry.created_at < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.expirations += len(expired)
+            self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "index_version": self.index_version,
+        }
+
+    # --- optional on-disk persistence ---
+
+    def load(self, index_version: str):
+        """Load persisted entries, discarding them if they belong to another index version."""
+        self.index_version = index_version
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        with open(self.persist_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("index_version") != index_version:
+            log_event("answer_cache_load_skipped", path=self.persist_path, index_version=index_version,
+                      persisted_index_version=data.get("index_version"))
+            return
+        with self._lock:
+            for item in data.get("entries", []):
+                self._entries[self._next_key] = CacheEntry(
+                    query=item["query"],
+                    answer=item["answer"],
+                    embedding=np.asarray(item["embedding"], dtype=np.float32),
+                    created_at=item["created_at"],
+                )
+                self._next_key += 1
+            self._drop_expired()
+            self._matrix = None
+        log_event("answer_cache_loaded", path=self.persist_path, entries=len(self._entries), index_version=index_version)
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._lock:
+            data = {
+                "index_version": self.index_version,
+                "entries": [
+                    {
+                        "query": entry.query,
+                        "answer": entry.answer,
+                        "embedding": entry.embedding.tolist(),
+                        "created_at": entry.created_at,
+                    }
+                    for entry in self._entries.values()
+                ],
+            }
+        # Write to a temp file first so a crash never leaves a truncated cache
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.persist_path)
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    persist_path=ANSWER_CACHE_PATH or None,
+    enabled=ANSWER_CACHE_ENABLED,
+)
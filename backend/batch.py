@@ -0,0 +1,194 @@
+import asyncio
+import time
+from langchain_core.messages import HumanMessage
+from config_state import (
+    embedding_model, COMPRESSION_MODE, INTENT_CLASSIFIER, INTENT_MIN_MARGIN,
+    INTENT_LLM_ESCALATION, RETRIEVAL_MODE, RETRIEVAL_K, HYBRID_CANDIDATES, RRF_K, BATCH_MAX_CONCURRENCY,
+    CHILD_CANDIDATES, PARENT_K, RERANK_ENABLED, RERANK_CANDIDATES, RERANK_TOP_N, RERANK_BUDGET_MS,
+)
+from answer_cache import answer_cache
+from compression import compress_documents
+from intent_router import intent_router
+from reranker import reranker
+from nodes import guideline_indexes, parent_sections, llm_intent, general_query, assemble_context, generation
+from sparse_index import reciprocal_rank_fusion
+from telemetry import log_event, record_cache, traced_node
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+async def dense_search_batch(vector_store, embeddings: list[list[float]], k: int) -> list[list]:
+    """Top-k for every query embedding: one matrix product on the NumPy store, parallel lookups otherwise."""
+    if hasattr(vector_store, "similarity_search_by_vectors"):
+        return await asyncio.to_thread(vector_store.similarity_search_by_vectors, embeddings, k)
+    return await asyncio.gather(*(
+        asyncio.to_thread(vector_store.similarity_search_by_vector, embedding, k) for embedding in embeddings
+    ))
+
+
+async def retrieve_batch(indexes, messages: list[str], embeddings: list[list[float]],
+                         pool: int = None) -> tuple[list[list], bool]:
+    """
+    Top `pool` (RETRIEVAL_K by default) candidates for every message from each guideline's collection, fused
+    across guidelines with RRF; for a parent-child index, the parent sections of the top children (PARENT_K
+    by default). Also returns whether they are sections.
+    """
+    sections = any(index.parents is not None for index in indexes)
+    k = max(CHILD_CANDIDATES, pool or 0) if sections else pool or RETRIEVAL_K
+
+    async def search(index) -> list[list]:
+        if index.sparse_index is None or RETRIEVAL_MODE != "hybrid":
+            return await dense_search_batch(index.vector_store, embeddings, k)
+        candidates = max(HYBRID_CANDIDATES, k)
+        dense, sparse = await asyncio.gather(
+            dense_search_batch(index.vector_store, embeddings, candidates),
+            asyncio.to_thread(lambda: [index.sparse_index.search(message, candidates) for message in messages]),
+        )
+        return [reciprocal_rank_fusion([d, s], k=RRF_K)[:k] for d, s in zip(dense, sparse)]
+
+    per_guideline = await asyncio.gather(*(search(index) for index in indexes))
+    if len(per_guideline) == 1:
+        ranked = per_guideline[0]
+    else:
+        ranked = [reciprocal_rank_fusion(list(rankings), k=RRF_K)[:k] for rankings in zip(*per_guideline)]
+    if sections:
+        ranked = [parent_sections(indexes, children, pool or PARENT_K) for children in ranked]
+    return ranked, sections
+
+
+async def classify_batch(messages: list[str], embeddings: list[list[float]]) -> list[str]:
+    """Route every message with the local router in one pass; only unsure ones go to the LLM."""
+    if not messages:
+        # Every item was answered from the cache
+        return []
+    routed = await asyncio.to_thread(intent_router.classify_embeddings, embeddings)
+    intents = [label for label, _ in routed]
+    unsure = [
+        i for i, (_, margin) in enumerate(routed)
+        if INTENT_CLASSIFIER != "embedding" or (margin < INTENT_MIN_MARGIN and INTENT_LLM_ESCALATION)
+    ]
+
+    async def escalate(i: int):
+        try:
+            intents[i] = await llm_intent(messages[i])
+        except Exception as e:
+            log_event("intent_error", error=str(e), fallback=intents[i])
+
+    await asyncio.gather(*(escalate(i) for i in unsure))
+    return intents
+
+
+async def _answer_item(state: dict) -> dict:
+    """Compression (or reranking) and generation for one batch item, traced like a graph node."""
+    start = time.perf_counter()
+    docs, compression_stats = await compress_documents(state['candidates'], state['message'], state['compression'])
+    rerank_stats = None
+    if RERANK_ENABLED:
+        docs, rerank_stats = await reranker.rerank(state['message'], docs, RERANK_TOP_N, RERANK_BUDGET_MS)
+    packed = await assemble_context({'retrieved_docs': docs})
+    compressed_at = time.perf_counter()
+    response = await generation({'query': [HumanMessage(content=state['message'])], 'guidelines': state['guidelines'], **packed})
+    return {
+        'output': response['messages'][-1].content,
+        'compression_stats': compression_stats,
+        'rerank_stats': rerank_stats,
+        'context_stats': packed['context_stats'],
+        'retrieved_docs': docs,
+        'compression_ms': _ms(compressed_at - start),
+        'generation_ms': _ms(time.perf_counter() - compressed_at),
+    }
+
+
+answer_item = traced_node('batch_item', _answer_item)
+
+
+async def answer_batch(messages: list[str], compression: str = None, concurrency: int = None,
+                       guidelines: list[str] = None) -> tuple[list[dict], dict]:
+    """
+    Answer independent questions in one pass: a single embed_documents call,
+    bulk intent routing, batched top-k retrieval (from `guidelines`, or all of
+    them), then compression (or reranking) and generation for each item concurrently (at
+    most `concurrency` at once). Returns per-item results in input order,
+    plus batch timings.
+    """
+    start = time.perf_counter()
+    mode = compression or COMPRESSION_MODE
+    concurrency = max(1, concurrency or BATCH_MAX_CONCURRENCY)
+    timings = {}
+
+    cache_generation = answer_cache.generation
+    step = time.perf_counter()
+    embeddings = await asyncio.to_thread(embedding_model.embed_documents, messages)
+    timings['embed_ms'] = _ms(time.perf_counter() - step)
+
+    results: list[dict] = [{'output': None, 'cached': False, 'intent': None} for _ in messages]
+    pending = []
+    # As in /bot, answers routed to specific guidelines neither come from nor go into the cache
+    # Items have no history, so each is keyed like the first turn of a chat session
+    use_cache = answer_cache.enabled and not guidelines
+    for i, embedding in enumerate(embeddings):
+        cached = answer_cache.lookup(embedding) if use_cache else None
+        if use_cache:
+            record_cache("answer", cached is not None)
+        if cached is not None:
+            results[i].update(output=cached.answer, cached=True, intent='medical', total_ms=_ms(time.perf_counter() - start))
+        else:
+            pending.append(i)
+
+    step = time.perf_counter()
+    intents = await classify_batch([messages[i] for i in pending], [embeddings[i] for i in pending])
+    timings['intent_ms'] = _ms(time.perf_counter() - step)
+    medical = []
+    for i, intent in zip(pending, intents):
+        results[i]['intent'] = intent
+        if intent == 'medical':
+            medical.append(i)
+        else:
+            reply = general_query({'guidelines': guidelines})
+            results[i].update(output=reply['messages'][-1].content, total_ms=_ms(time.perf_counter() - start))
+
+    step = time.perf_counter()
+    candidates = {}
+    if medical:
+        indexes = await guideline_indexes(guidelines)
+        retrieved, sections = await retrieve_batch(indexes, [messages[i] for i in medical], [embeddings[i] for i in medical],
+                                                   RERANK_CANDIDATES if RERANK_ENABLED else None)
+        candidates = dict(zip(medical, retrieved))
+        if sections or RERANK_ENABLED:
+            # As in retrieve_documents, parent sections and the rerank pool skip compression
+            mode = 'none'
+    timings['retrieval_ms'] = _ms(time.perf_counter() - step)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(i: int):
+        async with semaphore:
+            try:
+                item = await answer_item({'message': messages[i], 'candidates': candidates[i], 'compression': mode,
+                                          'guidelines': guidelines})
+            except Exception as e:
+                # One failed item shouldn't sink the rest of the batch
+                results[i].update(error=str(e), total_ms=_ms(time.perf_counter() - start))
+                return
+            item['retrieved_docs'] = len(item['retrieved_docs'])
+            results[i].update(item, total_ms=_ms(time.perf_counter() - start))
+            if use_cache:
+                answer_cache.store(messages[i], embeddings[i], item['output'], generation=cache_generation)
+
+    step = time.perf_counter()
+    await asyncio.gather(*(answer(i) for i in medical))
+    timings['generation_ms'] = _ms(time.perf_counter() - step)
+
+    total = time.perf_counter() - start
+    timings.update(
+        total_ms=_ms(total),
+        items=len(messages),
+        cached=len(messages) - len(pending),
+        medical=len(medical),
+        concurrency=concurrency,
+        questions_per_s=round(len(messages) / total, 2) if total else 0.0,
+    )
+    log_event("batch", **timings)
+    return results, timings
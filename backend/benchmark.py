@@ -0,0 +1,1741 @@
+"""
+Offline benchmarks for the CDSS backend.
+
+Run from the backend directory, for example:
+    python benchmark.py load --clients 16 --requests 4
+    python benchmark.py compression
+    python benchmark.py cache
+    python benchmark.py intent
+    python benchmark.py soak --requests 5000 --sessions 500
+    python benchmark.py stream
+    python benchmark.py retrieval --gold data/retrieval_gold.json
+    python benchmark.py coldstart
+    python benchmark.py startup --max-live-seconds 3
+    python benchmark.py vectorstore
+    python benchmark.py cds --hooks 200 --patients 60 --concurrency 16
+    python benchmark.py batch --concurrency 1 4 8
+    python benchmark.py context --budgets 0 1500 1000 500
+    python benchmark.py parentchild --compression llm
+    python benchmark.py rerank --compression llm
+    python benchmark.py speculative --rounds 3
+    python benchmark.py llm --requests 60 --rate 2 --rpm 30
+    python benchmark.py embeddings --backends torch onnx onnx-int8 --threads 4
+    python benchmark.py ingest --page 10
+    python benchmark.py --llm-latency 0.2 suite --output results/$(git rev-parse --short HEAD).json
+    python benchmark.py compare results/base.json results/new.json
+
+Unless LLM_PROVIDER is already set, the Groq model is replaced by the
+deterministic StubChatModel from stub_llm.py so runs need no network access.
+The embedding model and the guideline PDF are the real ones.
+"""
+import os
+os.environ.setdefault("LLM_PROVIDER", "stub")
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from pathlib import Path
+
+
+def data_path(name: str) -> Path:
+    """Resolve a file in data/, whether we run from the backend folder or the repo root."""
+    local = Path("data") / name
+    if local.exists():
+        return local
+    return Path(__file__).resolve().parent.parent / "data" / name
+
+
+def load_questions(path: Path = None) -> list[str]:
+    """Parse the `Que N- ...` lines of data/questions.txt into plain questions."""
+    path = path or data_path("questions.txt")
+    questions = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        match = re.match(r"\s*Que\s*\d+\s*-\s*(.+)", line)
+        if match:
+            questions.append(match.group(1).strip())
+    return questions
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux), NaN elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def memory_status_mb() -> dict:
+    """VmRSS split into anonymous (private heap) and file-backed (shareable, e.g. mmap) pages, in MB (Linux)."""
+    status = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    status[key] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        pass
+    return status
+
+
+def peak_rss_growth_mb(fn) -> float:
+    """How far RSS peaks above its current level while fn() runs, in MB (Linux 4.0+), NaN elsewhere."""
+    try:
+        # Writing 5 to clear_refs resets the VmHWM high-water mark to the current RSS
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = memory_status_mb()["VmRSS"]
+        fn()
+        with open("/proc/self/status") as f:
+            peak = next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmHWM:"))
+    except (OSError, KeyError, ValueError, StopIteration):
+        return float("nan")
+    return peak - before
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile, good enough for latency reports."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def print_latencies(label: str, values: list[float]):
+    print(
+        f"{label:<24} n={len(values):<5} "
+        f"p50={percentile(values, 50) * 1000:8.1f} ms  "
+        f"p99={percentile(values, 99) * 1000:8.1f} ms  "
+        f"max={max(values) * 1000 if values else float('nan'):8.1f} ms"
+    )
+
+
+# --- load: concurrent clients against /bot ---
+
+async def run_load(clients: int, requests_per_client: int, use_cache: bool = False):
+    import httpx
+    import main
+    from graph import build_rag_graph
+
+    questions = load_questions()
+    # ASGITransport does not run the lifespan, so build the graph ourselves
+    main.rag_app = build_rag_graph()
+    # The question list repeats, so with the cache on we would mostly measure cache hits
+    main.answer_cache.enabled = use_cache
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm-up request so PDF parsing and index loading are not measured
+        await client.post("/bot", json={"message": questions[0]})
+
+        bot_latencies: list[float] = []
+        discovery_latencies: list[float] = []
+        done = asyncio.Event()
+
+        async def chat_client(client_id: int):
+            for i in range(requests_per_client):
+                question = questions[(client_id * requests_per_client + i) % len(questions)]
+                start = time.perf_counter()
+                response = await client.post("/bot", json={"message": question})
+                response.raise_for_status()
+                bot_latencies.append(time.perf_counter() - start)
+
+        async def discovery_probe():
+            # /cds-services should stay responsive while the chat load runs
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/cds-services")
+                discovery_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        probe = asyncio.create_task(discovery_probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(chat_client(c) for c in range(clients)))
+        wall = time.perf_counter() - start
+        done.set()
+        await probe
+
+    total = clients * requests_per_client
+    print(f"clients={clients} requests={total} wall={wall:.2f}s throughput={total / wall:.2f} req/s")
+    print_latencies("/bot", bot_latencies)
+    print_latencies("/cds-services", discovery_latencies)
+
+
+# --- compression: latency and token counts per compression mode ---
+
+async def run_compression(modes: list[str]):
+    from langchain_core.messages import HumanMessage
+    from graph import build_rag_graph
+    from config_state import GUIDELINE_PATH
+
+    questions = load_questions()
+    rag_app = build_rag_graph()
+    # Warm-up so PDF parsing and index loading are not measured
+    await rag_app.ainvoke(
+        {'query': [HumanMessage(content=questions[0])], 'guideline_path': GUIDELINE_PATH, 'compression': 'none'},
+        config={'configurable': {'thread_id': 'bench-warmup'}},
+    )
+
+    print(f"{'mode':<10} {'e2e p50':>9} {'e2e p99':>9} {'compress p50':>13} {'llm calls':>10} {'tokens in':>10} {'tokens out':>11}")
+    for mode in modes:
+        e2e, compress, calls, tokens_in, tokens_out = [], [], [], [], []
+        for i, question in enumerate(questions):
+            start = time.perf_counter()
+            result = await rag_app.ainvoke(
+                {'query': [HumanMessage(content=question)], 'guideline_path': GUIDELINE_PATH, 'compression': mode},
+                config={'configurable': {'thread_id': f'bench-{mode}-{i}'}},
+            )
+            e2e.append(time.perf_counter() - start)
+            stats = result.get('compression_stats') or {}
+            compress.append(stats.get('latency_ms', 0.0) / 1000)
+            calls.append(stats.get('llm_calls', 0))
+            tokens_in.append(stats.get('tokens_in', 0))
+            tokens_out.append(stats.get('tokens_out', 0))
+        n = len(questions)
+        print(
+            f"{mode:<10} {percentile(e2e, 50) * 1000:7.0f}ms {percentile(e2e, 99) * 1000:7.0f}ms "
+            f"{percentile(compress, 50) * 1000:11.0f}ms {sum(calls) / n:10.1f} "
+            f"{sum(tokens_in) / n:10.0f} {sum(tokens_out) / n:11.0f}"
+        )
+
+
+# --- cache: semantic answer cache hit rate on reworded questions ---
+
+REWORDINGS = (
+    "{q}",
+    "Can you tell me: {q}",
+    "{q_lower}",
+    "According to the guideline, {q_lower}",
+)
+
+
+async def run_cache():
+    import httpx
+    import main
+    from graph import build_rag_graph
+
+    questions = load_questions()
+    main.rag_app = build_rag_graph()
+    main.answer_cache.invalidate()
+    transport = httpx.ASGITransport(app=main.app)
+
+    hit_latencies, miss_latencies = [], []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for template in REWORDINGS:
+            for question in questions:
+                message = template.format(q=question, q_lower=question[0].lower() + question[1:])
+                start = time.perf_counter()
+                response = await client.post("/bot", json={"message": message})
+                response.raise_for_status()
+                elapsed = time.perf_counter() - start
+                (hit_latencies if response.json().get("cached") else miss_latencies).append(elapsed)
+        stats = (await client.get("/cache/stats")).json()
+
+    print(f"hits={stats['hits']} misses={stats['misses']} hit_rate={stats['hit_rate']:.2%} "
+          f"entries={stats['entries']} threshold={stats['threshold']}")
+    print_latencies("cache hit", hit_latencies)
+    print_latencies("cache miss", miss_latencies)
+
+
+# --- intent: local router vs LLM classifier on a labelled query set ---
+
+async def run_intent():
+    from config_state import embedding_model, INTENT_MIN_MARGIN
+    from intent_router import intent_router
+    from nodes import llm_intent
+
+    labelled = [json.loads(line) for line in data_path("intent_queries.jsonl").read_text(encoding="utf-8").splitlines() if line.strip()]
+    queries = [item["query"] for item in labelled]
+    gold = [item["intent"] for item in labelled]
+
+    # Build the centroids before timing anything
+    intent_router.classify("warm-up")
+
+    embed_times, head_times, local, margins = [], [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        vector = embedding_model.embed_query(query)
+        embed_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        intent, margin = intent_router.classify_embedding(vector)
+        head_times.append(time.perf_counter() - start)
+        local.append(intent)
+        margins.append(margin)
+
+    llm_times, llm_only = [], []
+    for query in queries:
+        start = time.perf_counter()
+        try:
+            llm_only.append(await llm_intent(query))
+        except Exception as e:
+            print(f"LLM classification failed: {e}")
+            llm_only.append(None)
+        llm_times.append(time.perf_counter() - start)
+
+    escalated = [m < INTENT_MIN_MARGIN for m in margins]
+    hybrid = [llm if esc and llm else loc for loc, llm, esc in zip(local, llm_only, escalated)]
+
+    def accuracy(predictions):
+        return sum(p == g for p, g in zip(predictions, gold)) / len(gold)
+
+    print(f"{len(gold)} labelled queries ({gold.count('medical')} medical, {gold.count('general')} general)")
+    print(f"router accuracy            {accuracy(local):.2%}")
+    print(f"router + LLM escalation    {accuracy(hybrid):.2%}  (escalated {sum(escalated)}/{len(gold)}, margin < {INTENT_MIN_MARGIN})")
+    print(f"LLM only                   {accuracy(llm_only):.2%}")
+    print(f"router head (centroids)    p50={percentile(head_times, 50) * 1e6:.1f} us  p99={percentile(head_times, 99) * 1e6:.1f} us")
+    print_latencies("query embedding", embed_times)
+    print_latencies("LLM classifier", llm_times)
+    for query, g, p, m in zip(queries, gold, local, margins):
+        if p != g:
+            print(f"  router miss: [{g} -> {p}, margin {m:.3f}] {query}")
+
+
+# --- soak: memory of the checkpointer under many sessions and turns ---
+
+async def run_soak(total_requests: int, sessions: int, report_every: int):
+    import random
+    from langchain_core.messages import HumanMessage
+    from graph import build_rag_graph
+    from config_state import GUIDELINE_PATH
+
+    questions = load_questions()
+    rag_app = build_rag_graph()
+    rng = random.Random(0)
+    print(f"{'requests':>9} {'rss MB':>8} {'threads':>8} {'checkpoints':>12} {'blobs':>7} {'evicted':>8}")
+    for i in range(1, total_requests + 1):
+        session = rng.randrange(sessions)
+        await rag_app.ainvoke(
+            {'query': [HumanMessage(content=rng.choice(questions))], 'guideline_path': GUIDELINE_PATH, 'compression': 'none'},
+            config={'configurable': {'thread_id': f'soak-{session}'}},
+        )
+        if i % report_every == 0:
+            stats = rag_app.checkpointer.stats()
+            print(f"{i:>9} {current_rss_mb():8.1f} {stats['threads']:>8} {stats['checkpoints']:>12} "
+                  f"{stats['blobs']:>7} {stats['evicted_threads']:>8}")
+
+
+# --- stream: time to first token over SSE vs the blocking endpoint ---
+
+async def run_stream():
+    import httpx
+    import main
+    from graph import build_rag_graph
+
+    questions = load_questions()
+    main.rag_app = build_rag_graph()
+    main.answer_cache.enabled = False
+    transport = httpx.ASGITransport(app=main.app)
+
+    ttft, stream_total, blocking_total = [], [], []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/bot", json={"message": questions[0]})
+        for question in questions:
+            start = time.perf_counter()
+            await client.post("/bot", json={"message": question})
+            blocking_total.append(time.perf_counter() - start)
+
+            # ASGITransport buffers the response body, so use the timings the server measured
+            response = await client.post("/bot/stream", json={"message": question})
+            done = json.loads(response.text.split("event: done\ndata: ")[1].split("\n")[0])
+            ttft.append(done["ttft_ms"] / 1000)
+            stream_total.append(done["total_ms"] / 1000)
+
+    print_latencies("/bot (blocking)", blocking_total)
+    print_latencies("/bot/stream first token", ttft)
+    print_latencies("/bot/stream total", stream_total)
+
+
+# --- retrieval: recall@k and latency of dense, BM25 and hybrid retrieval ---
+
+def load_gold(path) -> dict:
+    """Gold relevant pages per question: {"question text": [page, ...]} with 0-based PyMuPDF page numbers."""
+    if path is None:
+        path = data_path("retrieval_gold.json")
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return {q: set(pages) for q, pages in json.loads(path.read_text(encoding="utf-8")).items()}
+
+
+def key_terms(question: str) -> set[str]:
+    """Exact clinical terms of a question: acronyms and tokens containing digits (HFrEF, CRT, SGLT2i, class III)."""
+    from sparse_index import tokenize
+    raw = re.findall(r"\b(?:[A-Z]{2,}\w*|\w*[a-z][A-Z]\w*|\w*\d\w*%?)", question)
+    return {t for word in raw for t in tokenize(word)}
+
+
+async def warm_up_index():
+    """Run one medical query through the graph so the vector store and BM25 index are loaded."""
+    from langchain_core.messages import HumanMessage
+    from graph import build_rag_graph
+    from config_state import GUIDELINE_PATH
+    import nodes
+
+    rag_app = build_rag_graph()
+    await rag_app.ainvoke(
+        {'query': [HumanMessage(content="heart failure guideline")], 'guideline_path': GUIDELINE_PATH, 'compression': 'none'},
+        config={'configurable': {'thread_id': 'bench-warmup'}},
+    )
+    return nodes
+
+
+async def run_retrieval(ks: list[int], gold_path):
+    from sparse_index import tokenize, hybrid_search
+    from config_state import HYBRID_CANDIDATES, RRF_K
+
+    nodes = await warm_up_index()
+    index = (await nodes.guideline_indexes())[0]
+    vector_store, sparse_index = index.vector_store, index.sparse_index
+    if sparse_index is None:
+        raise SystemExit("BM25 index not loaded; run with RETRIEVAL_MODE=hybrid")
+    questions = load_questions()
+    gold = load_gold(gold_path)
+    max_k = max(ks)
+
+    retrievers = {
+        "dense": lambda q, k: vector_store.asimilarity_search(q, k=k),
+        "bm25": lambda q, k: asyncio.to_thread(sparse_index.search, q, k),
+        "hybrid": lambda q, k: hybrid_search(vector_store, sparse_index, q, k=k, candidates=max(HYBRID_CANDIDATES, k), rrf_k=RRF_K),
+    }
+    header = " ".join(f"{'hit@' + str(k):>7}" for k in ks)
+    if gold:
+        header += " " + " ".join(f"{'R@' + str(k):>6}" for k in ks)
+    print(f"{'retriever':<8} {'p50':>8} {'p99':>8} {header}")
+    for name, retrieve in retrievers.items():
+        latencies = []
+        term_hits = {k: [] for k in ks}
+        recalls = {k: [] for k in ks}
+        for question in questions:
+            start = time.perf_counter()
+            docs = await retrieve(question, max_k)
+            latencies.append(time.perf_counter() - start)
+            terms = key_terms(question)
+            for k in ks:
+                top = docs[:k]
+                if terms:
+                    found = set(t for doc in top for t in tokenize(doc.page_content))
+                    term_hits[k].append(len(terms & found) / len(terms))
+                if question in gold:
+                    pages = {doc.metadata.get("page") for doc in top}
+                    recalls[k].append(len(gold[question] & pages) / len(gold[question]))
+        row = " ".join(f"{sum(term_hits[k]) / max(len(term_hits[k]), 1):7.2f}" for k in ks)
+        if gold:
+            row += " " + " ".join(f"{sum(recalls[k]) / max(len(recalls[k]), 1):6.2f}" for k in ks)
+        print(f"{name:<8} {percentile(latencies, 50) * 1000:6.1f}ms {percentile(latencies, 99) * 1000:6.1f}ms {row}")
+    print("hit@k: share of each question's exact terms (acronyms, numbers) found in the top-k chunks")
+    if gold:
+        print(f"R@k: recall of gold pages over {len([q for q in questions if q in gold])} questions with gold labels")
+    else:
+        print("No gold page list found (data/retrieval_gold.json); recall@k skipped")
+
+
+# --- coldstart: startup and first-query time with and without a prebuilt index ---
+
+async def run_coldstart_child():
+    """Runs in a fresh interpreter; prints one JSON line with the timings."""
+    start = time.perf_counter()
+    import main
+    from langchain_core.messages import HumanMessage
+    imported = time.perf_counter()
+    async with main.lifespan(main.app):
+        await main.wait_until_ready()
+        started = time.perf_counter()
+        main.answer_cache.enabled = False
+        await main.rag_app.ainvoke(
+            {'query': [HumanMessage(content=load_questions()[0])], 'guideline_path': main.GUIDELINE_PATH, 'compression': 'none'},
+            config={'configurable': {'thread_id': 'coldstart'}},
+        )
+        first = time.perf_counter()
+    print(json.dumps({
+        "import_s": imported - start,
+        "startup_s": started - imported,
+        "first_query_s": first - started,
+        "total_s": first - start,
+    }))
+
+
+def run_coldstart(index_dir: str, repeats: int):
+    import subprocess
+    import sys
+
+    scenarios = {"ingest on first query": "", "prebuilt index": index_dir}
+    print(f"{'scenario':<24} {'import':>8} {'startup':>8} {'1st query':>10} {'total':>8}")
+    for name, scenario_dir in scenarios.items():
+        runs = []
+        for _ in range(repeats):
+            env = dict(os.environ, INDEX_DIR=scenario_dir, STUB_LLM_LATENCY="0")
+            out = subprocess.run(
+                [sys.executable, __file__, "coldstart-child"],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r["total_s"])
+        print(f"{name:<24} {best['import_s']:7.2f}s {best['startup_s']:7.2f}s "
+              f"{best['first_query_s']:9.2f}s {best['total_s']:7.2f}s")
+    print(f"(best of {repeats}; stub LLM with zero latency, so the first query is ingest + retrieval only)")
+
+
+# --- startup: import-time profile of main.py and time until /health/live and /health/ready answer ---
+
+def run_startup(port: int, top: int, max_live_seconds: float, timeout: float) -> int:
+    import subprocess
+    import sys
+    import httpx
+    from startup_profile import import_profile
+
+    backend_dir = str(Path(__file__).resolve().parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [backend_dir, os.environ.get("PYTHONPATH")])))
+    failures = 0
+
+    total, packages, imported = import_profile(env)
+    print(f"import main: {total:.2f}s")
+    print(f"{'package':<28} {'self':>9}")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<28} {seconds * 1000:6.0f} ms")
+    if imported:
+        failures += 1
+        print(f"FAIL: imported at startup, should be lazy: {', '.join(imported)}")
+
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live_s = ready_s = None
+    ready = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while time.perf_counter() - start < timeout and ready_s is None:
+                if server.poll() is not None:
+                    break
+                try:
+                    if live_s is None:
+                        response = client.get("/health/live")
+                        if response.status_code == 200:
+                            live_s = time.perf_counter() - start
+                        elif response.json().get("status") == "failed":
+                            ready = client.get("/health/ready").json()
+                            break
+                    if live_s is not None:
+                        response = client.get("/health/ready")
+                        ready = response.json()
+                        if response.status_code == 200:
+                            ready_s = time.perf_counter() - start
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+
+    def seconds(value) -> str:
+        return f"{value:.2f}s" if value is not None else "never"
+
+    print(f"\nuvicorn main:app  live after {seconds(live_s)}  ready after {seconds(ready_s)}")
+    if ready.get("timings"):
+        print("warm-up: " + "  ".join(f"{name[:-2]} {value:.2f}s" for name, value in ready["timings"].items()))
+    if ready_s is None:
+        failures += 1
+        if ready.get("error"):
+            print(f"FAIL: startup failed: {ready['error']}")
+        else:
+            print(f"FAIL: not ready within {timeout:.0f}s ({ready.get('stage', 'server exited')})")
+    if max_live_seconds and (live_s is None or live_s > max_live_seconds):
+        failures += 1
+        print(f"FAIL: live after {seconds(live_s)}, budget {max_live_seconds:.2f}s")
+    return failures
+
+
+# --- vectorstore: Chroma vs the memory-mapped NumPy store ---
+
+def run_vectorstore_child(k: int, rounds: int):
+    """Runs in a fresh interpreter with VECTOR_BACKEND set; prints one JSON line."""
+    from config_state import INDEX_DIR, embedding_model
+    from index_store import load_index
+    from sparse_index import doc_key
+
+    questions = load_questions()
+    # Embed up front so only the vector search itself is timed
+    query_vectors = embedding_model.embed_documents(questions)
+    before = memory_status_mb()
+    start = time.perf_counter()
+    artifact = load_index(INDEX_DIR)
+    if artifact is None:
+        raise SystemExit(f"No index artifact in {INDEX_DIR!r}; run build_index.py first")
+    vector_store = artifact.guideline().vector_store
+    vector_store.similarity_search_by_vector(query_vectors[0], k=k)
+    load_s = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(rounds):
+        for vector in query_vectors:
+            t0 = time.perf_counter()
+            vector_store.similarity_search_by_vector(vector, k=k)
+            latencies.append(time.perf_counter() - t0)
+    after = memory_status_mb()
+    # Transient memory of one query: float16/int8 rows are converted to float32 while scoring
+    query_peaks = [peak_rss_growth_mb(lambda: vector_store.similarity_search_by_vector(v, k=k)) for v in query_vectors]
+    top_k = [[list(map(str, doc_key(d))) for d in vector_store.similarity_search_by_vector(v, k=k)] for v in query_vectors]
+    print(json.dumps({
+        "load_s": load_s,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rss_mb": after.get("VmRSS", float("nan")),
+        "rss_delta_mb": after.get("VmRSS", float("nan")) - before.get("VmRSS", float("nan")),
+        "anon_delta_mb": after.get("RssAnon", float("nan")) - before.get("RssAnon", float("nan")),
+        "file_delta_mb": after.get("RssFile", float("nan")) - before.get("RssFile", float("nan")),
+        "query_peak_mb": max(query_peaks, default=float("nan")),
+        "top_k": top_k,
+    }))
+
+
+def run_vectorstore(index_dir: str, k: int, rounds: int, dtypes: list[str]):
+    import subprocess
+    import sys
+
+    build_script = str(Path(__file__).resolve().with_name("build_index.py"))
+    scenarios = {"chroma": ("chroma", "float32")}
+    scenarios.update({f"numpy {dtype}": ("numpy", dtype) for dtype in dtypes})
+    results = {}
+    for name, (backend, dtype) in scenarios.items():
+        env = dict(os.environ, INDEX_DIR=index_dir, VECTOR_BACKEND=backend, VECTOR_DTYPE=dtype)
+        # The dtype is part of the artifact version; this reuses an existing artifact and points CURRENT at it
+        subprocess.run([sys.executable, build_script, "--index-dir", index_dir],
+                       env=env, capture_output=True, check=True)
+        out = subprocess.run(
+            [sys.executable, __file__, "vectorstore-child", "--k", str(k), "--rounds", str(rounds)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+    # Leave CURRENT pointing at the artifact for the configured dtype
+    subprocess.run([sys.executable, build_script, "--index-dir", index_dir], capture_output=True, check=True)
+
+    reference = results["chroma"]["top_k"]
+    print(f"{'backend':<16} {'load':>8} {'p50':>9} {'p99':>9} {'RSS':>8} {'+RSS':>8} {'+anon':>8} {'+file':>8} "
+          f"{'query':>8} {'overlap@' + str(k):>11}")
+    for name, r in results.items():
+        overlap = sum(len({tuple(d) for d in a} & {tuple(d) for d in b}) / max(len(a), 1)
+                      for a, b in zip(r["top_k"], reference)) / max(len(reference), 1)
+        print(f"{name:<16} {r['load_s']:7.2f}s {r['p50_ms']:6.2f} ms {r['p99_ms']:6.2f} ms "
+              f"{r['rss_mb']:5.0f} MB {r['rss_delta_mb']:5.1f} MB {r['anon_delta_mb']:5.1f} MB "
+              f"{r['file_delta_mb']:5.1f} MB {r['query_peak_mb']:5.1f} MB {overlap:10.1%}")
+    print("(+RSS/+anon/+file: growth from loading and querying the store in one worker; "
+          "file-backed pages of the mmap are shared between workers, anonymous ones are not. "
+          "query: largest RSS peak above the resting level during a single query)")
+
+
+# --- cds: CDS Hooks card cache and request coalescing on a synthetic census ---
+
+CONDITIONS = ["Heart failure", "Hypertension", "Type 2 diabetes mellitus", "Atrial fibrillation",
+              "Chronic kidney disease stage 3", "Hyperlipidemia", "Coronary artery disease"]
+MEDICATIONS = ["Sacubitril/valsartan 49/51 mg", "Carvedilol 25 mg", "Spironolactone 25 mg",
+               "Empagliflozin 10 mg", "Furosemide 40 mg", "Atorvastatin 40 mg", "Lisinopril 10 mg"]
+
+
+def synthetic_prefetch(rng) -> dict:
+    """A random patient-view prefetch (Patient, Condition and MedicationRequest bundles)."""
+    conditions = ["Heart failure"] + rng.sample(CONDITIONS[1:], rng.randint(0, 3))
+    medications = rng.sample(MEDICATIONS, rng.randint(0, 4))
+    return {
+        "patient": {
+            "resourceType": "Patient",
+            "gender": rng.choice(["male", "female"]),
+            "birthDate": f"{rng.randint(1935, 1990)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        },
+        "conditions": {"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Condition", "code": {"text": c}}} for c in conditions
+        ]},
+        "medications": {"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "MedicationRequest", "medicationCodeableConcept": {"text": m}}}
+            for m in medications
+        ]},
+    }
+
+
+async def run_cds(hooks: int, patients: int, concurrency: int, seed: int):
+    import random
+    import httpx
+    import main
+    from card_cache import card_cache
+    from fhir_profile import patient_profile
+
+    rng = random.Random(seed)
+    census = [synthetic_prefetch(rng) for _ in range(patients)]
+    profiles = {patient_profile(p["patient"], p["conditions"], p["medications"]).key for p in census}
+    # Charts get reopened: each hook picks a patient from the census
+    arrivals = [rng.choice(census) for _ in range(hooks)]
+    print(f"{hooks} hooks over {patients} patients ({len(profiles)} distinct profiles), concurrency {concurrency}")
+
+    async with main.lifespan(main.app):
+        await main.wait_until_ready()
+        main.answer_cache.enabled = False
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for enabled in (False, True):
+                card_cache.enabled = enabled
+                card_cache.invalidate()
+                before = card_cache.stats()
+                latencies = []
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def hook(i: int, prefetch: dict):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post("/cds-services/heart-failure-guideline", json={
+                            "hook": "patient-view", "hookInstance": f"bench-{enabled}-{i}",
+                            "context": {"patientId": f"p{i}"}, "prefetch": prefetch,
+                        })
+                        response.raise_for_status()
+                        latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                await asyncio.gather(*(hook(i, p) for i, p in enumerate(arrivals)))
+                wall = time.perf_counter() - start
+                stats = card_cache.stats()
+                runs = hooks if not enabled else (stats["misses"] - before["misses"]) + (stats["refreshes"] - before["refreshes"])
+                label = "card cache on" if enabled else "card cache off"
+                print_latencies(label, latencies)
+                print(f"{'':<24} graph runs={runs} hooks/s={hooks / wall:.1f}"
+                      + (f" hits={stats['hits']} coalesced={stats['coalesced']}" if enabled else ""))
+
+
+# --- batch: /bot/batch vs a sequential loop over /bot ---
+
+async def run_batch(concurrency: list[int], compression: str):
+    import httpx
+    import main
+
+    questions = load_questions()
+    async with main.lifespan(main.app):
+        await main.wait_until_ready()
+        # Every question should do the full work in both modes
+        main.answer_cache.enabled = False
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Warm-up so index loading is not measured
+            await client.post("/bot", json={"message": questions[0], "compression": compression})
+
+            latencies = []
+            start = time.perf_counter()
+            for question in questions:
+                t0 = time.perf_counter()
+                response = await client.post("/bot", json={"message": question, "compression": compression})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            sequential = time.perf_counter() - start
+            print(f"{len(questions)} questions, compression={compression}")
+            print(f"{'sequential /bot':<24} total={sequential:7.2f}s  {len(questions) / sequential:6.2f} q/s")
+            print_latencies("  per question", latencies)
+
+            for cap in concurrency:
+                start = time.perf_counter()
+                response = await client.post("/bot/batch", json={
+                    "messages": questions, "compression": compression, "max_concurrency": cap,
+                })
+                response.raise_for_status()
+                wall = time.perf_counter() - start
+                body = response.json()
+                timings = body["timings"]
+                errors = sum(1 for r in body["results"] if r.get("error"))
+                print(f"{'/bot/batch cap=' + str(cap):<24} total={wall:7.2f}s  {len(questions) / wall:6.2f} q/s  "
+                      f"speedup={sequential / wall:4.1f}x  errors={errors}")
+                print(f"{'':<24} embed={timings['embed_ms']:.0f} ms  intent={timings['intent_ms']:.0f} ms  "
+                      f"retrieval={timings['retrieval_ms']:.0f} ms  generation={timings['generation_ms']:.0f} ms")
+                print_latencies("  per item (done at)", [r["total_ms"] / 1000 for r in body["results"]])
+
+
+# --- context: prompt tokens saved by context packing at several budgets ---
+
+async def run_context(budgets: list[int], threshold: float):
+    from sparse_index import tokenize
+    from context_packing import pack_context
+    from config_state import RETRIEVAL_K
+
+    nodes = await warm_up_index()
+    indexes = await nodes.guideline_indexes()
+    questions = load_questions()
+    retrieved = []
+    for question in questions:
+        retrieved.append((question, await nodes.search_guidelines(indexes, question, RETRIEVAL_K)))
+
+    print(f"{len(questions)} questions, top {RETRIEVAL_K} chunks, dedup threshold {threshold}")
+    print(f"{'budget':>7} {'tokens in':>10} {'tokens out':>11} {'reduction':>10} {'merged':>7} "
+          f"{'dup sent':>9} {'cut':>5} {'pack p50':>9} {'term kept':>10}")
+    for budget in budgets:
+        rows, latencies, kept = [], [], []
+        for question, docs in retrieved:
+            start = time.perf_counter()
+            context, stats = pack_context(docs, budget=budget, threshold=threshold)
+            latencies.append(time.perf_counter() - start)
+            rows.append(stats)
+            # Share of the question's exact terms still present after packing, vs the naive join
+            terms = key_terms(question) & set(t for doc in docs for t in tokenize(doc.page_content))
+            if terms:
+                kept.append(len(terms & set(tokenize(context))) / len(terms))
+        n = len(rows)
+        tokens_in = sum(r["tokens_before"] for r in rows)
+        tokens_out = sum(r["tokens_after"] for r in rows)
+        print(
+            f"{budget or 'none':>7} {tokens_in / n:10.0f} {tokens_out / n:11.0f} "
+            f"{1 - tokens_out / tokens_in if tokens_in else 0.0:9.1%} "
+            f"{sum(r['merged_chunks'] for r in rows) / n:7.1f} {sum(r['duplicate_sentences'] for r in rows) / n:9.1f} "
+            f"{sum(r['truncated_blocks'] + r['skipped_blocks'] for r in rows) / n:5.1f} "
+            f"{percentile(latencies, 50) * 1000:7.1f}ms {sum(kept) / max(len(kept), 1):10.2f}"
+        )
+    print("tokens: estimated prompt tokens of the retrieved context (about 4 characters per token)")
+    print("cut: blocks truncated or left out by the budget; term kept: exact query terms still in the context")
+
+
+# --- parentchild: section-level parent-child index vs flat chunks with compression ---
+
+async def run_parentchild(gold_path, compression: str):
+    import subprocess
+    import sys
+    import tempfile
+    import shutil
+    from compression import compress_documents
+    from context_packing import pack_context
+    from index_store import load_index
+    from sparse_index import tokenize
+    import nodes
+
+    build_script = str(Path(__file__).resolve().with_name("build_index.py"))
+    workdir = Path(tempfile.mkdtemp(prefix="parentchild-bench-"))
+    questions = load_questions()
+    gold = load_gold(gold_path)
+    try:
+        scenarios = {}
+        for chunking in ("flat", "parent_child"):
+            index_dir = str(workdir / chunking)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, build_script, "--index-dir", index_dir],
+                           env=dict(os.environ, CHUNKING=chunking), capture_output=True, check=True)
+            build_s = time.perf_counter() - start
+            artifact = load_index(index_dir)
+            scenarios[chunking] = (artifact, build_s)
+
+        runs = [("flat", "none"), ("flat", compression), ("parent_child", "none")]
+        print(f"{len(questions)} questions; flat = top-k chunks, parent_child = sections of the top children")
+        print(f"{'index':<13} {'compression':<12} {'units':>9} {'retrieve':>9} {'compress':>9} {'LLM calls':>10} "
+              f"{'tokens':>7} {'term hit':>9} {'recall':>7}")
+        for chunking, mode in runs:
+            artifact, build_s = scenarios[chunking]
+            indexes = list(artifact.guidelines.values())
+            retrieve_s, compress_s, llm_calls, tokens, term_hits, recalls = [], [], 0, [], [], []
+            for question in questions:
+                start = time.perf_counter()
+                docs, _ = await nodes.retrieve_candidates(indexes, question)
+                retrieve_s.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                docs, stats = await compress_documents(docs, question, mode)
+                compress_s.append(time.perf_counter() - start)
+                llm_calls += stats["llm_calls"]
+                context, packed = pack_context(docs)
+                tokens.append(packed["tokens_after"])
+                terms = key_terms(question)
+                if terms:
+                    term_hits.append(len(terms & set(tokenize(context))) / len(terms))
+                if question in gold:
+                    # A section can span pages; it covers every page from its first to its last
+                    pages = {page for doc in docs
+                             for page in range(doc.metadata["page"], doc.metadata.get("end_page", doc.metadata["page"]) + 1)}
+                    recalls.append(len(gold[question] & pages) / len(gold[question]))
+            units = str(artifact.manifest["chunks"])
+            if chunking == "parent_child":
+                units += f"/{sum(len(index.parents) for index in indexes)}"
+            n = len(questions)
+            print(f"{chunking:<13} {mode:<12} {units:>9} {percentile(retrieve_s, 50) * 1000:7.1f}ms "
+                  f"{percentile(compress_s, 50) * 1000:7.1f}ms {llm_calls / n:10.1f} {sum(tokens) / n:7.0f} "
+                  f"{sum(term_hits) / max(len(term_hits), 1):9.2f} "
+                  f"{(f'{sum(recalls) / len(recalls):.2f}' if recalls else '-'):>7}")
+        print("build: " + ", ".join(f"{name} {build_s:.2f}s" for name, (_, build_s) in scenarios.items()))
+        print("units: indexed chunks (children/parents for parent_child); retrieve/compress: p50 per query;")
+        print("tokens: packed context tokens per query; term hit: exact query terms in the context; "
+              "recall: gold pages covered (with --gold)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- rerank: cross-encoder reranking of a wider pool vs LLM compression, end to end ---
+
+async def run_rerank_child(compression: str, gold_path):
+    """Runs in a fresh interpreter with the RERANK_* settings of one scenario; prints one JSON line."""
+    import main
+    from langchain_core.messages import HumanMessage
+    from reranker import reranker
+    from sparse_index import tokenize
+    from telemetry import LLM_CALLS
+
+    questions = load_questions()
+    gold = load_gold(gold_path)
+    async with main.lifespan(main.app):
+        await main.wait_until_ready()
+
+        async def ask(question: str, thread_id: str) -> dict:
+            return await main.rag_app.ainvoke(
+                {'query': [HumanMessage(content=question)], 'guideline_path': main.GUIDELINE_PATH, 'compression': compression},
+                config={'configurable': {'thread_id': thread_id}},
+            )
+
+        # Warm-up so index loading and the first forward pass are not measured
+        await ask(questions[0], "bench-rerank-warmup")
+        calls_before = sum(LLM_CALLS.values().values())
+        timeouts_before = reranker.timeouts
+        e2e, rerank_ms, tokens, term_hits, recalls = [], [], [], [], []
+        for i, question in enumerate(questions):
+            start = time.perf_counter()
+            result = await ask(question, f"bench-rerank-{i}")
+            e2e.append(time.perf_counter() - start)
+            if result.get('rerank_stats'):
+                rerank_ms.append(result['rerank_stats']['latency_ms'])
+            tokens.append((result.get('context_stats') or {}).get('tokens_after', 0))
+            terms = key_terms(question)
+            if terms:
+                term_hits.append(len(terms & set(tokenize(result.get('context') or ''))) / len(terms))
+            if question in gold:
+                pages = {page for doc in result['retrieved_docs']
+                         for page in range(doc.metadata["page"], doc.metadata.get("end_page", doc.metadata["page"]) + 1)}
+                recalls.append(len(gold[question] & pages) / len(gold[question]))
+    n = len(questions)
+    print(json.dumps({
+        "p50_ms": percentile(e2e, 50) * 1000,
+        "p99_ms": percentile(e2e, 99) * 1000,
+        "llm_calls": (sum(LLM_CALLS.values().values()) - calls_before) / n,
+        "tokens": sum(tokens) / n,
+        "term_hit": sum(term_hits) / max(len(term_hits), 1),
+        "recall": sum(recalls) / len(recalls) if recalls else None,
+        "rerank_p50_ms": percentile(rerank_ms, 50) if rerank_ms else None,
+        "fallback": (reranker.timeouts - timeouts_before) / len(rerank_ms) if rerank_ms else None,
+    }))
+
+
+def run_rerank(compression: str, budget_ms: float, gold_path):
+    import subprocess
+    import sys
+    from config_state import RERANK_BUDGET_MS, RERANK_CANDIDATES, RERANK_TOP_N, RETRIEVAL_K
+
+    budget_ms = RERANK_BUDGET_MS if budget_ms is None else budget_ms
+    scenarios = {
+        f"compression={compression}": {"RERANK_ENABLED": "false"},
+        f"rerank {budget_ms:g}ms budget": {"RERANK_ENABLED": "true", "RERANK_BUDGET_MS": str(budget_ms)},
+        # A budget no forward pass fits in: every query falls back to the retrieval order
+        "rerank 1ms budget": {"RERANK_ENABLED": "true", "RERANK_BUDGET_MS": "1"},
+    }
+    child_args = ["rerank-child", "--compression", compression] + (["--gold", gold_path] if gold_path else [])
+    print(f"{len(load_questions())} questions; compression runs on the top {RETRIEVAL_K}, "
+          f"the reranker keeps {RERANK_TOP_N} of the top {RERANK_CANDIDATES}")
+    print(f"{'scenario':<24} {'e2e p50':>9} {'e2e p99':>9} {'rerank p50':>11} {'fallback':>9} {'LLM calls':>10} "
+          f"{'tokens':>7} {'term hit':>9} {'recall':>7}")
+    for name, env in scenarios.items():
+        proc = subprocess.run([sys.executable, __file__, *child_args], env=dict(os.environ, **env),
+                              capture_output=True, text=True)
+        if proc.returncode:
+            print(f"{name:<24} skipped ({(proc.stderr.strip().splitlines() or ['failed'])[-1]})")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        rerank_p50 = f"{r['rerank_p50_ms']:9.1f}ms" if r["rerank_p50_ms"] is not None else f"{'-':>11}"
+        fallback = f"{r['fallback']:9.0%}" if r["fallback"] is not None else f"{'-':>9}"
+        recall = f"{r['recall']:.2f}" if r["recall"] is not None else "-"
+        print(f"{name:<24} {r['p50_ms']:7.0f}ms {r['p99_ms']:7.0f}ms {rerank_p50} {fallback} {r['llm_calls']:10.1f} "
+              f"{r['tokens']:7.0f} {r['term_hit']:9.2f} {recall:>7}")
+    print("LLM calls: per question, including intent and generation; tokens: packed context tokens per query;")
+    print("term hit: exact query terms in the context; recall: gold pages in the final excerpts (with --gold)")
+
+
+# --- speculative: retrieval alongside intent classification vs one after the other ---
+
+# Opening turn of every benchmark session; the timed question follows it, as in a chat
+SESSION_OPENER = "What are the stages of heart failure?"
+
+
+async def run_speculative(rounds: int, compression: str):
+    from langchain_core.messages import HumanMessage
+    from graph import build_rag_graph
+    from config_state import GUIDELINE_PATH, INTENT_CLASSIFIER, INTENT_LLM_ESCALATION, embedding_model
+
+    await warm_up_index()
+    labelled = [json.loads(line) for line in data_path("intent_queries.jsonl").read_text(encoding="utf-8").splitlines() if line.strip()]
+    graphs = {"sequential": build_rag_graph(speculative=False), "speculative": build_rag_graph(speculative=True)}
+    latencies = {name: {"medical": [], "general": []} for name in graphs}
+    discarded = 0
+    for r in range(rounds):
+        for i, item in enumerate(labelled):
+            # Alternate which graph goes first, and start each run with a cold query-embedding cache
+            order = list(graphs) if (r + i) % 2 == 0 else list(reversed(graphs))
+            for name in order:
+                # Past the first turn the retrieval query carries the history, so it needs its own embedding
+                config = {'configurable': {'thread_id': f'bench-{name}-{r}-{i}'}}
+                await graphs[name].ainvoke(
+                    {'query': [HumanMessage(content=SESSION_OPENER)], 'guideline_path': GUIDELINE_PATH, 'compression': 'none'},
+                    config=config,
+                )
+                embedding_model.clear()
+                start = time.perf_counter()
+                result = await graphs[name].ainvoke(
+                    {'query': [HumanMessage(content=item["query"])], 'guideline_path': GUIDELINE_PATH,
+                     'compression': compression},
+                    config=config,
+                )
+                latencies[name][item["intent"]].append(time.perf_counter() - start)
+                if name == "speculative" and result.get('intent') == 'general':
+                    discarded += 1
+
+    print(f"{len(labelled)} labelled queries x {rounds} rounds, each the second turn of a session; INTENT_CLASSIFIER={INTENT_CLASSIFIER} "
+          f"(LLM escalation {'on' if INTENT_LLM_ESCALATION else 'off'}), compression={compression}")
+    print(f"{'graph':<12} {'intent':<8} {'n':>4} {'e2e p50':>9} {'e2e p99':>9} {'mean':>9}")
+    for name, by_intent in latencies.items():
+        for intent, values in by_intent.items():
+            if values:
+                print(f"{name:<12} {intent:<8} {len(values):4d} {percentile(values, 50) * 1000:7.1f}ms "
+                      f"{percentile(values, 99) * 1000:7.1f}ms {sum(values) / len(values) * 1000:7.1f}ms")
+    for intent in ("medical", "general"):
+        before, after = latencies["sequential"][intent], latencies["speculative"][intent]
+        if before and after:
+            saved = (sum(before) / len(before) - sum(after) / len(after)) * 1000
+            print(f"mean saved on {intent} queries: {saved:.1f} ms")
+    print(f"speculative retrievals discarded (routed to general_query): {discarded}")
+
+
+# --- llm: the LLM gateway vs direct client calls against the fake Groq server ---
+
+def start_fake_llm_server(port: int, **options):
+    """Run fake_llm_server.py in a background thread; returns the uvicorn server."""
+    import threading
+    import uvicorn
+    from fake_llm_server import create_app
+
+    server = uvicorn.Server(uvicorn.Config(create_app(**options), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_llm(requests: int, rate: float, cds_share: float, rpm: int, tpm: int, latency: float,
+                  error_rate: float, port: int, seed: int):
+    import random
+    import httpx
+    from langchain_groq import ChatGroq
+    from langchain_core.messages import HumanMessage
+    from llm_gateway import LLMGateway, ModelPool, GatewayChatModel, llm_lane_var
+    from config_state import (
+        LLM_MODEL, LLM_FALLBACK_MODEL, LLM_POOL_SIZE, MAX_CONCURRENT_LLM_CALLS, LLM_MAX_RETRIES,
+        LLM_BACKOFF_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_MAX_QUEUE_SECONDS, LLM_HEDGE_MIN_SECONDS,
+    )
+
+    questions = load_questions()
+    rng = random.Random(seed)
+    # Poisson arrivals; a guideline-sized excerpt keeps token budgets in play
+    excerpt = " ".join(questions) * 2
+    workload, at = [], 0.0
+    for i in range(requests):
+        at += rng.expovariate(rate)
+        lane = "cds" if rng.random() < cds_share else "chat"
+        workload.append((at, lane, f"{excerpt}\n\nUser query: {questions[i % len(questions)]}"))
+
+    def groq(base_url: str, model: str, retries: int):
+        return ChatGroq(model=model, base_url=base_url, api_key="fake", temperature=0.3, max_retries=retries)
+
+    print(f"{requests} calls at {rate}/s ({cds_share:.0%} cds), fake server limits per model: "
+          f"{rpm} rpm / {tpm} tpm, latency {latency}s, error rate {error_rate:.0%}")
+    print(f"{'setup':<9} {'lane':<5} {'ok':>4} {'failed':>7} {'p50':>8} {'p95':>8} {'max':>8}")
+    for offset, setup in enumerate(("direct", "gateway")):
+        base_url = f"http://127.0.0.1:{port + offset}"
+        server = start_fake_llm_server(port + offset, rpm=rpm, tpm=tpm, latency=latency, error_rate=error_rate, seed=seed)
+        gateway = None
+        if setup == "direct":
+            # One client with the SDK's own retries behind a FIFO semaphore, as before the gateway
+            model = groq(base_url, LLM_MODEL, 2)
+            limit = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+        else:
+            pools = [ModelPool(LLM_MODEL, [groq(base_url, LLM_MODEL, 0) for _ in range(LLM_POOL_SIZE)], rpm=rpm, tpm=tpm)]
+            if LLM_FALLBACK_MODEL:
+                pools.append(ModelPool(LLM_FALLBACK_MODEL, [groq(base_url, LLM_FALLBACK_MODEL, 0) for _ in range(LLM_POOL_SIZE)],
+                                       rpm=rpm, tpm=tpm))
+            gateway = LLMGateway(pools, max_in_flight=MAX_CONCURRENT_LLM_CALLS, max_retries=LLM_MAX_RETRIES,
+                                 backoff_seconds=LLM_BACKOFF_SECONDS, backoff_max_seconds=LLM_BACKOFF_MAX_SECONDS,
+                                 max_queue_seconds=LLM_MAX_QUEUE_SECONDS, hedge_min_seconds=LLM_HEDGE_MIN_SECONDS)
+            model = GatewayChatModel(gateway=gateway)
+            limit = None
+
+        results = {"cds": [], "chat": []}
+        failures = {"cds": 0, "chat": 0}
+        start = time.perf_counter()
+
+        async def call(at: float, lane: str, prompt: str):
+            await asyncio.sleep(max(0.0, at - (time.perf_counter() - start)))
+            llm_lane_var.set(lane)
+            t0 = time.perf_counter()
+            try:
+                if limit is not None:
+                    async with limit:
+                        await model.ainvoke([HumanMessage(content=prompt)])
+                else:
+                    await model.ainvoke([HumanMessage(content=prompt)])
+                results[lane].append(time.perf_counter() - t0)
+            except Exception:
+                failures[lane] += 1
+
+        await asyncio.gather(*(call(*item) for item in workload))
+        wall = time.perf_counter() - start
+        for lane in ("cds", "chat"):
+            values = results[lane] or [0.0]
+            print(f"{setup:<9} {lane:<5} {len(results[lane]):4d} {failures[lane]:7d} {percentile(values, 50):7.2f}s "
+                  f"{percentile(values, 95):7.2f}s {max(values):7.2f}s")
+        async with httpx.AsyncClient() as client:
+            server_stats = (await client.get(f"{base_url}/stats")).json()
+        for name, counts in server_stats.items():
+            print(f"{'':<9} server {name}: {counts['requests']} requests, {counts['rate_limited']} rate limited, "
+                  f"{counts['errors']} errors")
+        if gateway is not None:
+            for pool in gateway.pools:
+                print(f"{'':<9} gateway {pool.name}: {pool.events}")
+        print(f"{'':<9} wall {wall:.1f}s")
+        server.should_exit = True
+
+
+# --- embeddings: PyTorch vs ONNX vs int8 ONNX, plus the query cache and micro-batching ---
+
+def run_embeddings_child(model_name: str, backend: str, int8_file: str, threads: int, rounds: int, concurrency: int):
+    """Runs in a fresh interpreter; loads one backend (without config_state) and prints one JSON line."""
+    from concurrent.futures import ThreadPoolExecutor
+    from embeddings import CachedEmbeddings, load_embeddings
+
+    questions = load_questions()
+    before = current_rss_mb()
+    start = time.perf_counter()
+    model = load_embeddings(model_name, backend, threads, int8_file)
+    vectors = model.embed_documents(questions)
+    load_s = time.perf_counter() - start
+
+    single = []
+    for _ in range(rounds):
+        for question in questions:
+            t0 = time.perf_counter()
+            model.embed_query(question)
+            single.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    model.embed_documents(questions)
+    batch_ms_per_query = (time.perf_counter() - t0) / len(questions) * 1000
+
+    # The same questions from `concurrency` threads at once, as concurrent requests would send them
+    concurrent = {}
+    for wait_ms in (0.0, 2.0):
+        embedder = CachedEmbeddings(model, cache_size=0, batch_wait_ms=wait_ms)
+        with ThreadPoolExecutor(concurrency) as pool:
+            t0 = time.perf_counter()
+            list(pool.map(embedder.embed_query, questions * rounds))
+            wall = time.perf_counter() - t0
+        concurrent[str(wait_ms)] = {"qps": len(questions) * rounds / wall, **embedder.stats()}
+
+    cached = CachedEmbeddings(model, cache_size=len(questions), batch_wait_ms=0)
+    for question in questions:
+        cached.embed_query(question)
+    hits = []
+    for question in questions:
+        t0 = time.perf_counter()
+        cached.embed_query(question)
+        hits.append(time.perf_counter() - t0)
+
+    print(json.dumps({
+        "load_s": load_s,
+        "rss_mb": current_rss_mb() - before,
+        "p50_ms": percentile(single, 50) * 1000,
+        "p99_ms": percentile(single, 99) * 1000,
+        "batch_ms_per_query": batch_ms_per_query,
+        "cache_hit_us": percentile(hits, 50) * 1e6,
+        "concurrent": concurrent,
+        "vectors": vectors,
+    }))
+
+
+def run_embeddings(backends: list[str], index_dir: str, k: int, threads: int, rounds: int, concurrency: int):
+    import subprocess
+    import sys
+    import numpy as np
+    from config_state import EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_INT8_FILE
+
+    results = {}
+    for backend in backends:
+        proc = subprocess.run(
+            [sys.executable, __file__, "embeddings-child", "--model", EMBEDDING_MODEL_NAME, "--backend", backend,
+             "--int8-file", EMBEDDING_ONNX_INT8_FILE, "--threads", str(threads),
+             "--rounds", str(rounds), "--concurrency", str(concurrency)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode:
+            print(f"{backend}: skipped ({(proc.stderr.strip().splitlines() or ['failed'])[-1]})")
+            continue
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+    if not results:
+        return
+
+    # Top-k against the prebuilt index, which was embedded with whatever backend built it
+    from index_store import load_index
+    from sparse_index import doc_key
+    artifact = load_index(index_dir)
+    reference_name = "torch" if "torch" in results else next(iter(results))
+    reference = np.asarray(results[reference_name]["vectors"], dtype=np.float32)
+
+    def top_k(vectors) -> list[list]:
+        if artifact is None:
+            return []
+        return [[doc_key(d) for d in artifact.guideline().vector_store.similarity_search_by_vector(list(map(float, v)), k=k)]
+                for v in vectors]
+
+    reference_top = top_k(reference)
+    print(f"{'backend':<10} {'load':>7} {'+RSS':>8} {'p50':>9} {'p99':>9} {'batched':>9} "
+          f"{'min cos':>8} {'same top-' + str(k):>11} {'overlap':>8}")
+    for name, r in results.items():
+        vectors = np.asarray(r["vectors"], dtype=np.float32)
+        cosine = float((vectors * reference).sum(axis=1).min())
+        tops = top_k(vectors)
+        same = sum(a == b for a, b in zip(tops, reference_top)) / len(tops) if tops else float("nan")
+        overlap = (sum(len(set(a) & set(b)) / k for a, b in zip(tops, reference_top)) / len(tops)
+                   if tops else float("nan"))
+        print(f"{name:<10} {r['load_s']:6.2f}s {r['rss_mb']:5.0f} MB {r['p50_ms']:6.2f} ms {r['p99_ms']:6.2f} ms "
+              f"{r['batch_ms_per_query']:6.2f} ms {cosine:8.4f} {same:11.1%} {overlap:8.1%}")
+    if artifact is None:
+        print(f"(no index artifact in {index_dir!r}, so top-k agreement was skipped; run build_index.py first)")
+    print(f"p50/p99: one embed_query at a time; batched: per query within one embed_documents call. "
+          f"min cos and top-{k} are against {reference_name}")
+
+    print(f"\n{concurrency} threads embedding concurrently:")
+    for name, r in results.items():
+        off, on = r["concurrent"]["0.0"], r["concurrent"]["2.0"]
+        print(f"{name:<10} no batching {off['qps']:7.1f} q/s   2 ms micro-batching {on['qps']:7.1f} q/s "
+              f"(mean batch {on['mean_batch']})   LRU hit {r['cache_hit_us']:.1f} us")
+
+
+# --- ingest: incremental re-index after a one-page edit vs a full rebuild ---
+
+def run_ingest(page: int, subset_pages: int):
+    import shutil
+    import tempfile
+    import fitz
+    from config_state import GUIDELINE_PATH
+    from index_store import build_index, load_index
+
+    source = Path(GUIDELINE_PATH) if Path(GUIDELINE_PATH).exists() else data_path(Path(GUIDELINE_PATH).name)
+    workdir = Path(tempfile.mkdtemp(prefix="ingest-bench-"))
+    try:
+        pdf = workdir / "guideline.pdf"
+        shutil.copy(source, pdf)
+        index_dir = str(workdir / "index")
+        rows, versions = [], []
+
+        def build(label: str, guidelines: dict, force: bool = False):
+            start = time.perf_counter()
+            manifest = build_index(guidelines, index_dir, force=force)
+            seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            artifact = load_index(index_dir)
+            load_s = time.perf_counter() - start
+            # An unchanged build returns the existing artifact's manifest: nothing was parsed or embedded
+            reused = bool(rows) and manifest["version"] == versions[-1]
+            versions.append(manifest["version"])
+            pages_changed = 0 if reused else sum(r["pages_changed"] for r in manifest["guidelines"].values())
+            rows.append((label, seconds, load_s, pages_changed, manifest["chunks"],
+                         0 if reused else manifest["chunks_embedded"]))
+            return artifact
+
+        build("full rebuild", {"hf": str(pdf)}, force=True)
+        build("unchanged", {"hf": str(pdf)})
+
+        # Edit one page: a new paragraph changes that page's text and so its chunks
+        doc = fitz.open(pdf)
+        page = min(page, len(doc) - 1)
+        doc[page].insert_text((72, 72), "Updated recommendation: reassess volume status at every visit.", fontsize=8)
+        edited = workdir / "guideline-edited.pdf"
+        doc.save(edited)
+        doc.close()
+        edited.replace(pdf)
+        build(f"edit page {page + 1}", {"hf": str(pdf)})
+
+        # A second guideline that repeats pages of the first: its chunks are deduplicated by content hash
+        doc = fitz.open(pdf)
+        doc.select(list(range(min(subset_pages, len(doc)))))
+        subset = workdir / "excerpt.pdf"
+        doc.save(subset)
+        doc.close()
+        artifact = build(f"add {subset_pages}-page guideline", {"hf": str(pdf), "excerpt": str(subset)})
+
+        full_s = rows[0][1]
+        print(f"{'build':<26} {'time':>8} {'speedup':>8} {'load':>8} {'pages chg':>10} {'chunks':>7} {'embedded':>9}")
+        for label, seconds, load_s, pages_changed, chunks, embedded in rows:
+            print(f"{label:<26} {seconds:7.2f}s {full_s / seconds:7.1f}x {load_s * 1000:6.0f}ms "
+                  f"{pages_changed:>10} {chunks:>7} {embedded:>9}")
+        print(f"guidelines in the final artifact: {', '.join(artifact.guidelines)}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- suite: end-to-end regression run written to JSON, and compare for diffing two runs ---
+
+def latency_summary(values: list[float]) -> dict:
+    """p50/p95/p99/mean of latencies in seconds, reported in ms."""
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1),
+    }
+
+
+def run_metadata() -> dict:
+    import platform
+    import subprocess
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_settings() -> dict:
+    """Settings that change what the suite measures, so two reports can be told apart."""
+    import config_state
+    names = (
+        "LLM_PROVIDER", "CHUNK_SIZE", "CHUNK_OVERLAP", "RETRIEVAL_MODE", "RETRIEVAL_K", "HYBRID_CANDIDATES",
+        "RRF_K", "COMPRESSION_MODE", "CONTEXT_PACKING", "CONTEXT_TOKEN_BUDGET", "CONTEXT_DEDUP_THRESHOLD",
+        "INTENT_CLASSIFIER", "VECTOR_BACKEND", "VECTOR_DTYPE", "HISTORY_WINDOW", "MAX_CONCURRENT_LLM_CALLS",
+        "EMBEDDING_BACKEND", "EMBEDDING_THREADS", "EMBEDDING_CACHE_SIZE", "EMBEDDING_BATCH_WAIT_MS", "GUIDELINES",
+        "CHUNKING", "CHILD_CANDIDATES", "PARENT_K", "RERANK_ENABLED", "RERANKER_MODEL", "RERANK_CANDIDATES",
+        "RERANK_TOP_N", "RERANK_BUDGET_MS", "SPECULATIVE_RETRIEVAL",
+    )
+    settings = {name: getattr(config_state, name, None) for name in names}
+    settings["STUB_LLM_LATENCY"] = os.environ.get("STUB_LLM_LATENCY", "0.5")
+    settings["EMBEDDING_MODEL"] = config_state.EMBEDDING_MODEL_NAME
+    return settings
+
+
+async def run_suite(output: str, concurrency: list[int], hooks: int, patients: int, census_path, gold_path,
+                    hook_concurrency: int, seed: int):
+    import hashlib
+    import random
+    import resource
+    import httpx
+    import main
+    from langchain_core.messages import HumanMessage
+    from card_cache import card_cache
+    from card_store import card_store
+    from fhir_profile import patient_profile
+    from sparse_index import tokenize
+    from telemetry import LLM_CALLS, LLM_TOKENS, node_listeners
+    from config_state import GUIDELINE_PATH, RETRIEVAL_K
+    import nodes
+
+    questions = load_questions()
+    gold = load_gold(gold_path)
+    report = {"meta": run_metadata(), "settings": run_settings()}
+    rss_start = current_rss_mb()
+
+    def chat_input(question: str, thread: str) -> tuple[dict, dict]:
+        state = {'query': [HumanMessage(content=question)], 'guideline_path': GUIDELINE_PATH}
+        return state, {'configurable': {'thread_id': thread}}
+
+    def llm_usage() -> tuple[float, float, float]:
+        tokens = LLM_TOKENS.values()
+        return (sum(LLM_CALLS.values().values()),
+                sum(v for (node, kind), v in tokens.items() if kind == "prompt"),
+                sum(v for (node, kind), v in tokens.items() if kind == "completion"))
+
+    started = time.perf_counter()
+    async with main.lifespan(main.app):
+        await main.wait_until_ready()
+        report["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        # Every question should run the whole graph, and hooks shouldn't depend on what the card store holds
+        main.answer_cache.enabled = False
+        card_store.path = ""
+        card_store.open(card_store.index_version)
+        rag_app = main.rag_app
+        await rag_app.ainvoke(*chat_input(questions[0], "suite-warmup"))
+
+        # Sequential pass: end-to-end and per-node latency and LLM usage per question
+        node_seconds: dict[str, list[float]] = {}
+        listener = lambda node, seconds: node_seconds.setdefault(node, []).append(seconds)
+        node_listeners.append(listener)
+        usage_before = llm_usage()
+        latencies, answers = [], []
+        for i, question in enumerate(questions):
+            start = time.perf_counter()
+            result = await rag_app.ainvoke(*chat_input(question, f"suite-seq-{i}"))
+            latencies.append(time.perf_counter() - start)
+            answers.append(result['messages'][-1].content)
+        node_listeners.remove(listener)
+        usage = [after - before for after, before in zip(llm_usage(), usage_before)]
+        n = len(questions)
+        report["chat"] = {
+            "questions": n,
+            "e2e": latency_summary(latencies),
+            "nodes": {node: latency_summary(values) for node, values in sorted(node_seconds.items())},
+            "llm_calls_per_question": round(usage[0] / n, 2),
+            "prompt_tokens_per_question": round(usage[1] / n, 1),
+            "completion_tokens_per_question": round(usage[2] / n, 1),
+            # Changes whenever retrieval, packing or the prompt change what the stub model is sent
+            "answers_digest": hashlib.sha1("\n".join(answers).encode()).hexdigest()[:12],
+        }
+
+        # Retrieval quality of the chunks handed to compression, as retrieve_documents fetches them
+        indexes = await nodes.guideline_indexes()
+        term_hits, gold_hits, gold_recall = [], [], []
+        for question in questions:
+            docs = await nodes.search_guidelines(indexes, question, RETRIEVAL_K)
+            terms = key_terms(question)
+            if terms:
+                found = set(t for doc in docs for t in tokenize(doc.page_content))
+                term_hits.append(len(terms & found) / len(terms))
+            if question in gold:
+                pages = {doc.metadata.get("page") for doc in docs}
+                gold_hits.append(1.0 if gold[question] & pages else 0.0)
+                gold_recall.append(len(gold[question] & pages) / len(gold[question]))
+        report["retrieval"] = {
+            "k": RETRIEVAL_K,
+            "term_hit_rate": round(sum(term_hits) / len(term_hits), 3) if term_hits else None,
+            "gold_questions": len(gold_hits),
+            "gold_hit_rate": round(sum(gold_hits) / len(gold_hits), 3) if gold_hits else None,
+            "gold_recall": round(sum(gold_recall) / len(gold_recall), 3) if gold_recall else None,
+        }
+
+        # Throughput: the question set sent with N graph runs in flight
+        report["concurrency"] = {}
+        for level in concurrency:
+            limit = asyncio.Semaphore(level)
+            run_latencies, errors = [], 0
+
+            async def ask(i: int, question: str):
+                nonlocal errors
+                async with limit:
+                    start = time.perf_counter()
+                    try:
+                        await rag_app.ainvoke(*chat_input(question, f"suite-c{level}-{i}"))
+                        run_latencies.append(time.perf_counter() - start)
+                    except Exception:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(ask(i, q) for i, q in enumerate(questions)))
+            wall = time.perf_counter() - start
+            report["concurrency"][str(level)] = {
+                "questions_per_s": round(n / wall, 2),
+                "errors": errors,
+                **latency_summary(run_latencies),
+            }
+
+        # CDS hooks on synthetic (or supplied) prefetch payloads, without and with the card cache
+        if census_path:
+            from precompute_cards import read_census
+            census = read_census(census_path)
+        else:
+            rng = random.Random(seed)
+            census = [synthetic_prefetch(rng) for _ in range(patients)]
+        rng = random.Random(seed + 1)
+        arrivals = [rng.choice(census) for _ in range(hooks)]
+        profiles = {patient_profile(p["patient"], p.get("conditions"), p.get("medications")).key for p in census}
+        report["cds"] = {"hooks": hooks, "patients": len(census), "profiles": len(profiles)}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://suite", timeout=None) as client:
+            for enabled in (False, True):
+                card_cache.enabled = enabled
+                card_cache.invalidate()
+                hook_latencies, errors = [], 0
+                limit = asyncio.Semaphore(hook_concurrency)
+
+                async def hook(i: int, prefetch: dict):
+                    nonlocal errors
+                    async with limit:
+                        start = time.perf_counter()
+                        response = await client.post("/cds-services/heart-failure-guideline", json={
+                            "hook": "patient-view", "hookInstance": f"suite-{enabled}-{i}",
+                            "context": {"patientId": f"p{i}"}, "prefetch": prefetch,
+                        })
+                        if response.status_code == 200:
+                            hook_latencies.append(time.perf_counter() - start)
+                        else:
+                            errors += 1
+
+                start = time.perf_counter()
+                await asyncio.gather(*(hook(i, p) for i, p in enumerate(arrivals)))
+                wall = time.perf_counter() - start
+                report["cds"]["card_cache_on" if enabled else "card_cache_off"] = {
+                    "hooks_per_s": round(hooks / wall, 2),
+                    "errors": errors,
+                    **latency_summary(hook_latencies),
+                }
+
+    # ru_maxrss is in KB on Linux
+    report["memory"] = {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_end_mb": round(current_rss_mb(), 1),
+    }
+    report["total_s"] = round(time.perf_counter() - started, 1)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+        print(f"Wrote {output}")
+    print(text)
+
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        else:
+            values[name] = value
+    return values
+
+
+def better_direction(name: str) -> int:
+    """+1 if a bigger value is better, -1 if smaller is better, 0 if it is just informational."""
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.endswith("_per_s") or "hit_rate" in leaf or leaf.endswith("recall"):
+        return 1
+    if leaf.endswith(("_ms", "_mb")) or leaf.startswith(("llm_calls", "prompt_tokens", "completion_tokens")) \
+            or leaf == "errors":
+        return -1
+    return 0
+
+
+def run_compare(baseline: str, candidate: str, tolerance: float, min_delta: float, show_all: bool) -> int:
+    """
+    Print the metrics of two suite reports side by side and flag the ones
+    that got worse by more than `tolerance` (relative) and, for ms/MB
+    values, more than `min_delta` (absolute). Returns the number of regressions.
+    """
+    old = flatten(json.loads(Path(baseline).read_text(encoding="utf-8")))
+    new = flatten(json.loads(Path(candidate).read_text(encoding="utf-8")))
+    print(f"{'metric':<48} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    regressions = 0
+    for name in sorted(set(old) | set(new)):
+        if name.startswith("meta."):
+            continue
+        a, b = old.get(name), new.get(name)
+        numeric = isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool)
+        change, flag = "", ""
+        if numeric and a != b:
+            change = f"{(b - a) / abs(a):+.1%}" if a else "new"
+            direction = better_direction(name)
+            worse = (b - a) * direction < 0
+            # Sub-millisecond jitter on fast nodes is not a regression
+            noise = name.endswith(("_ms", "_mb")) and abs(b - a) < min_delta
+            if direction and worse and not noise and (not a or abs(b - a) / abs(a) > tolerance):
+                flag = "  REGRESSION"
+                regressions += 1
+        elif not numeric and a != b:
+            change = "changed"
+        if show_all or change:
+            print(f"{name:<48} {str(a):>12} {str(b):>12} {change:>8}{flag}")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=None,
+                        help="seconds the stub LLM sleeps per call (sets STUB_LLM_LATENCY)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="p50/p99 latency of /bot with N concurrent clients")
+    load.add_argument("--clients", type=int, default=16)
+    load.add_argument("--requests", type=int, default=4, help="requests per client")
+    load.add_argument("--cache", action="store_true", help="keep the semantic answer cache enabled")
+
+    compression = commands.add_parser("compression", help="compare the llm / embedding / none compression modes")
+    compression.add_argument("--modes", nargs="+", default=["llm", "embedding", "none"],
+                             choices=["llm", "embedding", "none"])
+
+    commands.add_parser("cache", help="answer cache hit rate and latency on reworded questions")
+
+    commands.add_parser("intent", help="accuracy/latency of the local intent router vs the LLM classifier")
+
+    soak = commands.add_parser("soak", help="checkpointer size and RSS over many sessions and turns")
+    soak.add_argument("--requests", type=int, default=5000)
+    soak.add_argument("--sessions", type=int, default=500)
+    soak.add_argument("--report-every", type=int, default=500)
+
+    commands.add_parser("stream", help="time to first token of /bot/stream vs /bot latency")
+
+    retrieval = commands.add_parser("retrieval", help="recall@k and latency of dense, BM25 and hybrid retrieval")
+    retrieval.add_argument("--k", type=int, nargs="+", default=[3, 5, 7, 10])
+    retrieval.add_argument("--gold", default=None, help="JSON file mapping question -> relevant page numbers")
+
+    coldstart = commands.add_parser("coldstart", help="startup + first query time with and without a prebuilt index")
+    coldstart.add_argument("--index-dir", default="index", help="artifact directory written by build_index.py")
+    coldstart.add_argument("--repeats", type=int, default=3)
+    commands.add_parser("coldstart-child")
+
+    startup = commands.add_parser("startup", help="import-time profile and time until /health/live and /health/ready")
+    startup.add_argument("--port", type=int, default=8765)
+    startup.add_argument("--top", type=int, default=15, help="packages listed by import self-time")
+    startup.add_argument("--max-live-seconds", type=float, default=0.0,
+                         help="fail if the server takes longer to answer /health/live (0 = no check)")
+    startup.add_argument("--timeout", type=float, default=300.0, help="give up waiting for /health/ready after this")
+
+    vectorstore = commands.add_parser("vectorstore", help="load time, query latency and RSS of Chroma vs the NumPy store")
+    vectorstore.add_argument("--index-dir", default="index", help="artifact directory written by build_index.py")
+    vectorstore.add_argument("--k", type=int, default=20)
+    vectorstore.add_argument("--rounds", type=int, default=20, help="passes over the question set")
+    vectorstore.add_argument("--dtypes", nargs="+", default=["float32", "float16", "int8"],
+                             choices=["float32", "float16", "int8"])
+    vectorstore_child = commands.add_parser("vectorstore-child")
+    vectorstore_child.add_argument("--k", type=int, default=20)
+    vectorstore_child.add_argument("--rounds", type=int, default=20)
+
+    cds = commands.add_parser("cds", help="CDS hook latency and graph runs with and without the card cache")
+    cds.add_argument("--hooks", type=int, default=200)
+    cds.add_argument("--patients", type=int, default=60, help="size of the synthetic census hooks are drawn from")
+    cds.add_argument("--concurrency", type=int, default=16)
+    cds.add_argument("--seed", type=int, default=7)
+
+    batch = commands.add_parser("batch", help="throughput of /bot/batch vs a sequential loop over /bot")
+    batch.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="max_concurrency values to try")
+    batch.add_argument("--compression", default="none", choices=["llm", "embedding", "none"])
+
+    context = commands.add_parser("context", help="prompt tokens saved by overlap merging, dedup and the token budget")
+    context.add_argument("--budgets", type=int, nargs="+", default=[0, 1500, 1000, 500], help="0 means no budget")
+    context.add_argument("--threshold", type=float, default=None, help="sentence dedup threshold (default CONTEXT_DEDUP_THRESHOLD)")
+
+    parentchild = commands.add_parser("parentchild", help="parent-child section index vs flat chunks with compression")
+    parentchild.add_argument("--gold", default=None, help="JSON file mapping question -> relevant page numbers")
+    parentchild.add_argument("--compression", default="llm", choices=["llm", "embedding"],
+                             help="compression applied to the flat chunks")
+
+    rerank = commands.add_parser("rerank", help="cross-encoder reranking vs LLM compression, end to end")
+    rerank.add_argument("--compression", default="llm", choices=["llm", "embedding", "none"],
+                        help="compression of the path without the reranker")
+    rerank.add_argument("--budget-ms", type=float, default=None, help="reranker time budget (default RERANK_BUDGET_MS)")
+    rerank.add_argument("--gold", default=None, help="JSON file mapping question -> relevant page numbers")
+    rerank_child = commands.add_parser("rerank-child")
+    rerank_child.add_argument("--compression", default="llm")
+    rerank_child.add_argument("--gold", default=None)
+
+    speculative = commands.add_parser("speculative", help="retrieval started alongside intent classification vs after it")
+    speculative.add_argument("--rounds", type=int, default=3, help="passes over data/intent_queries.jsonl")
+    speculative.add_argument("--compression", default="none", choices=["llm", "embedding", "none"])
+
+    llm = commands.add_parser("llm", help="LLM gateway vs direct client calls against a rate-limited fake Groq server")
+    llm.add_argument("--requests", type=int, default=60)
+    llm.add_argument("--rate", type=float, default=2.0, help="calls per second (Poisson arrivals)")
+    llm.add_argument("--cds-share", type=float, default=0.25, help="share of calls in the cds lane")
+    llm.add_argument("--rpm", type=int, default=30, help="fake server requests per minute per model")
+    llm.add_argument("--tpm", type=int, default=60000, help="fake server tokens per minute per model")
+    llm.add_argument("--latency", type=float, default=0.4, help="fake server seconds per call")
+    llm.add_argument("--error-rate", type=float, default=0.02, help="share of calls the fake server fails with 503")
+    llm.add_argument("--port", type=int, default=8900, help="first of two local ports for the fake server")
+    llm.add_argument("--seed", type=int, default=7)
+
+    embeddings = commands.add_parser("embeddings", help="latency, RSS and top-k agreement of the embedding backends")
+    embeddings.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"],
+                            choices=["torch", "onnx", "onnx-int8"])
+    embeddings.add_argument("--index-dir", default="index", help="artifact directory written by build_index.py")
+    embeddings.add_argument("--k", type=int, default=5)
+    embeddings.add_argument("--threads", type=int, default=0, help="inference threads (0 = library default)")
+    embeddings.add_argument("--rounds", type=int, default=5, help="passes over the question set")
+    embeddings.add_argument("--concurrency", type=int, default=8, help="threads embedding queries at once")
+    embeddings_child = commands.add_parser("embeddings-child")
+    embeddings_child.add_argument("--model", required=True)
+    embeddings_child.add_argument("--backend", default="torch")
+    embeddings_child.add_argument("--int8-file", default=None)
+    embeddings_child.add_argument("--threads", type=int, default=0)
+    embeddings_child.add_argument("--rounds", type=int, default=5)
+    embeddings_child.add_argument("--concurrency", type=int, default=8)
+
+    ingest = commands.add_parser("ingest", help="incremental re-index time after a one-page edit vs a full rebuild")
+    ingest.add_argument("--page", type=int, default=10, help="0-based page of the guideline to edit")
+    ingest.add_argument("--subset-pages", type=int, default=5, help="pages copied into the added guideline")
+
+    suite = commands.add_parser("suite", help="end-to-end regression run: latency, throughput, RSS, hit rate -> JSON")
+    suite.add_argument("--output", default=None, help="JSON file to write the report to")
+    suite.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="graph runs in flight")
+    suite.add_argument("--hooks", type=int, default=100, help="CDS hooks to send")
+    suite.add_argument("--patients", type=int, default=40, help="size of the synthetic census hooks are drawn from")
+    suite.add_argument("--census", default=None, help="prefetch bundles to use instead (precompute_cards.py format)")
+    suite.add_argument("--hook-concurrency", type=int, default=8)
+    suite.add_argument("--gold", default=None, help="JSON file mapping question -> relevant page numbers")
+    suite.add_argument("--seed", type=int, default=7)
+
+    compare = commands.add_parser("compare", help="diff two suite reports and flag regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--tolerance", type=float, default=0.10, help="relative change tolerated before flagging")
+    compare.add_argument("--min-delta", type=float, default=5.0, help="smallest ms/MB change that can be flagged")
+    compare.add_argument("--all", action="store_true", help="also list unchanged metrics")
+
+    args = parser.parse_args()
+    if args.llm_latency is not None:
+        os.environ["STUB_LLM_LATENCY"] = str(args.llm_latency)
+
+    if args.command == "load":
+        asyncio.run(run_load(args.clients, args.requests, args.cache))
+    elif args.command == "compression":
+        asyncio.run(run_compression(args.modes))
+    elif args.command == "cache":
+        asyncio.run(run_cache())
+    elif args.command == "intent":
+        asyncio.run(run_intent())
+    elif args.command == "soak":
+        asyncio.run(run_soak(args.requests, args.sessions, args.report_every))
+    elif args.command == "stream":
+        asyncio.run(run_stream())
+    elif args.command == "retrieval":
+        asyncio.run(run_retrieval(args.k, args.gold))
+    elif args.command == "coldstart":
+        run_coldstart(args.index_dir, args.repeats)
+    elif args.command == "coldstart-child":
+        asyncio.run(run_coldstart_child())
+    elif args.command == "startup":
+        raise SystemExit(1 if run_startup(args.port, args.top, args.max_live_seconds, args.timeout) else 0)
+    elif args.command == "vectorstore":
+        run_vectorstore(args.index_dir, args.k, args.rounds, args.dtypes)
+    elif args.command == "vectorstore-child":
+        run_vectorstore_child(args.k, args.rounds)
+    elif args.command == "cds":
+        asyncio.run(run_cds(args.hooks, args.patients, args.concurrency, args.seed))
+    elif args.command == "batch":
+        asyncio.run(run_batch(args.concurrency, args.compression))
+    elif args.command == "context":
+        from config_state import CONTEXT_DEDUP_THRESHOLD
+        threshold = args.threshold if args.threshold is not None else CONTEXT_DEDUP_THRESHOLD
+        asyncio.run(run_context(args.budgets, threshold))
+    elif args.command == "parentchild":
+        asyncio.run(run_parentchild(args.gold, args.compression))
+    elif args.command == "rerank":
+        run_rerank(args.compression, args.budget_ms, args.gold)
+    elif args.command == "rerank-child":
+        asyncio.run(run_rerank_child(args.compression, args.gold))
+    elif args.command == "speculative":
+        asyncio.run(run_speculative(args.rounds, args.compression))
+    elif args.command == "llm":
+        asyncio.run(run_llm(args.requests, args.rate, args.cds_share, args.rpm, args.tpm, args.latency,
+                            args.error_rate, args.port, args.seed))
+    elif args.command == "embeddings":
+        run_embeddings(args.backends, args.index_dir, args.k, args.threads, args.rounds, args.concurrency)
+    elif args.command == "embeddings-child":
+        run_embeddings_child(args.model, args.backend, args.int8_file, args.threads, args.rounds, args.concurrency)
+    elif args.command == "ingest":
+        run_ingest(args.page, args.subset_pages)
+    elif args.command == "suite":
+        asyncio.run(run_suite(args.output, args.concurrency, args.hooks, args.patients, args.census, args.gold,
+                              args.hook_concurrency, args.seed))
+    elif args.command == "compare":
+        raise SystemExit(1 if run_compare(args.baseline, args.candidate, args.tolerance, args.min_delta, args.all) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Build the guideline index offline.
+
+Parses each guideline PDF, splits it into chunks, embeds them and writes a
+versioned artifact to <index-dir>/<version>/ (per guideline: its own Chroma
+collection, NumPy matrix and BM25 index; plus manifest.json), then points
+<index-dir>/CURRENT at it. The version is a content hash of the PDFs, the
+splitter settings and the embedding model, so rebuilding unchanged
+guidelines is a no-op. Builds are incremental: unchanged guidelines are
+copied from the current artifact and only chunks with new text are
+embedded. Running servers hot-swap to the new version (INDEX_RELOAD_SECONDS).
+
+    python build_index.py --index-dir index
+    python build_index.py --guideline hf=data/HF_Guideline.pdf --guideline af=data/AF_Guideline.pdf
+"""
+import argparse
+import json
+from config_state import INDEX_DIR
+from index_store import build_index, guideline_sources
+
+
+def parse_guideline(value: str) -> tuple[str, str]:
+    guideline_id, _, path = value.partition("=")
+    if not guideline_id or not path:
+        raise argparse.ArgumentTypeError(f"expected id=path, got {value!r}")
+    return guideline_id, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guideline", type=parse_guideline, action="append",
+                        help="id=path of a guideline PDF to index (repeatable; defaults to GUIDELINES and GUIDELINE_DIR)")
+    parser.add_argument("--index-dir", default=INDEX_DIR or "index", help="directory holding index artifacts")
+    parser.add_argument("--force", action="store_true", help="rebuild and re-embed everything, even if this version exists")
+    args = parser.parse_args()
+
+    guidelines = dict(args.guideline) if args.guideline else guideline_sources()
+    manifest = build_index(guidelines, args.index_dir, force=args.force)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from typing import Awaitable, Callable
+from langchain_core.messages import HumanMessage
+from config_state import (
+    GUIDELINE_PATH, CDS_GUIDELINES, COMPRESSION_MODE, CARD_CACHE_ENABLED, CARD_CACHE_TTL_SECONDS,
+    CARD_CACHE_STALE_SECONDS, CARD_CACHE_MAX_ENTRIES,
+)
+from fhir_profile import PatientProfile, profile_query
+from telemetry import log_event
+
+
+def missing_cds_guidelines(guideline_ids) -> list[str]:
+    """CDS_GUIDELINES ids an index doesn't have; serving it would fail every hook."""
+    return sorted(set(CDS_GUIDELINES) - set(guideline_ids))
+
+
+# Source links of the cards, for guidelines that have one
+GUIDELINE_URLS = {"hf": "https://hfsa.org/hfguidelines2022"}
+
+
+def guideline_card(detail: str, guidelines: list[str], names: list[str]) -> dict:
+    """CDS Hooks card carrying a recommendation from the given guidelines (ids and display names)."""
+    source = {"label": "; ".join(names)}
+    if len(guidelines) == 1 and guidelines[0] in GUIDELINE_URLS:
+        source["url"] = GUIDELINE_URLS[guidelines[0]]
+    return {
+        "summary": "Guideline Recommendation",
+        "indicator": "info",
+        "detail": detail,
+        "source": source,
+        "links": [
+            {
+                "label": "Open Full CDSS Chatbot",
+                "url": "https://cds-frontend-app.ambitiouscliff-0211bfd7.eastus.azurecontainerapps.io",
+                "type": "absolute"
+            }
+        ]
+    }
+
+
+async def generate_cards(rag_app, profile: PatientProfile, thread_id: str) -> list[dict]:
+    """Run the RAG graph for a patient profile and wrap the answer in a card."""
+    # nodes imports this module (to invalidate the cache on an index swap)
+    from nodes import guideline_ids, guideline_names
+
+    guidelines = CDS_GUIDELINES or guideline_ids()
+    names = guideline_names(guidelines)
+    initial_state = {
+        'query': [HumanMessage(content=profile_query(profile, names))],
+        'guideline_path': GUIDELINE_PATH,
+        'guidelines': CDS_GUIDELINES,
+        'compression': COMPRESSION_MODE
+    }
+    config = {'configurable': {'thread_id': thread_id}}
+    try:
+        rag_response = await rag_app.ainvoke(input=initial_state, config=config)
+    finally:
+        # A hook is a one-shot question, nothing ever reads its thread again
+        rag_app.checkpointer.delete_thread(thread_id)
+    return [guideline_card(rag_response['messages'][-1].content, guidelines, names)]
+
+
+@dataclass
+class CardEntry:
+    cards: list[dict]
+    created_at: float
+
+
+class CardCache:
+    """
+    TTL cache of CDS cards keyed on PatientProfile.key, with single-flight
+    computation and stale-while-revalidate.
+
+    - fresh (age <= ttl): served from the cache
+    - stale (age <= ttl + stale_seconds): served from the cache and refreshed in the background
+    - missing or older: computed; concurrent requests for the same key share one computation
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, stale_seconds: float = 86400, max_entries: int = 2048,
+                 enabled: bool = True):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: OrderedDict[str, CardEntry] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        # Bumped on invalidate so computations started earlier don't repopulate the cache
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[list[dict]]]) -> tuple[list[dict], str]:
+        """Return (cards, status) where status is hit, stale, coalesced, miss or disabled."""
+        if not self.enabled:
+            return await compute(), "disabled"
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry.created_at
+            if age <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.cards, "hit"
+            if age <= self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self.refreshes += 1
+                    self._start(key, compute).add_done_callback(partial(self._refresh_done, key))
+                return entry.cards, "stale"
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            status = "coalesced"
+        else:
+            self.misses += 1
+            task = self._start(key, compute)
+            status = "miss"
+        # Shield the shared task: one caller disconnecting must not cancel it for the others
+        return await asyncio.shield(task), status
+
+    def _start(self, key: str, compute: Callable[[], Awaitable[list[dict]]]) -> asyncio.Task:
+        generation = self._generation
+
+        async def run():
+            try:
+                cards = await compute()
+                if generation == self._generation:
+                    self.put(key, cards)
+                return cards
+            finally:
+                # invalidate() may have replaced this task with one started on the new index
+                if self._inflight.get(key) is asyncio.current_task():
+                    del self._inflight[key]
+
+        task = asyncio.create_task(run())
+        self._inflight[key] = task
+        return task
+
+    def _refresh_done(self, key: str, task: asyncio.Task):
+        # Nobody awaits a background refresh; keep serving the stale card if it failed.
+        # The callback runs in the context of the hook that started the refresh, so the log line carries its request id.
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            error = task.exception()
+            log_event("card_refresh_failed", key=key, error=f"{type(error).__name__}: {error}")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def put(self, key: str, cards: list[dict], created_at: float = None):
+        if not self.enabled:
+            return
+        self._entries[key] = CardEntry(cards=cards, created_at=created_at or time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        """Drop every card, e.g. because the guideline index was rebuilt."""
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._generation += 1
+        # Computations still running were started on the old index; later requests mustn't join them
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        served = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "graph_runs_saved_rate": round((served - self.misses) / served, 4) if served else 0.0,
+            "inflight": len(self._inflight),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+card_cache = CardCache(
+    ttl_seconds=CARD_CACHE_TTL_SECONDS,
+    stale_seconds=CARD_CACHE_STALE_SECONDS,
+    max_entries=CARD_CACHE_MAX_ENTRIES,
+    enabled=CARD_CACHE_ENABLED,
+)
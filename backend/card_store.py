@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from telemetry import log_event
+from config_state import CARD_STORE_PATH, CARD_CACHE_TTL_SECONDS, CARD_CACHE_STALE_SECONDS
+
+
+@dataclass
+class StoredCards:
+    cards: list[dict]
+    created_at: float
+
+
+class CardStore:
+    """
+    Append-only JSON-lines file of precomputed CDS cards, one record per patient
+    profile: {"key", "index_version", "created_at", "cards"}.
+
+    precompute_cards.py appends to it while the server may be running; readers
+    pick up new complete lines on the next lookup, so a running server serves
+    cards as soon as the batch job writes them. Records built against another
+    index version, or older than max_age_seconds, are ignored. A later record
+    for the same key replaces an earlier one.
+    """
+
+    def __init__(self, path: str, index_version: Optional[str] = None, max_age_seconds: Optional[float] = None):
+        self.path = path
+        self.index_version = index_version
+        self.max_age_seconds = max_age_seconds
+        self._records: dict[str, StoredCards] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, index_version: str):
+        """(Re)load the file for the given index version."""
+        with self._lock:
+            self.index_version = index_version
+            self._records.clear()
+            self._offset = 0
+            self._read_new_lines()
+        if self._records:
+            log_event("card_store_loaded", path=self.path, records=len(self._records), index_version=index_version)
+
+    def _read_new_lines(self):
+        # Caller holds the lock
+        if not self.path:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            # File was replaced or truncated: start over
+            self._records.clear()
+            self._offset = 0
+        if size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # A writer may be halfway through a line; leave it for the next read
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if self.index_version is not None and record.get("index_version") != self.index_version:
+                continue
+            self._records[record["key"]] = StoredCards(cards=record["cards"], created_at=record["created_at"])
+
+    def _expired(self, stored: StoredCards) -> bool:
+        return self.max_age_seconds is not None and time.time() - stored.created_at > self.max_age_seconds
+
+    def get(self, key: str) -> Optional[StoredCards]:
+        with self._lock:
+            self._read_new_lines()
+            stored = self._records.get(key)
+            if stored is not None and self._expired(stored):
+                stored = None
+            if stored is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return stored
+
+    def keys(self) -> set[str]:
+        """Keys with a record for the current index version that is not older than max_age_seconds."""
+        with self._lock:
+            self._read_new_lines()
+            return {key for key, stored in self._records.items() if not self._expired(stored)}
+
+    def append(self, key: str, cards: list[dict], created_at: Optional[float] = None):
+        """Add one record, flushed to disk so a crashed job keeps everything written so far."""
+        created_at = created_at or time.time()
+        line = json.dumps({"key": key, "index_version": self.index_version, "created_at": created_at, "cards": cards})
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "records": len(self._records),
+            "index_version": self.index_version,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Cards older than the card cache's stale window would never be served anyway
+card_store = CardStore(CARD_STORE_PATH, max_age_seconds=CARD_CACHE_TTL_SECONDS + CARD_CACHE_STALE_SECONDS)
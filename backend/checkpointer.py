@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """
+    InMemorySaver whose memory stays flat under long-running traffic.
+
+    Only the latest `max_checkpoints` checkpoints of each thread are kept
+    (the graph only ever resumes from the latest one), together with the
+    channel blobs they still reference. At most `max_threads` threads are
+    held; the least recently written thread is evicted first.
+    """
+
+    def __init__(self, max_threads: int = 1000, max_checkpoints: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.max_checkpoints = max(1, max_checkpoints)
+        self.evicted_threads = 0
+        self._thread_order: OrderedDict[str, None] = OrderedDict()
+        # Bookkeeping so pruning never has to scan the storage of other threads
+        self._blob_keys: dict[str, set] = {}
+        self._channel_versions: dict[tuple, dict] = {}
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+        self._channel_versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+        self._blob_keys.setdefault(thread_id, set()).update(
+            (thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items()
+        )
+        self._prune_checkpoints(thread_id, checkpoint_ns)
+
+        self._thread_order[thread_id] = None
+        self._thread_order.move_to_end(thread_id)
+        while len(self._thread_order) > self.max_threads:
+            oldest = next(iter(self._thread_order))
+            self.delete_thread(oldest)
+            self.evicted_threads += 1
+        return result
+
+    def _prune_checkpoints(self, thread_id: str, checkpoint_ns: str):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.max_checkpoints:
+            return
+        # Checkpoint ids are time-ordered, so sorting them sorts by age
+        checkpoint_ids = sorted(checkpoints)
+        for checkpoint_id in checkpoint_ids[:-self.max_checkpoints]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._channel_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        live = set()
+        for checkpoint_id in checkpoint_ids[-self.max_checkpoints:]:
+            versions = self._channel_versions.get((thread_id, checkpoint_ns, checkpoint_id), {})
+            live.update((thread_id, checkpoint_ns, channel, version) for channel, version in versions.items())
+        thread_blobs = self._blob_keys[thread_id]
+        for key in [k for k in thread_blobs if k[1] == checkpoint_ns and k not in live]:
+            self.blobs.pop(key, None)
+            thread_blobs.discard(key)
+
+    def delete_thread(self, thread_id: str) -> None:
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                self._channel_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        for key in self._blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+        self.storage.pop(thread_id, None)
+        self._thread_order.pop(thread_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "threads": len(self._thread_order),
+            "max_threads": self.max_threads,
+            "checkpoints": sum(len(c) for ns in self.storage.values() for c in ns.values()),
+            "blobs": len(self.blobs),
+            "evicted_threads": self.evicted_threads,
+        }
@@ -0,0 +1,110 @@
+import re
+import time
+import asyncio
+import numpy as np
+from langchain.schema import Document
+from config_state import llm, embedding_model, COMPRESSION_FAN_OUT, SENTENCE_SIMILARITY_THRESHOLD
+
+# Sentence boundaries: end punctuation followed by whitespace, or blank lines
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+_cached_extractor = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), enough to compare modes."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def split_sentences(text: str) -> list[str]:
+    """Sentences of a chunk with whitespace collapsed; empty pieces dropped."""
+    return [s for s in (" ".join(piece.split()) for piece in _SENTENCE_SPLIT.split(text)) if s]
+
+
+def _count_tokens(docs: list[Document]) -> int:
+    return sum(estimate_tokens(doc.page_content) for doc in docs)
+
+
+def _get_extractor():
+    global _cached_extractor
+    if _cached_extractor is None:
+        from langchain.retrievers.document_compressors import LLMChainExtractor
+        _cached_extractor = LLMChainExtractor.from_llm(llm)
+    return _cached_extractor
+
+
+async def llm_extract(docs: list[Document], query: str, fan_out: int = COMPRESSION_FAN_OUT) -> list[Document]:
+    """Run LLMChainExtractor on every document concurrently, at most `fan_out` at a time."""
+    extractor = _get_extractor()
+    fan_out_limit = asyncio.Semaphore(fan_out)
+
+    async def extract(doc: Document) -> list[Document]:
+        async with fan_out_limit:
+            return await extractor.acompress_documents([doc], query)
+
+    results = await asyncio.gather(*(extract(doc) for doc in docs))
+    # gather keeps the input order, so the retriever ranking is preserved
+    return [doc for compressed in results for doc in compressed]
+
+
+def embedding_filter(docs: list[Document], query: str, threshold: float = SENTENCE_SIMILARITY_THRESHOLD,
+                     min_sentences: int = 3) -> list[Document]:
+    """
+    Keep only the sentences whose embedding is close to the query embedding.
+    Uses the local embedding model, so no LLM calls are made.
+    """
+    sentences = []
+    for doc_index, doc in enumerate(docs):
+        for sentence in split_sentences(doc.page_content):
+            sentences.append((doc_index, sentence))
+    if not sentences:
+        return []
+
+    # One batched call for all sentences; embeddings are already normalized
+    sentence_vectors = np.asarray(embedding_model.embed_documents([s for _, s in sentences]), dtype=np.float32)
+    query_vector = np.asarray(embedding_model.embed_query(query), dtype=np.float32)
+    scores = sentence_vectors @ query_vector
+
+    keep = scores >= threshold
+    if keep.sum() < min_sentences:
+        # Never hand generation an empty context: fall back to the best few sentences
+        keep[np.argsort(-scores)[:min_sentences]] = True
+
+    kept_by_doc: dict[int, list[str]] = {}
+    for (doc_index, sentence), selected in zip(sentences, keep):
+        if selected:
+            kept_by_doc.setdefault(doc_index, []).append(sentence)
+
+    return [
+        Document(page_content=" ".join(kept_by_doc[i]), metadata=docs[i].metadata)
+        for i in sorted(kept_by_doc)
+    ]
+
+
+async def compress_documents(docs: list[Document], query: str, mode: str) -> tuple[list[Document], dict]:
+    """
+    Apply the selected compression mode and return (documents, stats).
+    mode is one of "llm", "embedding" or "none".
+    """
+    start = time.perf_counter()
+    llm_calls = 0
+    if mode == "llm":
+        compressed = await llm_extract(docs, query)
+        llm_calls = len(docs)
+    elif mode == "embedding":
+        compressed = await asyncio.to_thread(embedding_filter, docs, query)
+    elif mode == "none":
+        compressed = list(docs)
+    else:
+        raise ValueError(f"Unknown compression mode: {mode!r}")
+
+    stats = {
+        "mode": mode,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "llm_calls": llm_calls,
+        "docs_in": len(docs),
+        "docs_out": len(compressed),
+        "tokens_in": _count_tokens(docs),
+        "tokens_out": _count_tokens(compressed),
+    }
+    return compressed, stats
@@ -1,12 +1,14 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
-from langchain_groq import ChatGroq
 # from langchain_openai import ChatOpenAI
 from typing import TypedDict, Annotated, List, Literal
 from langchain.schema import Document
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+from telemetry import llm_usage_callback
+from llm_gateway import LLMGateway, ModelPool, GatewayChatModel
+from embeddings import CachedEmbeddings, LazyEmbeddings, load_embeddings
 load_dotenv()
 
 class IntentChecker(BaseModel):
@@ -16,18 +18,207 @@ class ChatState(TypedDict):
     intent: Literal['medical', 'general']
     query: Annotated[list[BaseMessage], add_messages]
     guideline_path: str
+    guidelines: Annotated[list[str], 'Guideline ids retrieval is routed to; all of them when empty']
     docs: Annotated[List[Document], 'It will be a list of document_object']
     chunks: Annotated[list[Document], 'It will be a list of document_object chunks']
     retrieved_docs: Annotated[List[Document], 'Retrieved relevant documents']
     messages: list[BaseMessage]
+    compression: Literal['llm', 'embedding', 'none']
+    compression_stats: Annotated[dict, 'Latency and token counts of the compression stage']
+    context: Annotated[str, 'Packed guideline excerpts handed to generation']
+    context_stats: Annotated[dict, 'Token counts before/after context packing']
+    rerank_stats: Annotated[dict, 'Latency and fallback of the rerank stage']
+    candidates: Annotated[List[Document], 'Retrieval results fetched while the intent was classified']
+    candidate_sections: Annotated[bool, 'Whether the candidates are parent sections']
 
-embedding_model = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2",
-    model_kwargs={'device': 'cpu'},
-    encode_kwargs={'normalize_embeddings':True}
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# torch (sentence-transformers on PyTorch), onnx (ONNX Runtime) or onnx-int8 (quantized ONNX); see embeddings.py
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Quantized export used by onnx-int8; the model repo also has avx512, avx512_vnni and arm64 builds
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# CPU threads for embedding inference; 0 keeps the library default (all cores)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Query embeddings kept in an LRU (a turn embeds the same question several times); 0 disables it
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+# Concurrent query embeddings arriving within this window are encoded as one batch; 0 disables batching
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "2"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+
+# Loaded by the startup warm-up in main.py (or on first use), not at import
+embedding_model = CachedEmbeddings(
+    LazyEmbeddings(lambda: load_embeddings(
+        EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_THREADS, EMBEDDING_ONNX_INT8_FILE
+    )),
+    cache_size=EMBEDDING_CACHE_SIZE,
+    batch_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+    max_batch=EMBEDDING_MAX_BATCH,
 )
 
-llm = ChatGroq(model='llama-3.1-8b-instant', temperature=0.3)
+# LLM_PROVIDER=stub swaps Groq for a deterministic offline model (used by benchmark.py)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+
+# Every LLM call goes through the gateway in llm_gateway.py
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+# Secondary model used when the primary is rate limited or failing; empty disables fallback
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.3-70b-versatile")
+# Clients per model; a hedged call goes to a different client than the original
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "2"))
+# Requests and tokens per minute allowed per model (your Groq limits); 0 means unlimited, the stub's default
+_groq_limits = LLM_PROVIDER != "stub"
+LLM_RPM = int(os.getenv("LLM_RPM", "30" if _groq_limits else "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "6000" if _groq_limits else "0"))
+LLM_FALLBACK_RPM = int(os.getenv("LLM_FALLBACK_RPM", "30" if _groq_limits else "0"))
+LLM_FALLBACK_TPM = int(os.getenv("LLM_FALLBACK_TPM", "12000" if _groq_limits else "0"))
+# Retries per model on 429/5xx/timeouts, with jittered exponential backoff starting at LLM_BACKOFF_SECONDS
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Longest a call waits for the primary's budget (or backs off) before falling over to the fallback model
+LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", "5"))
+# Race a second copy of calls slower than the model's recent p95, but never before LLM_HEDGE_MIN_SECONDS
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "2"))
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "30"))
+# Upper bound on LLM calls in flight at once across all requests in this worker
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "8"))
+
+
+def chat_model(model: str):
+    """One client for `model` from the configured provider."""
+    if LLM_PROVIDER == "stub":
+        from stub_llm import StubChatModel
+        return StubChatModel(latency=float(os.getenv("STUB_LLM_LATENCY", "0.5")))
+    # Imported here so the Groq SDK loads with the first LLM call, not at startup
+    from langchain_groq import ChatGroq
+    # Retries are the gateway's job, so it can fall over to the other model instead
+    return ChatGroq(model=model, temperature=0.3, max_retries=0, request_timeout=LLM_REQUEST_TIMEOUT_SECONDS)
 # llm = ChatOpenAI(model='gpt-4o-mini', temperature=0.3)
 
-structured_llm = llm.with_structured_output(IntentChecker)
\ No newline at end of file
+
+llm_gateway = LLMGateway(
+    [ModelPool(LLM_MODEL, lambda: [chat_model(LLM_MODEL) for _ in range(LLM_POOL_SIZE)], rpm=LLM_RPM, tpm=LLM_TPM)]
+    + ([ModelPool(LLM_FALLBACK_MODEL, lambda: [chat_model(LLM_FALLBACK_MODEL) for _ in range(LLM_POOL_SIZE)],
+                  rpm=LLM_FALLBACK_RPM, tpm=LLM_FALLBACK_TPM)] if LLM_FALLBACK_MODEL else []),
+    max_in_flight=MAX_CONCURRENT_LLM_CALLS,
+    max_retries=LLM_MAX_RETRIES,
+    backoff_seconds=LLM_BACKOFF_SECONDS,
+    backoff_max_seconds=LLM_BACKOFF_MAX_SECONDS,
+    max_queue_seconds=LLM_MAX_QUEUE_SECONDS,
+    hedging=LLM_HEDGING,
+    hedge_min_seconds=LLM_HEDGE_MIN_SECONDS,
+)
+# The callback attributes calls and token usage to the graph node making them (see telemetry.py)
+llm = GatewayChatModel(gateway=llm_gateway, callbacks=[llm_usage_callback])
+
+# Context compression applied to retrieved chunks before generation:
+# "llm" (LLMChainExtractor per chunk), "embedding" (local sentence filter) or "none"
+COMPRESSION_MODE = os.getenv("COMPRESSION_MODE", "llm")
+# Maximum number of concurrent extractor calls for a single query in "llm" mode
+COMPRESSION_FAN_OUT = int(os.getenv("COMPRESSION_FAN_OUT", "4"))
+# Minimum cosine similarity for a sentence to survive the "embedding" filter
+SENTENCE_SIMILARITY_THRESHOLD = float(os.getenv("SENTENCE_SIMILARITY_THRESHOLD", "0.35"))
+
+# Guideline PDF the index is built from; also what the in-process index (no INDEX_DIR) serves
+GUIDELINE_PATH = os.getenv("GUIDELINE_PATH", "data/HF_Guideline.pdf")
+# Guidelines in the prebuilt index, as comma-separated id=path pairs; each gets its own collection
+GUIDELINES = os.getenv("GUIDELINES", f"hf={GUIDELINE_PATH}")
+# Directory of further guideline PDFs, indexed under their file names (af.pdf -> "af"); rescanned on every ingest
+GUIDELINE_DIR = os.getenv("GUIDELINE_DIR", "")
+# Guideline ids CDS hook cards are retrieved from; empty means all of them
+CDS_GUIDELINES = [g.strip() for g in os.getenv("CDS_GUIDELINES", "").split(",") if g.strip()]
+# Names the prompts give the guidelines, as ;-separated id=title pairs; others use the PDF's title metadata or their id
+GUIDELINE_TITLES = os.getenv("GUIDELINE_TITLES", "hf=2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure")
+
+# Semantic answer cache in front of the graph (see answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# Optional JSON file the cache is loaded from at startup and saved to at shutdown
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+
+# Intent classification: "embedding" (local nearest-centroid router, see intent_router.py) or "llm"
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "embedding")
+# Router decisions with a centroid-similarity margin below this are escalated to the LLM
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", "0.05"))
+INTENT_LLM_ESCALATION = os.getenv("INTENT_LLM_ESCALATION", "true").lower() == "true"
+
+# Number of most recent user messages of a thread used to build retrieval/classification queries.
+# Older messages are removed from the thread state.
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "2"))
+if HISTORY_WINDOW < 1:
+    # A query needs at least the latest message; 0 would also make query[-0:] the whole thread
+    raise ValueError(f"HISTORY_WINDOW must be at least 1, not {HISTORY_WINDOW}")
+# Checkpointer bounds: threads kept in memory (LRU) and checkpoints kept per thread
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_MAX_PER_THREAD = int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "2"))
+
+# Retrieval: "hybrid" fuses BM25 keyword and dense results with reciprocal-rank fusion, "dense" is Chroma only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Chunks handed to compression/generation
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))
+# Candidates taken from each retriever before fusion (at least the number of results asked for)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Start retrieval for a chat turn alongside intent classification; a general query discards the result
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+
+# Text splitter settings; part of the index version
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# Cross-encoder reranking of a wider retrieval pool, in place of compression (see reranker.py)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates retrieved for the reranker, and how many it keeps
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+# Time budget of the rerank pass; when it runs over, the retrieval order is kept. 0 means no limit
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+# Pairs per forward pass; the budget is checked between passes, so a late rerank stops within one batch
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+
+# Prebuilt index layout, part of its version: "flat" (CHUNK_SIZE chunks) or "parent_child"
+# (sentence-level children are searched, and their guideline section is returned; see sections.py)
+CHUNKING = os.getenv("CHUNKING", "flat")
+# Largest child and parent section in characters (parent_child only)
+CHILD_MAX_CHARS = int(os.getenv("CHILD_MAX_CHARS", "400"))
+PARENT_MAX_CHARS = int(os.getenv("PARENT_MAX_CHARS", "2500"))
+# parent_child retrieval: children fetched per query, and distinct parent sections handed to generation
+CHILD_CANDIDATES = int(os.getenv("CHILD_CANDIDATES", "20"))
+PARENT_K = int(os.getenv("PARENT_K", "3"))
+# Directory holding prebuilt index artifacts (see build_index.py). Empty disables them.
+INDEX_DIR = os.getenv("INDEX_DIR", "index")
+# The index, graph and embedding model load in a background warm-up after the server starts (see main.py).
+# Requests that arrive before it finishes wait this long for it, then get a 503
+READY_WAIT_SECONDS = float(os.getenv("READY_WAIT_SECONDS", "60"))
+# Seconds between checks of INDEX_DIR/CURRENT; a new version there is hot-swapped in. 0 disables the check
+INDEX_RELOAD_SECONDS = float(os.getenv("INDEX_RELOAD_SECONDS", "10"))
+
+# Vector store backend: "numpy" (memory-mapped exact search, see numpy_store.py) or "chroma"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy")
+# Storage precision of the NumPy store's embedding matrix: float32, float16 or int8
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+
+# Context packing between retrieval and generation (see context_packing.py)
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+# Prompt-token budget for the guideline excerpts; 0 means no limit
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Word-set Jaccard similarity at which a sentence counts as a duplicate of one already packed
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.85"))
+
+# /bot/batch: largest accepted batch, and default number of items compressed/generated at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# CDS Hooks card cache keyed on the normalized patient profile (see card_cache.py)
+CARD_CACHE_ENABLED = os.getenv("CARD_CACHE_ENABLED", "true").lower() == "true"
+# Cards younger than this are served as-is
+CARD_CACHE_TTL_SECONDS = float(os.getenv("CARD_CACHE_TTL_SECONDS", "3600"))
+# For this long after the TTL a stale card is still served while it is refreshed in the background
+CARD_CACHE_STALE_SECONDS = float(os.getenv("CARD_CACHE_STALE_SECONDS", "86400"))
+CARD_CACHE_MAX_ENTRIES = int(os.getenv("CARD_CACHE_MAX_ENTRIES", "2048"))
+# Precomputed cards written by precompute_cards.py (JSON lines); empty disables the store
+CARD_STORE_PATH = os.getenv("CARD_STORE_PATH", "card_store.jsonl")
+# Width of the age bands in the patient profile; 1 keeps the exact age
+CDS_AGE_BAND_YEARS = int(os.getenv("CDS_AGE_BAND_YEARS", "10"))
@@ -0,0 +1,145 @@
+import re
+from dataclasses import dataclass, field
+from langchain.schema import Document
+from config_state import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, CHUNK_OVERLAP
+from compression import estimate_tokens, split_sentences
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Shortest suffix/prefix match treated as splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = 40
+
+
+@dataclass
+class Block:
+    """Text from one page, built from one or more retrieved chunks."""
+    source: str
+    page: int
+    text: str
+    rank: int  # best retriever rank among its chunks (0 = most relevant)
+    chunks: int = 1
+    sentences: list[str] = field(default_factory=list)
+
+
+def _overlap(left: str, right: str, max_chars: int) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right` (0 if shorter than MIN_OVERLAP_CHARS)."""
+    for size in range(min(len(left), len(right), max_chars), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge(a: str, b: str, max_overlap: int):
+    """Join two chunks of the same page if one contains the other or they overlap; None otherwise."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    size = _overlap(a, b, max_overlap)
+    if size:
+        return a + b[size:]
+    size = _overlap(b, a, max_overlap)
+    if size:
+        return b + a[size:]
+    return None
+
+
+def merge_chunks(docs: list[Document], max_overlap: int = CHUNK_OVERLAP) -> list[Block]:
+    """
+    Collapse chunks from the same PDF page that overlap (the splitter repeats up
+    to chunk_overlap characters between neighbours) or contain one another.
+    Blocks come back in relevance order.
+    """
+    blocks: list[Block] = []
+    for rank, doc in enumerate(docs):
+        source, page = doc.metadata.get("source"), doc.metadata.get("page")
+        text = doc.page_content.strip()
+        block = Block(source=source, page=page, text=text, rank=rank)
+        # A new chunk can bridge two existing blocks, so keep merging until nothing changes
+        merged = True
+        while merged:
+            merged = False
+            for other in blocks:
+                if other.source != block.source or other.page != block.page or page is None:
+                    continue
+                joined = _merge(other.text, block.text, max_overlap)
+                if joined is not None:
+                    blocks.remove(other)
+                    block = Block(source=source, page=page, text=joined, rank=min(other.rank, block.rank),
+                                  chunks=other.chunks + block.chunks)
+                    merged = True
+                    break
+        blocks.append(block)
+    return sorted(blocks, key=lambda b: b.rank)
+
+
+def _shingles(sentence: str) -> frozenset:
+    return frozenset(_WORD.findall(sentence.lower()))
+
+
+def drop_duplicate_sentences(blocks: list[Block], threshold: float = CONTEXT_DEDUP_THRESHOLD) -> int:
+    """
+    Split blocks into sentences and drop any whose word set has Jaccard
+    similarity >= threshold with a sentence kept earlier (more relevant blocks
+    are visited first). Returns the number of sentences dropped.
+    """
+    kept: list[frozenset] = []
+    dropped = 0
+    for block in blocks:
+        block.sentences = []
+        for sentence in split_sentences(block.text):
+            words = _shingles(sentence)
+            if words and any(len(words & other) / len(words | other) >= threshold for other in kept):
+                dropped += 1
+                continue
+            kept.append(words)
+            block.sentences.append(sentence)
+    return dropped
+
+
+def pack_context(docs: list[Document], budget: int = CONTEXT_TOKEN_BUDGET,
+                 threshold: float = CONTEXT_DEDUP_THRESHOLD) -> tuple[str, dict]:
+    """
+    Build the generation context from the retrieved docs: merge overlapping
+    chunks per page, drop near-duplicate sentences and add blocks in relevance
+    order until the token budget is spent (the block that crosses it is cut at
+    a sentence boundary). Returns (context, stats).
+    """
+    naive_tokens = estimate_tokens("\n\n".join(doc.page_content for doc in docs))
+    blocks = merge_chunks(docs)
+    dropped = drop_duplicate_sentences(blocks, threshold)
+
+    parts, used, truncated, full = [], 0, 0, False
+    for block in blocks:
+        sentences = []
+        for sentence in block.sentences:
+            # +1 for the separator between sentences/blocks
+            cost = estimate_tokens(sentence) + 1
+            # The most relevant sentence always goes in, even if it alone exceeds the budget
+            if budget and used + cost > budget and used:
+                full = True
+                break
+            sentences.append(sentence)
+            used += cost
+        if sentences:
+            parts.append(" ".join(sentences))
+            truncated += len(sentences) < len(block.sentences)
+        if full:
+            break
+    skipped = sum(1 for block in blocks if block.sentences) - len(parts)
+
+    context = "\n\n".join(parts)
+    context_tokens = estimate_tokens(context)
+    stats = {
+        "docs_in": len(docs),
+        "blocks": len(parts),
+        "merged_chunks": len(docs) - len(blocks),
+        "duplicate_sentences": dropped,
+        "truncated_blocks": truncated,
+        "skipped_blocks": skipped,
+        "budget": budget,
+        "tokens_before": naive_tokens,
+        "tokens_after": context_tokens,
+        "tokens_saved": naive_tokens - context_tokens,
+        "reduction": round(1 - context_tokens / naive_tokens, 3) if naive_tokens else 0.0,
+    }
+    return context, stats
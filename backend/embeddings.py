@@ -0,0 +1,201 @@
+"""
+Embedding model loading and the query-side wrapper around it.
+
+EMBEDDING_BACKEND picks how all-MiniLM-L6-v2 runs: "torch" (sentence-transformers
+on PyTorch), "onnx" (ONNX Runtime) or "onnx-int8" (a dynamically quantized ONNX
+export from the same model repo). The ONNX backends need the optional
+optimum[onnxruntime] package (`pip install "sentence-transformers[onnx]"`).
+
+CachedEmbeddings keeps a bounded LRU of query embeddings (a chat turn embeds the
+same question for the intent router, the answer cache, retrieval and
+compression) and encodes concurrent embed_query calls together in one batch.
+LazyEmbeddings defers loading the model (and importing sentence-transformers)
+until the first call or an explicit load() from the startup warm-up.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from langchain_core.embeddings import Embeddings
+from telemetry import log_event, record_cache
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def load_embeddings(model_name: str, backend: str = "torch", threads: int = 0, int8_file: str = None) -> Embeddings:
+    """HuggingFaceEmbeddings for `model_name` on the given backend; threads=0 keeps the library default."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}")
+    model_kwargs = {'device': 'cpu'}
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+    else:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(
+                f"EMBEDDING_BACKEND={backend} needs ONNX Runtime: pip install \"sentence-transformers[onnx]\""
+            ) from e
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+            session_options.inter_op_num_threads = 1
+        onnx_kwargs = {'provider': 'CPUExecutionProvider', 'session_options': session_options}
+        if backend == "onnx-int8":
+            onnx_kwargs['file_name'] = int8_file
+        model_kwargs.update(backend='onnx', model_kwargs=onnx_kwargs)
+    start = time.perf_counter()
+    model = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'normalize_embeddings': True}
+    )
+    log_event("embedding_model_loaded", model=model_name, backend=backend, threads=threads,
+              seconds=round(time.perf_counter() - start, 3))
+    return model
+
+
+class LazyEmbeddings(Embeddings):
+    """Calls `loader` to build the real model on first use; load() can be called ahead of time."""
+
+    def __init__(self, loader: Callable[[], Embeddings]):
+        self._loader = loader
+        self._model: Embeddings = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> Embeddings:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._loader()
+        return self._model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.load().embed_query(text)
+
+
+class _PendingBatch:
+    """Queries waiting to be encoded together; the first caller encodes for everyone."""
+
+    def __init__(self):
+        self.texts: list[str] = []
+        self.done = threading.Event()
+        self.vectors: list[list[float]] = None
+        self.error: Exception = None
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with a bounded LRU of query embeddings and
+    micro-batching of concurrent embed_query calls. Callers block (they run in
+    asyncio.to_thread workers), so batching is thread-based: the first query
+    to arrive waits up to `batch_wait_ms` for others, then encodes them all
+    with one embed_documents call. Document embedding is passed straight through.
+    """
+
+    def __init__(self, model: Embeddings, cache_size: int = 1024, batch_wait_ms: float = 2.0, max_batch: int = 32):
+        self.model = model
+        self.cache_size = cache_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._open: _PendingBatch = None
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self._cached(text)
+        if vector is not None:
+            return vector
+        if self.batch_wait <= 0:
+            vector = self.model.embed_query(text)
+        else:
+            vector = self._embed_batched(text)
+        self._remember(text, vector)
+        return vector
+
+    def _cached(self, text: str):
+        if not self.cache_size:
+            return None
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache("embedding", vector is not None)
+        return vector
+
+    def _remember(self, text: str, vector: list[float]):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _embed_batched(self, text: str) -> list[float]:
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _PendingBatch()
+            index = len(batch.texts)
+            batch.texts.append(text)
+            if len(batch.texts) >= self.max_batch:
+                # Full: later queries start a new batch
+                self._open = None
+        if not leader:
+            batch.done.wait()
+        else:
+            time.sleep(self.batch_wait)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            try:
+                batch.vectors = self.model.embed_documents(batch.texts)
+            except Exception as e:
+                batch.error = e
+            with self._lock:
+                self.batches += 1
+                self.batched_queries += len(batch.texts)
+            batch.done.set()
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[index]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "cache_entries": len(self._cache),
+                "cache_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "batches": self.batches,
+                "mean_batch": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,159 @@
+"""
+Local stand-in for the Groq chat completions API, for load-testing the LLM
+gateway offline. It enforces per-model requests- and tokens-per-minute
+limits the way Groq does (429 with a Retry-After header), adds latency with
+an occasional slow tail, and can fail a share of calls with 503. Answers are
+the same deterministic echo as the stub model; tool calls (structured output)
+and streaming are supported.
+
+    python fake_llm_server.py --port 8900 --rpm 30 --tpm 6000
+    GROQ_API_BASE=http://127.0.0.1:8900 GROQ_API_KEY=fake uvicorn main:app
+
+GET /stats returns per-model request, 429 and error counts.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import deque
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+from stub_llm import stub_answer, stub_intent, stub_usage
+
+
+class MinuteWindow:
+    """Requests and tokens seen in the last 60 seconds for one model."""
+
+    def __init__(self):
+        self.calls: deque[tuple[float, int]] = deque()
+        self.tokens = 0
+
+    def _expire(self, now: float):
+        while self.calls and now - self.calls[0][0] >= 60:
+            self.tokens -= self.calls.popleft()[1]
+
+    def admit(self, tokens: int, rpm: int, tpm: int) -> float:
+        """Record the call and return 0, or return the seconds until it would fit."""
+        now = time.monotonic()
+        self._expire(now)
+        over_requests = rpm and len(self.calls) >= rpm
+        over_tokens = tpm and self.tokens + tokens > tpm and self.calls
+        if over_requests or over_tokens:
+            return max(0.1, 60 - (now - self.calls[0][0]))
+        self.calls.append((now, tokens))
+        self.tokens += tokens
+        return 0.0
+
+
+def create_app(rpm: int = 30, tpm: int = 6000, latency: float = 0.4, tail_share: float = 0.05,
+               tail_latency: float = 4.0, error_rate: float = 0.0, seed: int = None) -> FastAPI:
+    app = FastAPI(title="Fake Groq API")
+    rng = random.Random(seed)
+    windows: dict[str, MinuteWindow] = {}
+    stats: dict[str, dict] = {}
+
+    def delay() -> float:
+        return tail_latency if rng.random() < tail_share else latency * rng.uniform(0.8, 1.2)
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "unknown")
+        counts = stats.setdefault(model, {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0})
+        counts["requests"] += 1
+        messages = body.get("messages") or []
+        prompt = "".join(str(m.get("content") or "") for m in messages)
+        last = str(messages[-1].get("content") or "") if messages else ""
+        max_tokens = body.get("max_tokens") or 200
+        reserved = len(prompt) // 4 + 1 + max_tokens
+
+        wait = windows.setdefault(model, MinuteWindow()).admit(reserved, rpm, tpm)
+        if wait:
+            counts["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": str(math.ceil(wait))},
+                content={"error": {"message": f"Rate limit reached for model `{model}`. Please try again in {wait:.1f}s.",
+                                   "type": "tokens", "code": "rate_limit_exceeded"}},
+            )
+        if rng.random() < error_rate:
+            counts["errors"] += 1
+            return JSONResponse(status_code=503, content={"error": {"message": "Service unavailable",
+                                                                    "type": "internal_server_error"}})
+
+        completion_id = "chatcmpl-" + uuid.uuid4().hex[:12]
+        created = int(time.time())
+        tools = body.get("tools")
+        if tools:
+            answer = ""
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": "call_" + uuid.uuid4().hex[:8], "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps({"intent": stub_intent(last)})},
+            }]}
+        else:
+            answer = stub_answer(last)
+            message = {"role": "assistant", "content": answer}
+        usage = stub_usage(prompt, answer or "tool")
+        usage = {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"],
+                 "total_tokens": usage["total_tokens"]}
+        seconds = delay()
+        counts["ok"] += 1
+
+        if body.get("stream"):
+            def chunk(delta: dict, finish_reason=None, **extra) -> str:
+                data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+                return f"data: {json.dumps(data)}\n\n"
+
+            async def events():
+                await asyncio.sleep(seconds / 2)
+                if tools:
+                    # Groq sends a streamed tool call whole, in one delta
+                    calls = [dict(call, index=i) for i, call in enumerate(message["tool_calls"])]
+                    yield chunk({"role": "assistant", "content": None, "tool_calls": calls})
+                    await asyncio.sleep(seconds / 2)
+                else:
+                    words = answer.split(" ")
+                    for i, word in enumerate(words):
+                        yield chunk({"role": "assistant", "content": word if i == 0 else " " + word})
+                        await asyncio.sleep(seconds / 2 / len(words))
+                yield chunk({}, "tool_calls" if tools else "stop", x_groq={"id": completion_id, "usage": usage})
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(seconds)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tools else "stop"}],
+            "usage": usage,
+        }
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--rpm", type=int, default=30, help="requests per minute per model (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=6000, help="tokens per minute per model (0 = unlimited)")
+    parser.add_argument("--latency", type=float, default=0.4, help="typical seconds per call")
+    parser.add_argument("--tail-share", type=float, default=0.05, help="share of calls that take --tail-latency")
+    parser.add_argument("--tail-latency", type=float, default=4.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 503")
+    args = parser.parse_args()
+    app = create_app(args.rpm, args.tpm, args.latency, args.tail_share, args.tail_latency, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
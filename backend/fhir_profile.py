@@ -0,0 +1,83 @@
+import hashlib
+import json
+import re
+from dataclasses import dataclass, asdict
+from datetime import date
+from typing import Optional
+from config_state import CDS_AGE_BAND_YEARS
+
+UNKNOWN_AGE = "unknown"
+
+
+@dataclass(frozen=True)
+class PatientProfile:
+    """
+    The parts of a CDS Hooks prefetch that the guideline prompt depends on,
+    normalized so that charts which would produce the same prompt compare equal.
+    """
+    age_band: str
+    gender: str
+    conditions: tuple[str, ...]
+    medications: tuple[str, ...]
+
+    @property
+    def key(self) -> str:
+        """Stable cache key for the profile."""
+        return hashlib.sha256(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:24]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+def age_band(birth_date_str: str, today: Optional[date] = None, band_years: int = CDS_AGE_BAND_YEARS) -> str:
+    """Age bucketed into band_years-wide bands, e.g. "60-69"."""
+    try:
+        birth_date = date.fromisoformat(birth_date_str)
+    except (ValueError, TypeError):
+        return UNKNOWN_AGE
+    today = today or date.today()
+    age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+    if band_years <= 1:
+        return str(age)
+    low = age // band_years * band_years
+    return f"{low}-{low + band_years - 1}"
+
+
+def patient_profile(patient: Optional[dict], conditions: Optional[dict], medications: Optional[dict],
+                    today: Optional[date] = None) -> PatientProfile:
+    """Build the canonical profile from the prefetched Patient resource and Condition/MedicationRequest bundles."""
+    patient = patient or {}
+    conditions = conditions or {}
+    medications = medications or {}
+    condition_names = [
+        entry.get("resource", {}).get("code", {}).get("text", "unspecified condition")
+        for entry in conditions.get("entry", [])
+    ]
+    medication_names = [
+        entry.get("resource", {}).get("medicationCodeableConcept", {}).get("text", "unspecified medication")
+        for entry in medications.get("entry", [])
+    ]
+    return PatientProfile(
+        age_band=age_band(patient.get("birthDate", "2000-01-01"), today),
+        gender=_normalize(patient.get("gender", "unknown gender")),
+        # Order and duplicates in the bundles don't change the recommendation
+        conditions=tuple(sorted({_normalize(c) for c in condition_names})),
+        medications=tuple(sorted({_normalize(m) for m in medication_names})),
+    )
+
+
+def profile_query(profile: PatientProfile, guideline_names: list[str]) -> str:
+    """The guideline question sent to the RAG graph for a patient profile, naming the guidelines it is answered from."""
+    if profile.age_band == UNKNOWN_AGE:
+        patient_summary = f"A {profile.gender} patient of unknown age"
+    else:
+        patient_summary = f"A {profile.age_band}-year-old {profile.gender} patient"
+    conditions_summary = f"with diagnoses including: {', '.join(profile.conditions) if profile.conditions else 'none listed'}"
+    meds_summary = f"and is currently prescribed: {', '.join(profile.medications) if profile.medications else 'no active medications'}"
+    return (
+        f"Based on the {' and the '.join(guideline_names)}, what are the key recommendations "
+        f"for the following clinical scenario? \n\n"
+        f"**Patient Profile:** {patient_summary} {conditions_summary} {meds_summary}. \n\n"
+        f"Please provide a concise, evidence-based summary."
+    )
@@ -1,35 +1,57 @@
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import InMemorySaver
-from config_state import ChatState
-from nodes import intent_classifier, general_query, router, doc_loader, text_splitter, vector_db, retrieve_documents, generation
+from config_state import ChatState, CHECKPOINT_MAX_THREADS, CHECKPOINT_MAX_PER_THREAD, RERANK_ENABLED, SPECULATIVE_RETRIEVAL
+from checkpointer import BoundedInMemorySaver
+from telemetry import traced_node
+from nodes import (
+    intent_classifier, general_query, router, speculative_retrieval, retrieve_documents,
+    rerank, assemble_context, generation,
+)
 
 
-def build_rag_graph():
-    """Build and compile the RAG Graph"""
-    checkpointer = InMemorySaver()
+def build_rag_graph(use_reranker: bool = RERANK_ENABLED, speculative: bool = SPECULATIVE_RETRIEVAL):
+    """
+    Build and compile the RAG Graph.
+    Medical queries go straight to retrieve_documents, which ingests the guideline on first use
+    when no prebuilt index was loaded (nodes.activate_index).
+    With speculative, retrieval starts in the same step as intent classification; a general
+    query discards its result.
+    With use_reranker a cross-encoder rerank node runs between retrieval and context packing.
+    """
+    checkpointer = BoundedInMemorySaver(
+        max_threads=CHECKPOINT_MAX_THREADS,
+        max_checkpoints=CHECKPOINT_MAX_PER_THREAD
+    )
     graph = StateGraph(ChatState)
 
-    graph.add_node('intent_classifier', intent_classifier)
-    graph.add_node('general_query', general_query)
-    graph.add_node('doc_loader', doc_loader)
-    graph.add_node('text_splitter',text_splitter)
-    graph.add_node('vector_db',vector_db)
-    graph.add_node('retrieve_documents',retrieve_documents)
-    graph.add_node('generation',generation)
+    # Every node is wrapped to record latency, LLM usage and cache hits (see telemetry.py)
+    graph.add_node('intent_classifier', traced_node('intent_classifier', intent_classifier))
+    graph.add_node('general_query', traced_node('general_query', general_query))
+    if speculative:
+        graph.add_node('speculative_retrieval', traced_node('speculative_retrieval', speculative_retrieval))
+    graph.add_node('retrieve_documents', traced_node('retrieve_documents', retrieve_documents))
+    if use_reranker:
+        graph.add_node('rerank', traced_node('rerank', rerank))
+    graph.add_node('assemble_context', traced_node('assemble_context', assemble_context))
+    graph.add_node('generation', traced_node('generation', generation))
 
-    graph.set_entry_point('intent_classifier')
+    graph.add_edge(START, 'intent_classifier')
+    if speculative:
+        # Runs in the same superstep as the classifier, so the router sees both results
+        graph.add_edge(START, 'speculative_retrieval')
     graph.add_conditional_edges(
         "intent_classifier",
         router,
         {
             "general": "general_query",
-            "medical": "doc_loader"
+            "medical": "retrieve_documents"
         }
     )
-    graph.add_edge("doc_loader", "text_splitter")
-    graph.add_edge("text_splitter", "vector_db")
-    graph.add_edge("vector_db", "retrieve_documents")
-    graph.add_edge("retrieve_documents", "generation")
+    if use_reranker:
+        graph.add_edge("retrieve_documents", "rerank")
+        graph.add_edge("rerank", "assemble_context")
+    else:
+        graph.add_edge("retrieve_documents", "assemble_context")
+    graph.add_edge("assemble_context", "generation")
     graph.add_edge("generation", END)
     graph.add_edge("general_query", END)
     compiled_graph = graph.compile(checkpointer=checkpointer)
@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+from langchain.schema import Document
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from config_state import (
+    embedding_model, EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, VECTOR_BACKEND, VECTOR_DTYPE,
+    GUIDELINES, GUIDELINE_DIR, GUIDELINE_TITLES, CHUNKING, CHILD_MAX_CHARS, PARENT_MAX_CHARS,
+)
+from sparse_index import BM25Index
+from numpy_store import NumpyVectorStore
+from telemetry import log_event
+
+# Bump when the artifact layout changes so old artifacts are rebuilt
+ARTIFACT_FORMAT = 3
+
+# Layout of index/<version>/: manifest.json plus one directory per guideline id
+MANIFEST_FILE = 'manifest.json'
+CHROMA_DIR = 'chroma'
+NUMPY_DIR = 'numpy'
+SPARSE_FILE = 'bm25_index.json'
+# Float32 embeddings and content hashes of the chunks, in row order; what later builds reuse
+EMBEDDINGS_FILE = 'embeddings.npy'
+CHUNKS_FILE = 'chunks.json'
+# Parent sections of a parent_child index; the chunks above are their children
+PARENTS_FILE = 'parents.json'
+# index/CURRENT holds the version the server should load
+CURRENT_FILE = 'CURRENT'
+# Held while a build runs, so builds from several processes take turns
+LOCK_FILE = '.build.lock'
+
+
+@dataclass
+class GuidelineIndex:
+    """Retrieval structures for one guideline: its own vector collection and BM25 index."""
+    id: str
+    vector_store: VectorStore
+    sparse_index: Optional[BM25Index]
+    # Sections the indexed chunks belong to (chunk.metadata['parent'] indexes this); None for a flat index
+    parents: Optional[list[Document]] = None
+
+
+@dataclass
+class IndexArtifact:
+    version: str
+    path: str
+    manifest: dict
+    guidelines: dict[str, GuidelineIndex]
+
+    @property
+    def default_guideline(self) -> str:
+        return next(iter(self.guidelines))
+
+    def guideline(self, guideline_id: str = None) -> GuidelineIndex:
+        """One guideline's index; the first (default) one when no id is given."""
+        return self.guidelines[guideline_id or self.default_guideline]
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Serves embeddings computed earlier, so the chunks are embedded only once per build."""
+
+    def __init__(self, texts: list[str], vectors):
+        self._vectors = {text: list(map(float, vector)) for text, vector in zip(texts, vectors)}
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._vectors[text]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def guideline_sources(guidelines: str = GUIDELINES, guideline_dir: str = GUIDELINE_DIR) -> dict[str, str]:
+    """
+    Guideline id -> PDF path: the id=path pairs in GUIDELINES, then every PDF in
+    GUIDELINE_DIR under its file name. Rescanned on each build, so dropping a PDF
+    into the directory and re-ingesting adds a guideline.
+    """
+    sources = {}
+    for pair in guidelines.split(','):
+        if pair.strip():
+            guideline_id, _, path = pair.partition('=')
+            if not path:
+                raise ValueError(f"GUIDELINES entries look like id=path, not {pair!r}")
+            sources[guideline_id.strip()] = path.strip()
+    if guideline_dir and os.path.isdir(guideline_dir):
+        for name in sorted(os.listdir(guideline_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == '.pdf':
+                sources.setdefault(stem, os.path.join(guideline_dir, name))
+    return sources
+
+
+def guideline_titles(titles: str = GUIDELINE_TITLES) -> dict[str, str]:
+    """Guideline id -> display title from the ;-separated id=title pairs of GUIDELINE_TITLES."""
+    pairs = (pair.partition('=') for pair in titles.split(';') if pair.strip())
+    return {guideline_id.strip(): title.strip() for guideline_id, _, title in pairs if title.strip()}
+
+
+def pdf_title(path: str) -> Optional[str]:
+    """The title in the PDF's metadata, if it has one."""
+    import pymupdf
+
+    try:
+        with pymupdf.open(path) as doc:
+            return (doc.metadata or {}).get('title', '').strip() or None
+    except Exception:
+        return None
+
+
+def split_settings() -> dict:
+    """How guidelines are cut into chunks. Part of the version; a guideline's build is reused only under the same settings."""
+    if CHUNKING == 'parent_child':
+        return {'chunking': CHUNKING, 'child_max_chars': CHILD_MAX_CHARS, 'parent_max_chars': PARENT_MAX_CHARS}
+    return {'chunking': CHUNKING, 'chunk_size': CHUNK_SIZE, 'chunk_overlap': CHUNK_OVERLAP}
+
+
+def artifact_version(source_hashes: dict[str, str], settings: dict = None, vector_dtype: str = VECTOR_DTYPE) -> str:
+    """Content hash of everything the index depends on: each guideline's PDF bytes, the split settings, the embedding model and its storage dtype."""
+    sources = ','.join(f"{guideline_id}:{sha256}" for guideline_id, sha256 in source_hashes.items())
+    split = ','.join(f"{name}={value}" for name, value in (settings or split_settings()).items())
+    key = f"{ARTIFACT_FORMAT}|{sources}|{split}|{EMBEDDING_MODEL_NAME}|{vector_dtype}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _read_manifest(artifact_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(artifact_path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+
+def _previous_build(index_dir: str) -> tuple[Optional[str], dict, dict[str, np.ndarray]]:
+    """
+    The artifact CURRENT points at, if later builds can reuse it: its path, its
+    manifest and a chunk hash -> float32 embedding map over all its guidelines.
+    Vectors only carry over between builds with the same embedding model.
+    """
+    version = current_version(index_dir)
+    artifact_path = os.path.join(index_dir, version) if version else None
+    manifest = _read_manifest(artifact_path) if artifact_path else None
+    if (manifest is None or manifest.get('format') != ARTIFACT_FORMAT
+            or manifest.get('embedding_model') != EMBEDDING_MODEL_NAME):
+        return None, {}, {}
+    vectors = {}
+    for guideline_id in manifest['guidelines']:
+        guideline_path = os.path.join(artifact_path, guideline_id)
+        with open(os.path.join(guideline_path, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            hashes = json.load(f)['hashes']
+        matrix = np.load(os.path.join(guideline_path, EMBEDDINGS_FILE), mmap_mode='r')
+        for chunk_hash, row in zip(hashes, matrix):
+            vectors.setdefault(chunk_hash, row)
+    return artifact_path, manifest, vectors
+
+
+def _split_guideline(source_path: str) -> tuple[list[str], list[Document], Optional[list[Document]]]:
+    """Page texts, the chunks to embed and, for CHUNKING=parent_child, the parent sections they map to."""
+    if CHUNKING == 'parent_child':
+        from sections import split_sections
+        return split_sections(source_path, CHILD_MAX_CHARS, PARENT_MAX_CHARS)
+    if CHUNKING != 'flat':
+        raise ValueError(f"CHUNKING must be flat or parent_child, not {CHUNKING!r}")
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    docs = PyMuPDFLoader(source_path).load()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [doc.page_content for doc in docs], splitter.split_documents(docs), None
+
+
+def _build_guideline(guideline_id: str, source_path: str, out_path: str, version: str,
+                     previous_pages: list[str], previous_vectors: dict[str, np.ndarray]) -> dict:
+    """Parse and chunk one guideline into out_path, embedding only chunks whose content hash is not in previous_vectors."""
+    from langchain_chroma import Chroma
+
+    timings = {}
+    os.makedirs(out_path)
+
+    step = time.perf_counter()
+    page_texts, chunks, parents = _split_guideline(source_path)
+    page_hashes = [text_sha256(text) for text in page_texts]
+    for doc in chunks + (parents or []):
+        doc.metadata['guideline'] = guideline_id
+    texts = [chunk.page_content for chunk in chunks]
+    chunk_hashes = [text_sha256(text) for text in texts]
+    timings['parse_s'] = round(time.perf_counter() - step, 3)
+
+    # Unchanged chunks (same text) keep their vectors; the rest are embedded, each distinct text once
+    step = time.perf_counter()
+    missing = list(dict.fromkeys(h for h in chunk_hashes if h not in previous_vectors))
+    text_by_hash = dict(zip(chunk_hashes, texts))
+    new_vectors = {}
+    if missing:
+        embedded = embedding_model.embed_documents([text_by_hash[h] for h in missing])
+        new_vectors = dict(zip(missing, np.asarray(embedded, dtype=np.float32)))
+    vectors = np.asarray(
+        [new_vectors[h] if h in new_vectors else previous_vectors[h] for h in chunk_hashes], dtype=np.float32
+    )
+    timings['embed_s'] = round(time.perf_counter() - step, 3)
+
+    step = time.perf_counter()
+    np.save(os.path.join(out_path, EMBEDDINGS_FILE), vectors)
+    with open(os.path.join(out_path, CHUNKS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'pages': page_hashes, 'hashes': chunk_hashes}, f)
+    # Both vector backends are written so VECTOR_BACKEND can be switched without a rebuild
+    Chroma.from_documents(
+        documents=chunks,
+        embedding=PrecomputedEmbeddings(texts, vectors),
+        persist_directory=os.path.join(out_path, CHROMA_DIR),
+        collection_name=guideline_id
+    )
+    # The chunks themselves live in the BM25 file; the NumPy store only needs the matrix
+    NumpyVectorStore.from_vectors(embedding_model, vectors, chunks, dtype=VECTOR_DTYPE, version=version).save(
+        os.path.join(out_path, NUMPY_DIR), include_documents=False
+    )
+    BM25Index(chunks, version=version).save(os.path.join(out_path, SPARSE_FILE))
+    if parents is not None:
+        with open(os.path.join(out_path, PARENTS_FILE), 'w', encoding='utf-8') as f:
+            json.dump([{'page_content': p.page_content, 'metadata': p.metadata} for p in parents], f)
+    timings['write_s'] = round(time.perf_counter() - step, 3)
+
+    previous = set(previous_pages)
+    report = {
+        'source': os.path.basename(source_path),
+        'pages': len(page_texts),
+        'pages_changed': sum(1 for h in page_hashes if h not in previous),
+        'chunks': len(chunks),
+        'chunks_embedded': len(missing),
+        'chunks_reused': len(chunks) - sum(1 for h in chunk_hashes if h in new_vectors),
+        'timings': timings,
+    }
+    if parents is not None:
+        report['parents'] = len(parents)
+    return report
+
+
+@contextmanager
+def _build_lock(index_dir: str):
+    """Exclusive lock on index_dir across processes (server workers, build_index.py) for one build."""
+    import fcntl
+
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _reusable_build(index_dir: str, version: str) -> Optional[str]:
+    """Directory name of a finished build of `version`: the one CURRENT points at if it is one, else `version`."""
+    for name in (current_version(index_dir), version):
+        if name and name.split('-')[0] == version and _read_manifest(os.path.join(index_dir, name)) is not None:
+            return name
+    return None
+
+
+def build_index(guidelines: dict[str, str], index_dir: str, force: bool = False) -> dict:
+    """
+    Parse, chunk and embed every guideline (id -> PDF path) into
+    index_dir/<version>/<id>/ and point index_dir/CURRENT at the new version.
+    Builds are incremental against the artifact CURRENT points at: a
+    guideline whose PDF is unchanged is copied over as is, and in a changed
+    one only chunks with new content are embedded. force re-embeds
+    everything. Returns the manifest.
+
+    Builds in several processes at once take turns on a file lock. A
+    finished version directory is never modified: the build is written to a
+    unique scratch directory and renamed into place, and a forced rebuild of
+    the version being served goes to a new directory (<version>-<n>).
+    """
+    if not guidelines:
+        raise ValueError("No guidelines to index")
+    with _build_lock(index_dir):
+        return _build_index(guidelines, index_dir, force)
+
+
+def _build_index(guidelines: dict[str, str], index_dir: str, force: bool) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    source_hashes = {guideline_id: file_sha256(path) for guideline_id, path in guidelines.items()}
+    settings = split_settings()
+    version = artifact_version(source_hashes, settings)
+    timings['hash_s'] = round(time.perf_counter() - start, 3)
+
+    existing = _reusable_build(index_dir, version)
+    if existing is not None and not force:
+        log_event("index_reused", version=existing, index_dir=index_dir)
+        set_current_version(index_dir, existing)
+        return _read_manifest(os.path.join(index_dir, existing))
+    # Forced rebuild: workers may be serving the existing directory, so leave it alone
+    base, rebuild = version, 0
+    while os.path.exists(os.path.join(index_dir, version)):
+        rebuild += 1
+        version = f"{base}-{rebuild}"
+    artifact_path = os.path.join(index_dir, version)
+
+    previous_path, previous, previous_vectors = (None, {}, {}) if force else _previous_build(index_dir)
+
+    # Build into a scratch directory so a failed build never leaves a half-written artifact
+    partial_path = tempfile.mkdtemp(dir=index_dir, prefix=f".{version}.")
+    try:
+        manifest = _write_artifact(guidelines, partial_path, version, source_hashes, settings, previous_path,
+                                   previous, previous_vectors, timings, start)
+        os.rename(partial_path, artifact_path)
+    except BaseException:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+    set_current_version(index_dir, version)
+    return manifest
+
+
+def _write_artifact(guidelines: dict[str, str], partial_path: str, version: str, source_hashes: dict[str, str],
+                    settings: dict, previous_path: Optional[str], previous: dict,
+                    previous_vectors: dict[str, np.ndarray], timings: dict, start: float) -> dict:
+    """Build every guideline into partial_path and write its manifest; returns the manifest."""
+    previous_guidelines = previous.get('guidelines', {})
+
+    reports = {}
+    for guideline_id, source_path in guidelines.items():
+        step = time.perf_counter()
+        out_path = os.path.join(partial_path, guideline_id)
+        before = previous_guidelines.get(guideline_id)
+        if (before is not None and before['source_sha256'] == source_hashes[guideline_id]
+                and previous.get('vector_dtype') == VECTOR_DTYPE
+                and all(previous.get(name) == value for name, value in settings.items())):
+            # Same PDF and settings: the previous build of this guideline is still exact
+            shutil.copytree(os.path.join(previous_path, guideline_id), out_path)
+            report = {**before, 'pages_changed': 0, 'chunks_embedded': 0, 'chunks_reused': before['chunks'],
+                      'copied': True, 'timings': {}}
+        else:
+            previous_pages = []
+            if before is not None:
+                with open(os.path.join(previous_path, guideline_id, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+                    previous_pages = json.load(f)['pages']
+            report = _build_guideline(guideline_id, source_path, out_path, version, previous_pages, previous_vectors)
+            report['copied'] = False
+        report['source_sha256'] = source_hashes[guideline_id]
+        report['title'] = pdf_title(source_path)
+        report['timings']['total_s'] = round(time.perf_counter() - step, 3)
+        reports[guideline_id] = report
+    timings['total_s'] = round(time.perf_counter() - start, 3)
+
+    manifest = {
+        'version': version,
+        'format': ARTIFACT_FORMAT,
+        'guidelines': reports,
+        **settings,
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        'vector_dtype': VECTOR_DTYPE,
+        'pages': sum(report['pages'] for report in reports.values()),
+        'chunks': sum(report['chunks'] for report in reports.values()),
+        'chunks_embedded': sum(report['chunks_embedded'] for report in reports.values()),
+        'previous_version': previous.get('version'),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'timings': timings,
+    }
+    with open(os.path.join(partial_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def set_current_version(index_dir: str, version: str):
+    """Atomically point index_dir/CURRENT at a version."""
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=f".{CURRENT_FILE}.")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def current_version(index_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def load_index(index_dir: str) -> Optional[IndexArtifact]:
+    """Open the artifact index_dir/CURRENT points at, or return None when there is none."""
+    if not index_dir:
+        return None
+    version = current_version(index_dir)
+    if version is None:
+        return None
+    artifact_path = os.path.join(index_dir, version)
+    manifest = _read_manifest(artifact_path)
+    if manifest is None or manifest.get('format') != ARTIFACT_FORMAT:
+        log_event("index_ignored", version=version, reason="old layout; rebuild it with build_index.py",
+                  format=manifest.get('format') if manifest else None)
+        return None
+    if manifest.get('embedding_model') != EMBEDDING_MODEL_NAME:
+        log_event("index_ignored", version=version, reason="built with another embedding model",
+                  embedding_model=manifest.get('embedding_model'), expected=EMBEDDING_MODEL_NAME)
+        return None
+
+    guidelines = {}
+    for guideline_id in manifest['guidelines']:
+        guideline_path = os.path.join(artifact_path, guideline_id)
+        sparse_index = BM25Index.load(os.path.join(guideline_path, SPARSE_FILE))
+        if VECTOR_BACKEND == "numpy":
+            # Chunk order is the same in both files, so share the BM25 index's documents
+            vector_store = NumpyVectorStore.load(
+                os.path.join(guideline_path, NUMPY_DIR), embedding_model, documents=sparse_index.documents
+            )
+        else:
+            # Only imported when serving from Chroma; the NumPy backend never needs chromadb
+            from langchain_chroma import Chroma
+            vector_store = Chroma(
+                embedding_function=embedding_model,
+                persist_directory=os.path.join(guideline_path, CHROMA_DIR),
+                collection_name=guideline_id
+            )
+        parents = None
+        if os.path.exists(os.path.join(guideline_path, PARENTS_FILE)):
+            with open(os.path.join(guideline_path, PARENTS_FILE), 'r', encoding='utf-8') as f:
+                parents = [Document(page_content=p['page_content'], metadata=p['metadata']) for p in json.load(f)]
+        guidelines[guideline_id] = GuidelineIndex(guideline_id, vector_store, sparse_index, parents)
+    return IndexArtifact(version=version, path=artifact_path, manifest=manifest, guidelines=guidelines)
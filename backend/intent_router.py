@@ -0,0 +1,120 @@
+import threading
+import numpy as np
+from config_state import embedding_model
+
+# Labelled exemplars the centroids are built from. Keep them distinct from
+# data/intent_queries.jsonl, which is the held-out set used by benchmark.py.
+MEDICAL_EXEMPLARS = [
+    "What is the first-line treatment for heart failure with reduced ejection fraction?",
+    "When should an ICD be implanted for primary prevention of sudden cardiac death?",
+    "What dose of sacubitril/valsartan should be started in HFrEF?",
+    "How do you manage hyperkalemia in a patient on an MRA?",
+    "What are the recommendations for SGLT2 inhibitors in HFpEF?",
+    "Is digoxin recommended in heart failure?",
+    "How should loop diuretics be titrated in congestion?",
+    "What BNP or NT-proBNP levels support a diagnosis of heart failure?",
+    "Which patients qualify for a left ventricular assist device?",
+    "How is cardiogenic shock managed according to the guideline?",
+    "What are the criteria for NYHA class III symptoms?",
+    "When should patients with stage D heart failure be referred for transplant?",
+    "How should atrial fibrillation be managed in patients with heart failure?",
+    "What is the role of beta blockers after myocardial infarction with reduced LVEF?",
+    "Should hydralazine and isosorbide dinitrate be used in Black patients with HFrEF?",
+    "What imaging is recommended to evaluate suspected cardiomyopathy?",
+    "How do you treat iron deficiency in heart failure?",
+    "Recommendations for cardiac rehabilitation in stable heart failure",
+    "What is heart failure with improved ejection fraction?",
+    "How should blood pressure be controlled in patients at risk of heart failure?",
+    "Management of a 70 year old patient with HFrEF on metoprolol and furosemide",
+    "Can ACE inhibitors and ARNi be given together?",
+    "What vaccines are recommended for patients with heart failure?",
+    "When is CRT indicated for LBBB with QRS over 150 ms?",
+    "How should cardiac amyloidosis be diagnosed and treated?",
+    "What lifestyle changes reduce hospitalization for heart failure?",
+    "GDMT titration schedule after discharge",
+    "Patient profile: 65 year old male with hypertension, type 2 diabetes and reduced ejection fraction",
+]
+
+GENERAL_EXEMPLARS = [
+    "Hello",
+    "Hi there, how are you?",
+    "Good morning!",
+    "Thanks for your help",
+    "Who are you?",
+    "What can you do?",
+    "Tell me a joke",
+    "What's the weather like today?",
+    "Who won the football match yesterday?",
+    "Write a poem about the ocean",
+    "How do I bake sourdough bread?",
+    "What is the capital of France?",
+    "Translate this sentence into Spanish",
+    "Recommend a good movie for tonight",
+    "How do I reset my password?",
+    "What time is it in Tokyo?",
+    "Explain how a car engine works",
+    "How do I learn Python programming?",
+    "What's the best laptop to buy?",
+    "Can you help me plan a holiday to Italy?",
+    "What is the stock price of Apple?",
+    "Tell me about the history of the Roman empire",
+    "How many calories are in a banana?",
+    "What are some tips for studying for exams?",
+    "Goodbye",
+    "Summarize today's news",
+    "How do I fix a leaking tap?",
+    "Who painted the Mona Lisa?",
+]
+
+LABELS = ("medical", "general")
+
+
+class IntentRouter:
+    """
+    Nearest-centroid intent classifier over the shared embedding model.
+
+    Each label's centroid is the normalized mean of its exemplar embeddings.
+    The query goes to the label whose centroid is most similar, and the
+    confidence is the margin between the two similarities.
+    """
+
+    def __init__(self, exemplars: dict[str, list[str]]):
+        self.exemplars = exemplars
+        self._centroids = None  # (n_labels, dim), built on first use
+        self._lock = threading.Lock()
+
+    def _build_centroids(self):
+        with self._lock:
+            if self._centroids is not None:
+                return
+            centroids = []
+            for label in LABELS:
+                vectors = np.asarray(embedding_model.embed_documents(self.exemplars[label]), dtype=np.float32)
+                centroid = vectors.mean(axis=0)
+                centroids.append(centroid / np.linalg.norm(centroid))
+            self._centroids = np.stack(centroids)
+
+    def classify_embedding(self, query_embedding) -> tuple[str, float]:
+        """Return (label, margin) for an already embedded query. Pure NumPy, no model calls."""
+        if self._centroids is None:
+            self._build_centroids()
+        scores = self._centroids @ np.asarray(query_embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        margin = float(scores[best] - scores[1 - best])
+        return LABELS[best], margin
+
+    def classify_embeddings(self, query_embeddings) -> list[tuple[str, float]]:
+        """classify_embedding for a whole batch with one matrix product."""
+        if self._centroids is None:
+            self._build_centroids()
+        scores = np.asarray(query_embeddings, dtype=np.float32) @ self._centroids.T
+        best = scores.argmax(axis=1)
+        margins = scores[np.arange(len(scores)), best] - scores[np.arange(len(scores)), 1 - best]
+        return [(LABELS[b], float(m)) for b, m in zip(best, margins)]
+
+    def classify(self, query: str) -> tuple[str, float]:
+        """Embed the query and classify it. Blocking, so call it via asyncio.to_thread."""
+        return self.classify_embedding(embedding_model.embed_query(query))
+
+
+intent_router = IntentRouter({"medical": MEDICAL_EXEMPLARS, "general": GENERAL_EXEMPLARS})
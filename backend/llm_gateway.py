@@ -0,0 +1,476 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Union
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from telemetry import LLM_GATEWAY_EVENTS, LLM_QUEUE_SECONDS, log_event
+
+# Lower number = served first when calls queue for a slot or rate budget
+LANES = {"cds": 0, "chat": 1, "batch": 2}
+# Lane of the LLM calls made while serving the current request; handlers set it, "chat" otherwise
+llm_lane_var: ContextVar[str] = ContextVar("llm_lane", default="chat")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Latency samples needed before hedging kicks in
+MIN_HEDGE_SAMPLES = 20
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth another try."""
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, ConnectionError)) or \
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After header), if it said."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_prompt_tokens(messages: List[BaseMessage]) -> int:
+    # Same ~4 characters per token estimate as compression.estimate_tokens
+    return sum(len(str(m.content)) for m in messages) // 4 + 1
+
+
+def used_tokens(message) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+class TokenBucket:
+    """Refills `per_minute` units a minute and holds at most a minute's worth; 0 means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units can be taken (0 = now)."""
+        blocked = max(0.0, self.blocked_until - now)
+        if not self.per_minute:
+            return blocked
+        self._refill(now)
+        # A call bigger than the whole bucket waits for a full bucket rather than forever
+        shortfall = min(amount, self.per_minute) - self.level
+        return max(blocked, shortfall * 60 / self.per_minute if shortfall > 0 else 0.0)
+
+    def take(self, amount: float, now: float):
+        if self.per_minute:
+            self._refill(now)
+            self.level -= min(amount, self.per_minute)
+
+    def adjust(self, amount: float):
+        """Correct an earlier take once the real usage is known (negative gives units back)."""
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level - amount)
+
+    def block(self, seconds: float, now: float):
+        """Hand out nothing for `seconds`, e.g. after the server answered 429."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class ModelPool:
+    """One model behind the gateway: its clients, request/token budgets and recent latencies."""
+
+    def __init__(self, name: str, clients: Union[list[BaseChatModel], Callable[[], list[BaseChatModel]]],
+                 rpm: int = 0, tpm: int = 0):
+        self.name = name
+        # A function returning the clients is called on first use, so the client library loads lazily
+        self._clients = clients
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight: dict[int, int] = defaultdict(int)
+        self.latencies: deque[float] = deque(maxlen=200)
+        self.events: dict[str, int] = {}
+
+    @property
+    def clients(self) -> list[BaseChatModel]:
+        if callable(self._clients):
+            self._clients = self._clients()
+        return self._clients
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def take(self, tokens: int, now: float):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+    def pick_client(self, exclude: Optional[int] = None) -> int:
+        """Least busy client, avoiding `exclude` when there is another one."""
+        candidates = [i for i in range(len(self.clients)) if i != exclude] or [0]
+        return min(candidates, key=lambda i: self.in_flight[i])
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self, minimum: float) -> Optional[float]:
+        """Hedge calls slower than this pool's p95 (never sooner than `minimum`)."""
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return max(minimum, self.latency_quantile(0.95))
+
+    def count(self, event: str):
+        self.events[event] = self.events.get(event, 0) + 1
+        LLM_GATEWAY_EVENTS.inc(self.name, event)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        p50, p95 = self.latency_quantile(0.5), self.latency_quantile(0.95)
+        return {
+            "model": self.name,
+            # 0 until the first call creates them
+            "clients": 0 if callable(self._clients) else len(self._clients),
+            "in_flight": sum(self.in_flight.values()),
+            "rpm": self.requests.per_minute,
+            "tpm": self.tokens.per_minute,
+            "budget_wait_s": round(self.wait_time(1, now), 2),
+            "latency_p50_s": round(p50, 3) if p50 is not None else None,
+            "latency_p95_s": round(p95, 3) if p95 is not None else None,
+            "events": dict(self.events),
+        }
+
+
+@dataclass
+class _Waiter:
+    lane: str
+    priority: int
+    seq: int
+    pool: ModelPool
+    tokens: int
+    future: asyncio.Future
+
+
+class LLMGateway:
+    """
+    Schedules every LLM call of this worker:
+
+    - at most `max_in_flight` calls at once, admitted in lane priority order
+      (cds, then chat, then batch) and only when the model's requests- and
+      tokens-per-minute budgets allow it
+    - retryable errors (429, 5xx, timeouts) are retried with jittered
+      exponential backoff, honouring Retry-After
+    - a call that waits too long for the primary's budget, or keeps failing on
+      it, falls over to the next model
+    - a non-streaming call slower than the model's recent p95 is hedged with a
+      second copy on another client when there is spare budget; the first
+      answer wins
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, pools: list[ModelPool], max_in_flight: int = 8, max_retries: int = 3,
+                 backoff_seconds: float = 0.5, backoff_max_seconds: float = 20.0, max_queue_seconds: float = 5.0,
+                 hedging: bool = True, hedge_min_seconds: float = 2.0, completion_tokens: int = 300):
+        self.pools = pools
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.max_queue_seconds = max_queue_seconds
+        self.hedging = hedging
+        self.hedge_min_seconds = hedge_min_seconds
+        # Reserved per call for the answer until the real usage is known
+        self.completion_tokens = completion_tokens
+        self._waiting: list[_Waiter] = []
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # --- admission ---
+
+    def _pump(self):
+        """Admit waiting calls in priority order while there are free slots and budget."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        blocked, wake = set(), None
+        for waiter in sorted(self._waiting, key=lambda w: (w.priority, w.seq)):
+            if self._in_flight >= self.max_in_flight:
+                break
+            if id(waiter.pool) in blocked:
+                continue
+            wait = waiter.pool.wait_time(waiter.tokens, now)
+            if wait > 0:
+                # Lower-priority calls for this model queue behind it; calls for other models can still go
+                blocked.add(id(waiter.pool))
+                wake = wait if wake is None else min(wake, wait)
+                continue
+            waiter.pool.take(waiter.tokens, now)
+            self._in_flight += 1
+            self._waiting.remove(waiter)
+            waiter.future.set_result(None)
+        if wake is not None and self._waiting:
+            self._timer = asyncio.get_running_loop().call_later(wake, self._pump)
+
+    async def _admit(self, pool: ModelPool, lane: str, seq: int, tokens: int, timeout: Optional[float]) -> bool:
+        """
+        Wait for a slot and budget on `pool`. Returns False once the call has
+        waited `timeout` seconds and the pool's budget is still what holds it
+        back; waiting only for a free slot never gives up, as another model
+        would not help.
+        """
+        waiter = _Waiter(lane, LANES.get(lane, LANES["chat"]), seq, pool, tokens,
+                         asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        start = time.monotonic()
+        self._pump()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    if waiter.future.done():
+                        break
+                    if pool.wait_time(tokens, time.monotonic()) > 0:
+                        waiter.future.cancel()
+                        self._waiting.remove(waiter)
+                        return False
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                # Admitted just as the caller went away: hand the slot back
+                self._release(pool)
+            else:
+                waiter.future.cancel()
+                self._waiting.remove(waiter)
+            raise
+        LLM_QUEUE_SECONDS.observe(time.monotonic() - start, lane)
+        return True
+
+    def _admit_now(self, pool: ModelPool, priority: int, tokens: int) -> bool:
+        """Admit a hedge only if it jumps no queue and the budget is there right now."""
+        if self._in_flight >= self.max_in_flight or any(w.priority <= priority for w in self._waiting):
+            return False
+        now = time.monotonic()
+        if pool.wait_time(tokens, now) > 0:
+            return False
+        pool.take(tokens, now)
+        self._in_flight += 1
+        return True
+
+    def _release(self, pool: ModelPool, reserved: int = 0, used: Optional[int] = None):
+        self._in_flight -= 1
+        if used is not None:
+            pool.tokens.adjust(used - reserved)
+        self._pump()
+
+    # --- retries and fallback ---
+
+    def _backoff(self, pool: ModelPool, error: BaseException, attempt: int) -> float:
+        """Delay before retrying after `error`; a 429 also holds back the pool's other calls."""
+        server_wait = retry_after(error)
+        if status_code(error) == 429:
+            pool.count("rate_limited")
+            if server_wait:
+                pool.requests.block(server_wait, time.monotonic())
+        else:
+            pool.count("error")
+        # Full jitter, so calls that failed together don't retry together
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt))
+        return max(delay, server_wait or 0.0)
+
+    async def _run(self, tokens: int, attempt_fn: Callable[[ModelPool, int], Awaitable[Any]]):
+        """
+        Admit and run `attempt_fn(pool, priority)` on the primary pool, retrying
+        and then falling over to the next pools. `attempt_fn` owns the admission
+        and must release it.
+        """
+        lane = llm_lane_var.get()
+        priority = LANES.get(lane, LANES["chat"])
+        seq = next(self._seq)
+        error = None
+        for position, pool in enumerate(self.pools):
+            has_fallback = position < len(self.pools) - 1
+            for attempt in range(self.max_retries + 1):
+                if not await self._admit(pool, lane, seq, tokens, self.max_queue_seconds if has_fallback else None):
+                    pool.count("queue_timeout")
+                    break
+                try:
+                    return await attempt_fn(pool, priority)
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    error = e
+                    delay = self._backoff(pool, e, attempt)
+                    if attempt == self.max_retries or (has_fallback and delay > self.max_queue_seconds):
+                        break
+                    pool.count("retry")
+                    await asyncio.sleep(delay)
+            if has_fallback:
+                pool.count("fallback")
+                log_event("llm_fallback", model=pool.name, fallback=self.pools[position + 1].name,
+                          lane=lane, error=str(error) if error else "queue timeout")
+        raise error
+
+    # --- calls ---
+
+    async def _call(self, pool: ModelPool, index: int, tokens: int, fn: Callable[[BaseChatModel], Awaitable[ChatResult]]):
+        pool.count("attempt")
+        pool.in_flight[index] += 1
+        start = time.monotonic()
+        used = None
+        try:
+            result = await fn(pool.clients[index])
+            pool.latencies.append(time.monotonic() - start)
+            used = used_tokens(result.generations[0].message) if result.generations else None
+            return result
+        finally:
+            pool.in_flight[index] -= 1
+            self._release(pool, tokens, used)
+
+    async def _hedged(self, pool: ModelPool, priority: int, tokens: int,
+                      fn: Callable[[BaseChatModel], Awaitable[ChatResult]]) -> ChatResult:
+        """Run `fn` on one client; if it runs past the hedge delay, race a copy on another client."""
+        first_index = pool.pick_client()
+        first = asyncio.create_task(self._call(pool, first_index, tokens, fn))
+        tasks = [first]
+        try:
+            delay = pool.hedge_delay(self.hedge_min_seconds) if self.hedging else None
+            if delay is not None:
+                done, _ = await asyncio.wait({first}, timeout=delay)
+                if not done and self._admit_now(pool, priority, tokens):
+                    pool.count("hedge")
+                    second = asyncio.create_task(self._call(pool, pool.pick_client(exclude=first_index), tokens, fn))
+                    tasks.append(second)
+                    pending, error = {first, second}, None
+                    while pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            if task.exception() is None:
+                                if task is second:
+                                    pool.count("hedge_won")
+                                return task.result()
+                            error = task.exception()
+                    raise error
+            return await first
+        finally:
+            # Also when the caller is cancelled mid-wait: a call left running would hold its slot and budget
+            for task in tasks:
+                task.cancel()
+
+    async def agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs) -> ChatResult:
+        tokens = estimate_prompt_tokens(messages) + self.completion_tokens
+
+        async def attempt(pool: ModelPool, priority: int) -> ChatResult:
+            return await self._hedged(pool, priority, tokens,
+                                      lambda client: client._agenerate(messages, stop=stop, **kwargs))
+
+        return await self._run(tokens, attempt)
+
+    async def astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                      **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        """Stream from one client. Failures before the first chunk are retried; later ones are raised."""
+        tokens = estimate_prompt_tokens(messages) + self.completion_tokens
+
+        async def attempt(pool: ModelPool, priority: int):
+            index = pool.pick_client()
+            pool.count("attempt")
+            pool.in_flight[index] += 1
+            stream = pool.clients[index]._astream(messages, stop=stop, **kwargs)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                pool.in_flight[index] -= 1
+                self._release(pool)
+                raise
+            return pool, index, stream, first
+
+        pool, index, stream, chunk = await self._run(tokens, attempt)
+        used = None
+        try:
+            while chunk is not None:
+                used = used_tokens(chunk.message) or used
+                yield chunk
+                chunk = await anext(stream, None)
+        finally:
+            pool.in_flight[index] -= 1
+            self._release(pool, tokens, used)
+            await stream.aclose()
+
+    def generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs) -> ChatResult:
+        """Blocking calls get retries and fallback, but skip the lanes and rate budgets."""
+        error = None
+        for pool in self.pools:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return pool.clients[pool.pick_client()]._generate(messages, stop=stop, **kwargs)
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    error = e
+                    if attempt < self.max_retries:
+                        time.sleep(self._backoff(pool, e, attempt))
+        raise error
+
+    def stats(self) -> dict:
+        waiting = {lane: 0 for lane in LANES}
+        for waiter in self._waiting:
+            waiting[waiter.lane] = waiting.get(waiter.lane, 0) + 1
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": waiting,
+            "models": [pool.stats() for pool in self.pools],
+        }
+
+
+class GatewayChatModel(BaseChatModel):
+    """LangChain chat model that sends every call through an LLMGateway."""
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self.gateway.generate(messages, stop, **kwargs)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return await self.gateway.agenerate(messages, stop, **kwargs)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.gateway.astream(messages, stop, **kwargs):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        # The primary model formats the tools for its API; every pool receives the same call arguments
+        bound = self.gateway.pools[0].clients[0].bind_tools(tools, **kwargs)
+        return self.bind(**bound.kwargs)
@@ -1,20 +1,57 @@
 # --- 1. Imports ---
 import os
+import json
+import time
+import uuid
+import asyncio
 from contextlib import asynccontextmanager
-from datetime import date
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, Field
-from langchain_core.messages import HumanMessage
-from graph import build_rag_graph
+from langchain_core.messages import HumanMessage, AIMessage
+from config_state import (
+    COMPRESSION_MODE, GUIDELINE_PATH, INDEX_DIR, INDEX_RELOAD_SECONDS, BATCH_MAX_ITEMS, READY_WAIT_SECONDS,
+    RERANK_ENABLED, CDS_GUIDELINES, embedding_model, llm_gateway,
+)
+from answer_cache import answer_cache
+from batch import answer_batch
+from card_cache import card_cache, generate_cards, missing_cds_guidelines
+from card_store import card_store
+from fhir_profile import PatientProfile, patient_profile, profile_query
+from nodes import index_version, activate_index, active_index, guideline_ids, guideline_names, query_text
+from index_store import load_index, build_index, current_version, guideline_sources
+from intent_router import intent_router
+from llm_gateway import llm_lane_var
+from reranker import reranker
+from telemetry import RequestIdMiddleware, record_cache, render_metrics, log_event
 
 
 # --- 2. Pydantic Models ---
 # For the /bot endpoint
 class AskBot(BaseModel):
     message: str
+    # Per-request override of the context compression mode (defaults to COMPRESSION_MODE)
+    compression: Optional[Literal["llm", "embedding", "none"]] = None
+    # Conversation id; each session gets its own checkpointer thread. A new one is issued when missing.
+    session_id: Optional[str] = None
+    # Guideline ids to retrieve from (see GET /index); all of them when missing
+    guidelines: Optional[List[str]] = None
+
+# For the /bot/batch endpoint
+class AskBatch(BaseModel):
+    messages: List[str] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+    compression: Optional[Literal["llm", "embedding", "none"]] = None
+    # Items compressed/generated at once; defaults to BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = Field(default=None, ge=1, le=64)
+    guidelines: Optional[List[str]] = None
+
+# For POST /index/ingest
+class IngestRequest(BaseModel):
+    # Re-embed every chunk instead of reusing the vectors of unchanged ones
+    force: bool = False
 
 # For the CDS Hooks service
 class Prefetch(BaseModel):
@@ -32,20 +69,149 @@ class CDSHookRequest(BaseModel):
 # --- 3. Global RAG App and Lifespan Manager ---
 # This global variable will hold our compiled RAG graph
 rag_app = None
+# Progress of the startup warm-up, reported by /health/ready
+startup = {"stage": "starting", "error": None, "timings": {}}
+_started_at = time.monotonic()
+_warm_up_task: Optional[asyncio.Task] = None
+_index_watch_task: Optional[asyncio.Task] = None
+# One index build and one swap at a time per worker
+_build_lock = asyncio.Lock()
+_swap_lock = asyncio.Lock()
+
+
+async def _timed(name: str, fn, *args):
+    """Run a blocking warm-up step in a thread, recording its duration."""
+    step = time.perf_counter()
+    result = await asyncio.to_thread(fn, *args)
+    startup["timings"][f"{name}_s"] = round(time.perf_counter() - step, 3)
+    return result
+
+
+def _build_graph():
+    """Open the prebuilt index and compile the graph. Importing graph pulls in langgraph, so it happens here."""
+    # A prebuilt index (python build_index.py) skips PDF parsing, chunking and embedding entirely
+    artifact = load_index(INDEX_DIR)
+    if artifact is not None:
+        activate_index(artifact)
+    missing = missing_cds_guidelines(guideline_ids())
+    if missing:
+        raise RuntimeError(f"CDS_GUIDELINES names guidelines the index doesn't have: {', '.join(missing)}")
+    if artifact is None:
+        # The guideline is ingested on the first medical query; only GUIDELINE_PATH is served that way
+        log_event("index_missing", index_dir=INDEX_DIR, guideline_path=GUIDELINE_PATH,
+                  unserved_guidelines=sorted(set(guideline_sources()) - set(guideline_ids())))
+    from graph import build_rag_graph
+    compiled = build_rag_graph()
+    log_event("graph_built", index_version=artifact.version if artifact else None)
+    version = artifact.version if artifact else index_version(GUIDELINE_PATH)
+    answer_cache.load(version)
+    # Cards precomputed by precompute_cards.py for this index version
+    card_store.open(version)
+    return compiled
+
+
+def _warm_embeddings():
+    """Load the embedding model and build the intent centroids, so the first query doesn't pay for it."""
+    embedding_model.model.load()
+    intent_router.classify("warm-up")
+
+
+async def warm_up():
+    """
+    Everything slow about startup, run as a background task so the server
+    answers /health/live (and binds its port) right away: the index, the graph,
+    the embedding model and the reranker (when enabled) load in parallel threads. /health/ready turns 200,
+    and held requests proceed, once rag_app is set.
+    """
+    global rag_app
+    start = time.perf_counter()
+    startup["stage"] = "loading"
+    try:
+        steps = [_timed("graph", _build_graph), _timed("embeddings", _warm_embeddings)]
+        if RERANK_ENABLED:
+            steps.append(_timed("reranker", reranker.load))
+        compiled, *_ = await asyncio.gather(*steps)
+    except Exception as e:
+        startup.update(stage="failed", error=f"{type(e).__name__}: {e}")
+        log_event("startup_failed", error=startup["error"])
+        raise
+    rag_app = compiled
+    startup["timings"]["total_s"] = round(time.perf_counter() - start, 3)
+    startup["stage"] = "ready"
+    log_event("startup", **startup["timings"], since_process_start_s=round(time.monotonic() - _started_at, 3))
+
+
+async def wait_until_ready() -> bool:
+    """
+    True once the warm-up has built the graph. Requests that arrive earlier wait
+    for it, up to READY_WAIT_SECONDS; False if it failed or is still running.
+    """
+    if rag_app is not None:
+        return True
+    if _warm_up_task is None:
+        return False
+    try:
+        await asyncio.wait_for(asyncio.shield(_warm_up_task), READY_WAIT_SECONDS)
+    except Exception:
+        # Timed out, or the warm-up failed (already logged)
+        pass
+    return rag_app is not None
+
+
+async def reload_index() -> Optional[str]:
+    """
+    Hot-swap to the version INDEX_DIR/CURRENT points at when it differs from
+    the one being served. Requests already retrieving finish on the old
+    artifact. Returns the new version, or None when nothing changed.
+    """
+    async with _swap_lock:
+        version = current_version(INDEX_DIR) if INDEX_DIR else None
+        serving = active_index()
+        if rag_app is None or version is None or (serving is not None and version == serving.version):
+            return None
+        artifact = await asyncio.to_thread(load_index, INDEX_DIR)
+        if artifact is None:
+            return None
+        missing = missing_cds_guidelines(artifact.guidelines)
+        if missing:
+            # Keep serving the current version rather than fail every CDS hook
+            log_event("index_swap_refused", version=artifact.version, missing_cds_guidelines=missing)
+            return None
+        activate_index(artifact)
+        log_event("index_swapped", previous=serving.version if serving else None, version=artifact.version,
+                  guidelines=list(artifact.guidelines))
+        return artifact.version
+
+
+async def watch_index():
+    """Pick up versions published by build_index.py or by /index/ingest in another worker."""
+    while True:
+        await asyncio.sleep(INDEX_RELOAD_SECONDS)
+        try:
+            await reload_index()
+        except Exception as e:
+            log_event("index_reload_error", error=f"{type(e).__name__}: {e}")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    This function runs once at application startup.
-    We build the RAG graph here to ensure it's a single, shared instance.
+    Runs at application startup and shutdown. Startup only schedules the
+    warm-up, so the process is live within the import time of this module.
     """
-    global rag_app
-    print("Application startup: Building shared RAG graph...")
-    rag_app = build_rag_graph()
-    print("Shared RAG graph built successfully.")
+    global _warm_up_task, _index_watch_task
+    _warm_up_task = asyncio.create_task(warm_up())
+    if INDEX_DIR and INDEX_RELOAD_SECONDS > 0:
+        _index_watch_task = asyncio.create_task(watch_index())
     yield
     # Code below yield runs on shutdown
-    print("Application shutdown.")
+    if _index_watch_task is not None:
+        _index_watch_task.cancel()
+    if not _warm_up_task.done():
+        _warm_up_task.cancel()
+    elif rag_app is not None:
+        answer_cache.save()
+    log_event("shutdown")
 
 
 # manager is defined, and the lifespan manager is correctly passed to it.
@@ -58,38 +224,73 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Request-ID"],
 )
+# Tags each request with an id (X-Request-ID) used in the structured logs, and times it for /metrics
+app.add_middleware(RequestIdMiddleware)
 
 
 # --- 4. Helper Function  ---
+def prefetch_profile(prefetch_data: Prefetch) -> PatientProfile:
+    """Canonical profile of the prefetched chart; charts with the same profile get the same card."""
+    return patient_profile(prefetch_data.patient, prefetch_data.conditions, prefetch_data.medications)
+
+
 def format_query_from_fhir(prefetch_data: Prefetch) -> str:
-    
-    patient = prefetch_data.patient or {}
-    conditions_bundle = prefetch_data.conditions or {}
-    meds_bundle = prefetch_data.medications or {}
-    try:
-        birth_date_str = patient.get("birthDate", "2000-01-01")
-        birth_date = date.fromisoformat(birth_date_str)
-        today = date.today()
-        age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
-    except (ValueError, TypeError):
-        age = "an unknown age"
-    gender = patient.get("gender", "unknown gender")
-    patient_summary = f"A {age}-year-old {gender} patient"
-    conditions_list = [entry.get("resource", {}).get("code", {}).get("text", "unspecified condition") for entry in conditions_bundle.get("entry", [])]
-    # has_hf = any("Vascular dementia, uncomplicated" in c.lower() for c in conditions_list)
-    # if not has_hf:
-    #     return "Patient does not have a recorded diagnosis of heart failure."
-    conditions_summary = f"with diagnoses including: {', '.join(conditions_list) if conditions_list else 'none listed'}"
-    meds_list = [entry.get("resource", {}).get("medicationCodeableConcept", {}).get("text", "unspecified medication") for entry in meds_bundle.get("entry", [])]
-    meds_summary = f"and is currently prescribed: {', '.join(meds_list) if meds_list else 'no active medications'}"
-    final_query = (
-        f"Based on the 2022 AHA/ACC/HFSA guidelines, what are the key recommendations "
-        f"for managing heart failure in the following clinical scenario? \n\n"
-        f"**Patient Profile:** {patient_summary} {conditions_summary} {meds_summary}. \n\n"
-        f"Please provide a concise, evidence-based summary."
+    return profile_query(prefetch_profile(prefetch_data), guideline_names(CDS_GUIDELINES or None))
+
+
+def chat_state(input: AskBot) -> dict:
+    """Initial graph state for a chat message."""
+    return {
+        'query': [HumanMessage(content=input.message)],
+        'guideline_path': GUIDELINE_PATH,
+        'guidelines': input.guidelines or [],
+        'compression': input.compression or COMPRESSION_MODE,
+        'compression_stats': None,
+        'rerank_stats': None,
+        'context_stats': None
+    }
+
+
+def check_guidelines(guidelines: Optional[List[str]]) -> Optional[JSONResponse]:
+    """A 400 response naming the requested guideline ids the served index doesn't have, or None."""
+    unknown = sorted(set(guidelines or []) - set(guideline_ids()))
+    if unknown:
+        return JSONResponse({"error": f"Unknown guidelines: {', '.join(unknown)}", "guidelines": guideline_ids()},
+                            status_code=400)
+    return None
+
+
+async def session_query(config: dict, message: str) -> str:
+    """
+    The query this turn is answered from: the thread's last HISTORY_WINDOW messages plus the new one,
+    joined as retrieval and generation see them. The answer cache is keyed on it, so a follow-up
+    question never matches an answer built from another session's history.
+    """
+    snapshot = await rag_app.aget_state(config)
+    history = (snapshot.values or {}).get('query') or []
+    return query_text(list(history) + [HumanMessage(content=message)])
+
+
+async def lookup_answer_cache(query: str, guidelines: Optional[List[str]] = None):
+    """Return (query_embedding, cached_entry) for a session_query(). Both are None when the cache is disabled."""
+    # Cached answers come from all guidelines, so questions routed to specific ones skip the cache
+    if not answer_cache.enabled or guidelines:
+        return None, None
+    query_embedding = await asyncio.to_thread(embedding_model.embed_query, query)
+    entry = answer_cache.lookup(query_embedding)
+    record_cache("answer", entry is not None)
+    return query_embedding, entry
+
+
+async def record_cached_turn(config: dict, message: str, answer: str):
+    """Add a turn answered from the cache to the session thread, so the next turn has it in its history."""
+    await rag_app.aupdate_state(
+        config,
+        {'query': [HumanMessage(content=message)], 'messages': [AIMessage(content=answer)], 'intent': 'medical'},
+        as_node='generation',
     )
-    return final_query
 
 
 # --- 5. API Endpoints ---
@@ -100,18 +301,230 @@ async def bot(input: AskBot):
     Endpoint for the Streamlit App.
     """
     
-    if rag_app is None:
-        return {"error": "RAG application is not initialized."}, 503
+    if not await wait_until_ready():
+        return JSONResponse({"error": "RAG application is not initialized."}, status_code=503)
 
-    config = {'configurable': {'thread_id': 'streamlit-thread-1'}} 
-    initial_state = {
-        'query': [HumanMessage(content=input.message)],
-        'guideline_path': 'data/HF_Guideline.pdf'
-    }
-    response = rag_app.invoke(input=initial_state, config=config)
+    error = check_guidelines(input.guidelines)
+    if error is not None:
+        return error
+    session_id = input.session_id or uuid.uuid4().hex
+    config = {'configurable': {'thread_id': f'chat-{session_id}'}}
+    # Read before the run: an answer from an index swapped out meanwhile isn't cached
+    cache_generation = answer_cache.generation
+    query = await session_query(config, input.message)
+    query_embedding, cached = await lookup_answer_cache(query, input.guidelines)
+    if cached is not None:
+        await record_cached_turn(config, input.message, cached.answer)
+        return {'output': cached.answer, 'cached': True, 'compression_stats': None, 'rerank_stats': None,
+                'context_stats': None, 'session_id': session_id}
+
+    response = await rag_app.ainvoke(input=chat_state(input), config=config)
 
     output = response['messages'][-1].content
-    return {'output': output}
+    # Only guideline answers are worth caching; general queries get a canned reply
+    if query_embedding is not None and response.get('intent') == 'medical':
+        answer_cache.store(query, query_embedding, output, generation=cache_generation)
+    return {'output': output, 'cached': False, 'compression_stats': response.get('compression_stats'),
+            'rerank_stats': response.get('rerank_stats'), 'context_stats': response.get('context_stats'),
+            'session_id': session_id}
+
+
+@app.post("/bot/batch")
+async def bot_batch(input: AskBatch):
+    """
+    Answer a list of independent questions in one call (e.g. an evaluation run).
+    Results come back in input order with per-item timings; `timings` covers the whole batch.
+    Batch items don't belong to a chat session.
+    """
+
+    if not await wait_until_ready():
+        return JSONResponse({"error": "RAG application is not initialized."}, status_code=503)
+
+    error = check_guidelines(input.guidelines)
+    if error is not None:
+        return error
+    # Bulk work yields the LLM to interactive chat and CDS hooks
+    llm_lane_var.set("batch")
+    results, timings = await answer_batch(input.messages, input.compression, input.max_concurrency, input.guidelines)
+    return {'results': results, 'timings': timings}
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/bot/stream")
+async def bot_stream(input: AskBot):
+    """
+    Streaming variant of /bot. Sends server-sent events:
+    `node` when a graph node finishes, `token` for each generated text chunk,
+    then `done` with the full answer, or `error`.
+    """
+
+    if not await wait_until_ready():
+        return JSONResponse({"error": "RAG application is not initialized."}, status_code=503)
+
+    error = check_guidelines(input.guidelines)
+    if error is not None:
+        return error
+    session_id = input.session_id or uuid.uuid4().hex
+
+    async def event_stream():
+        start = time.perf_counter()
+        first_token_at = None
+        yield sse_event("session", {"session_id": session_id})
+
+        config = {'configurable': {'thread_id': f'chat-{session_id}'}}
+        cache_generation = answer_cache.generation
+        query = await session_query(config, input.message)
+        query_embedding, cached = await lookup_answer_cache(query, input.guidelines)
+        if cached is not None:
+            await record_cached_turn(config, input.message, cached.answer)
+            first_token_at = time.perf_counter()
+            yield sse_event("token", {"text": cached.answer})
+            yield sse_event("done", {"output": cached.answer, "cached": True, "session_id": session_id})
+            log_event("stream", session_id=session_id, cached=True, ttft_ms=round((first_token_at - start) * 1000, 1))
+            return
+
+        tokens = []
+        output, intent, compression_stats, rerank_stats, context_stats = "", None, None, None, None
+        try:
+            async for mode, chunk in rag_app.astream(chat_state(input), config=config, stream_mode=["updates", "messages"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    # Only stream the answer; intent and compression LLM calls run in other nodes
+                    if metadata.get("langgraph_node") == "generation" and message_chunk.content:
+                        first_token_at = first_token_at or time.perf_counter()
+                        tokens.append(message_chunk.content)
+                        yield sse_event("token", {"text": message_chunk.content})
+                    continue
+
+                for node, update in chunk.items():
+                    yield sse_event("node", {"node": node})
+                    update = update or {}
+                    if node == "intent_classifier":
+                        intent = update.get("intent")
+                    elif node == "retrieve_documents":
+                        compression_stats = update.get("compression_stats")
+                    elif node == "rerank":
+                        rerank_stats = update.get("rerank_stats")
+                    elif node == "assemble_context":
+                        context_stats = update.get("context_stats")
+                    elif node in ("generation", "general_query"):
+                        output = update["messages"][-1].content
+                        if not tokens:
+                            # Model didn't stream (or canned reply): send the whole answer at once
+                            first_token_at = first_token_at or time.perf_counter()
+                            yield sse_event("token", {"text": output})
+        except Exception as e:
+            log_event("stream_error", session_id=session_id, error=str(e))
+            yield sse_event("error", {"error": str(e)})
+            return
+
+        if query_embedding is not None and intent == 'medical':
+            answer_cache.store(query, query_embedding, output, generation=cache_generation)
+        total = time.perf_counter() - start
+        ttft = (first_token_at - start) if first_token_at else total
+        log_event("stream", session_id=session_id, intent=intent, cached=False,
+                  ttft_ms=round(ttft * 1000, 1), total_ms=round(total * 1000, 1))
+        yield sse_event("done", {
+            "output": output,
+            "cached": False,
+            "compression_stats": compression_stats,
+            "rerank_stats": rerank_stats,
+            "context_stats": context_stats,
+            "session_id": session_id,
+            "ttft_ms": round(ttft * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+        })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/health/live")
+def liveness():
+    """The process is up and serving; 503 only if the startup warm-up failed (restart it)."""
+    body = {"status": "failed" if startup["stage"] == "failed" else "alive",
+            "uptime_s": round(time.monotonic() - _started_at, 1)}
+    return JSONResponse(body, status_code=503 if startup["stage"] == "failed" else 200)
+
+
+@app.get("/health/ready")
+def readiness():
+    """200 once the index, graph and embedding model are loaded; 503 (with the current stage) before."""
+    ready = rag_app is not None
+    return JSONResponse({"status": "ready" if ready else startup["stage"], **startup},
+                        status_code=200 if ready else 503)
+
+
+@app.get("/index")
+def index_info():
+    """The index version being served, its guidelines and the version INDEX_DIR/CURRENT points at."""
+    artifact = active_index()
+    return {
+        "version": artifact.version if artifact else None,
+        "current": current_version(INDEX_DIR) if INDEX_DIR else None,
+        "guidelines": artifact.manifest["guidelines"] if artifact else {gid: None for gid in guideline_ids()},
+    }
+
+
+@app.post("/index/ingest")
+async def ingest(input: IngestRequest = IngestRequest()):
+    """
+    Re-index GUIDELINES and the PDFs in GUIDELINE_DIR, embedding only new or
+    changed chunks, then hot-swap this worker to the new version. Other workers
+    follow within INDEX_RELOAD_SECONDS. Returns the build manifest.
+    """
+    if not INDEX_DIR:
+        return JSONResponse({"error": "INDEX_DIR is not set."}, status_code=400)
+    if not await wait_until_ready():
+        return JSONResponse({"error": "RAG application is not initialized."}, status_code=503)
+    async with _build_lock:
+        manifest = await asyncio.to_thread(build_index, guideline_sources(), INDEX_DIR, input.force)
+    swapped = await reload_index()
+    log_event("index_ingest", version=manifest["version"], swapped=swapped is not None,
+              chunks_embedded=manifest["chunks_embedded"], seconds=manifest["timings"]["total_s"])
+    return {**manifest, "swapped": swapped is not None}
+
+
+@app.post("/index/reload")
+async def index_reload():
+    """Hot-swap to INDEX_DIR/CURRENT now instead of waiting for the next check."""
+    swapped = await reload_index()
+    return {"swapped": swapped is not None, **index_info()}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters and size of the semantic answer cache."""
+    return answer_cache.stats()
+
+
+@app.delete("/cache")
+def clear_cache():
+    """Drop all cached answers and CDS cards."""
+    answer_cache.invalidate()
+    card_cache.invalidate()
+    return answer_cache.stats()
+
+
+@app.get("/cache/cards")
+def card_cache_stats():
+    """Hit/stale/coalesced counters of the CDS card cache and the precomputed card store."""
+    return {**card_cache.stats(), "store": card_store.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-node latency, LLM call/token, retrieval and cache metrics in Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/llm/stats")
+def llm_stats():
+    """Queue depth per lane, budgets, latency and retry/hedge/fallback counts of the LLM gateway."""
+    return llm_gateway.stats()
 
 
 # In your main.py file, replace the existing discovery function with this one.
@@ -129,7 +542,7 @@ def discovery():
                 "id": "heart-failure-guideline",
                 "hook": "patient-view",
                 "title": "Heart Failure Guideline Support",
-                "description": "Provides clinical guidance for Heart Failure management based on the 2022 AHA/ACC/HFSA guidelines.",
+                "description": f"Provides clinical guidance based on the {' and the '.join(guideline_names(CDS_GUIDELINES or None))}.",
                 "prefetch": {
                     "patient": "Patient/{{context.patientId}}",
                     # This is simpler and more likely to be supported
@@ -152,39 +565,25 @@ async def handle_hook(request: CDSHookRequest):
     The main CDS Service endpoint for the `patient-view` hook.
     """
 
-    if rag_app is None:
-        return {"error": "CDS service is not initialized."}, 503
-
-
-    query_input = format_query_from_fhir(request.prefetch)
-    # if "does not have" in query_input:
-    #     return {"cards": []}
+    if not await wait_until_ready():
+        return JSONResponse({"error": "CDS service is not initialized."}, status_code=503)
 
+    # A clinician is waiting on the chart: CDS calls go ahead of chat and batch work
+    llm_lane_var.set("cds")
 
-    initial_state = {
-        'query': [HumanMessage(content=query_input)],
-        'guideline_path': 'data/HF_Guideline.pdf'
-    }
-    config = {'configurable': {'thread_id': request.hookInstance}} # Use hookInstance for a unique thread per request
-    rag_response = rag_app.invoke(input=initial_state, config=config)
-    rag_result_text = rag_response['messages'][-1].content
-    card = {
-        "summary": "Heart Failure Guideline Recommendation",
-        "indicator": "info",
-        "detail": rag_result_text,
-        "source": {
-            "label": "2022 AHA/ACC/HFSA Guideline for HF Management",
-            "url": "https://hfsa.org/hfguidelines2022"
-        },
-              "links": [
-        {
-          "label": "Open Full CDSS Chatbot",
-          "url": "https://cds-frontend-app.ambitiouscliff-0211bfd7.eastus.azurecontainerapps.io",
-          "type": "absolute"
-        }
-      ]
-    }
-    return {"cards": [card]}
+    # Charts that reduce to the same profile share one card; identical concurrent hooks share one graph run
+    profile = prefetch_profile(request.prefetch)
+    if profile.key not in card_cache:
+        stored = card_store.get(profile.key)
+        if stored is not None:
+            # Keeps its original age, so an old precomputed card is refreshed like any stale one
+            card_cache.put(profile.key, stored.cards, created_at=stored.created_at)
+    cards, status = await card_cache.get_or_compute(
+        profile.key, lambda: generate_cards(rag_app, profile, thread_id=f"cds-{request.hookInstance}")
+    )
+    record_cache("cds_card", status in ("hit", "stale", "coalesced"))
+    log_event("cds_hook", hook=request.hook, profile=profile.key, card_cache=status)
+    return {"cards": cards}
 
 
 # --- 6. Main execution block ---
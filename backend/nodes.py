@@ -1,30 +1,184 @@
 import os
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain.retrievers.document_compressors import LLMChainExtractor
-from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
+import asyncio
+import hashlib
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain_core.messages import BaseMessage, AIMessage
-from config_state import ChatState, llm, embedding_model, structured_llm
+from langchain_core.messages import BaseMessage, AIMessage, RemoveMessage
+from config_state import (
+    ChatState, IntentChecker, llm, embedding_model, COMPRESSION_MODE,
+    INTENT_CLASSIFIER, INTENT_MIN_MARGIN, INTENT_LLM_ESCALATION, HISTORY_WINDOW,
+    RETRIEVAL_MODE, RETRIEVAL_K, HYBRID_CANDIDATES, RRF_K, CHUNK_SIZE, CHUNK_OVERLAP,
+    VECTOR_BACKEND, VECTOR_DTYPE, CONTEXT_PACKING, GUIDELINE_PATH, GUIDELINES, CHILD_CANDIDATES, PARENT_K,
+    RERANK_ENABLED, RERANK_CANDIDATES, RERANK_TOP_N, RERANK_BUDGET_MS,
+)
+from compression import compress_documents, estimate_tokens
+from context_packing import pack_context
+from answer_cache import answer_cache
+from card_cache import card_cache
+from card_store import card_store
+from intent_router import intent_router
+from reranker import reranker
+from sparse_index import BM25Index, hybrid_search, reciprocal_rank_fusion
+from index_store import GuidelineIndex, guideline_sources, guideline_titles
+from telemetry import record_cache, log_event
+from numpy_store import NumpyVectorStore, store_lock
 from dotenv import load_dotenv
 load_dotenv()
 
+PERSIST_DIRECTORY = 'chroma_db'
+# BM25 keyword index, persisted next to the Chroma directory
+SPARSE_INDEX_PATH = 'bm25_index.json'
+# Memory-mapped embedding matrix used when VECTOR_BACKEND=numpy
+NUMPY_STORE_DIRECTORY = 'vector_store'
+
 # Caching Variables
 _cached_docs = None
 _cached_chunks = None
 _cached_vector_store = None
-_cached_retriever = None
+_cached_sparse_index = None
+_cached_intent_llm = None
+# Prebuilt artifact being served (see index_store.py). activate_index replaces it in one assignment,
+# so a request that already picked it up finishes against the version it started with
+_active_index = None
+# Guideline id of the in-process index over GUIDELINE_PATH, used when there is no prebuilt artifact
+LOCAL_GUIDELINE = next(iter(guideline_sources(GUIDELINES, '')), 'local')
+# Serialises the one-time ingest work so concurrent requests don't build it twice
+_ingest_lock = asyncio.Lock()
+
+
+def activate_index(artifact):
+    """
+    Serve retrieval from a prebuilt index artifact (see index_store.py).
+    The graph is then built without the ingest nodes. Called again with a
+    newer artifact it hot-swaps the index and drops answers and cards
+    computed against the old one.
+    """
+    global _active_index
+    previous = _active_index
+    _active_index = artifact
+    if previous is not None and previous.version != artifact.version:
+        invalidate_caches(artifact.version)
+    log_event("index_activated", version=artifact.version,
+              chunks={g: report['chunks'] for g, report in artifact.manifest['guidelines'].items()})
+
+
+def active_index():
+    return _active_index
+
+
+def index_ready() -> bool:
+    """Whether retrieval can run without first ingesting the guideline."""
+    return _active_index is not None or _cached_vector_store is not None
+
 
-def intent_classifier(state: ChatState):
+def guideline_ids() -> list[str]:
+    """Guideline ids retrieval can be routed to."""
+    artifact = _active_index
+    return list(artifact.guidelines) if artifact is not None else [LOCAL_GUIDELINE]
+
+
+def guideline_names(guidelines: list[str] = None) -> list[str]:
     """
-    This function now includes logging to help debug the classification process.
+    Display names of the guidelines a query is answered from (the requested
+    ones, or all served): GUIDELINE_TITLES, else the PDF title recorded in the
+    manifest, else the id.
     """
-    print("--- INTENT CLASSIFICATION ---")
-    query = state['query']
-    print(f"Received query: {query}")
+    configured = guideline_titles()
+    artifact = _active_index
+    reports = artifact.manifest['guidelines'] if artifact is not None else {}
+    return [configured.get(g) or (reports.get(g) or {}).get('title') or f"{g} guideline"
+            for g in guidelines or guideline_ids()]
+
+
+def guideline_scope(names: list[str]) -> str:
+    """The guidelines as the prompts name them: 'the <title>', or a list of titles."""
+    if len(names) == 1:
+        return f"the {names[0]}"
+    return "these guidelines: " + "; ".join(names)
+
+
+async def ensure_index(guideline_path: str):
+    """Run the ingest nodes once, for callers that retrieve without going through the graph."""
+    if _cached_vector_store is None:
+        state = {'guideline_path': guideline_path}
+        state.update(await doc_loader(state))
+        state.update(await text_splitter(state))
+        await vector_db(state)
+    return _cached_vector_store, (_cached_sparse_index if RETRIEVAL_MODE == "hybrid" else None)
+
 
+async def guideline_indexes(guidelines: list[str] = None) -> list[GuidelineIndex]:
+    """
+    The indexes a query is routed to: the requested guidelines (all when
+    empty) of the active artifact or, without one, the in-process index over
+    GUIDELINE_PATH, built by the ingest nodes on first use.
+    """
+    artifact = _active_index
+    if artifact is not None:
+        return [artifact.guidelines[g] for g in (guidelines or artifact.guidelines)]
+    vector_store, sparse_index = await ensure_index(GUIDELINE_PATH)
+    return [GuidelineIndex(LOCAL_GUIDELINE, vector_store, sparse_index)]
+
+
+async def search_guidelines(indexes: list[GuidelineIndex], query: str, k: int = RETRIEVAL_K) -> list:
+    """Top-k from each guideline's own collection (hybrid or dense); rankings from several guidelines are fused with RRF."""
+    async def search(index: GuidelineIndex):
+        if RETRIEVAL_MODE == "hybrid" and index.sparse_index is not None:
+            return await hybrid_search(
+                index.vector_store, index.sparse_index, query, k=k, candidates=max(HYBRID_CANDIDATES, k), rrf_k=RRF_K
+            )
+        return await index.vector_store.asimilarity_search(query, k=k)
+
+    rankings = await asyncio.gather(*(search(index) for index in indexes))
+    if len(rankings) == 1:
+        return rankings[0]
+    return reciprocal_rank_fusion(rankings, k=RRF_K)[:k]
+
+
+def parent_sections(indexes: list[GuidelineIndex], children: list, k: int = PARENT_K) -> list:
+    """The parent sections of ranked children, in the order of their best child, each once; at most k."""
+    by_id = {index.id: index for index in indexes}
+    parents, seen = [], set()
+    for child in children:
+        index = by_id.get(child.metadata.get('guideline'))
+        key = (child.metadata.get('guideline'), child.metadata.get('parent'))
+        if index is None or index.parents is None or key in seen:
+            continue
+        seen.add(key)
+        parents.append(index.parents[child.metadata['parent']])
+        if len(parents) == k:
+            break
+    return parents
+
+
+async def retrieve_candidates(indexes: list[GuidelineIndex], query: str, k: int = None) -> tuple[list, bool]:
+    """
+    Top k chunks for the query (RETRIEVAL_K by default), or for a parent-child
+    index the sections of the best-matching children (PARENT_K by default).
+    Returns the documents and whether they are sections.
+    """
+    if any(index.parents is not None for index in indexes):
+        children = await search_guidelines(indexes, query, max(CHILD_CANDIDATES, k or 0))
+        return parent_sections(indexes, children, k or PARENT_K), True
+    return await search_guidelines(indexes, query, k or RETRIEVAL_K), False
+
+
+def query_text(query, window: int = HISTORY_WINDOW) -> str:
+    """Join the contents of the last `window` messages of the thread into one query string."""
+    if isinstance(query, list) and all(isinstance(msg, BaseMessage) for msg in query):
+        start = max(len(query) - window, 0)
+        return " ".join([msg.content for msg in query[start:] if hasattr(msg, 'content')])
+    raise ValueError("Expected 'query' to be a list of BaseMessage with 'content'.")
+
+
+def trim_history(query, window: int = HISTORY_WINDOW) -> list[RemoveMessage]:
+    """Messages older than the history window are never read again, so drop them from the thread state."""
+    # Sliced by position, since query[:-0] would keep everything
+    return [RemoveMessage(id=msg.id) for msg in query[:max(len(query) - window, 0)] if msg.id]
+
+
+async def llm_intent(query) -> str:
+    """Classify the query with the LLM. Raises if the API call fails."""
     classifier_prompt = f"""
     You are an intent classification assistant.
     Your job is to read the user's query and classify it into EXACTLY one category:
@@ -36,37 +190,71 @@ def intent_classifier(state: ChatState):
     User query:
     {query}
     """
-    
+    global _cached_intent_llm
+    if _cached_intent_llm is None:
+        # Binding the tool schema creates the primary model's clients, so it waits for the first escalation
+        _cached_intent_llm = llm.with_structured_output(IntentChecker)
+    result_obj = await _cached_intent_llm.ainvoke(classifier_prompt)
+    return result_obj.intent
+
+
+async def intent_classifier(state: ChatState):
+    """
+    Classify the query locally with the embedding router and only ask the LLM
+    when the router is unsure (or when INTENT_CLASSIFIER=llm).
+    """
+    query = state['query']
+    latest_query = query[-1].content
+    removed = trim_history(query)
+
+    # Query text stays out of the logs: it may carry patient details
+    local_intent, margin = await asyncio.to_thread(intent_router.classify, latest_query)
+    log_event("intent", classifier="router", intent=local_intent, margin=round(margin, 3))
+    if INTENT_CLASSIFIER == "embedding" and (margin >= INTENT_MIN_MARGIN or not INTENT_LLM_ESCALATION):
+        return {"intent": local_intent, "query": removed}
+
     try:
-        # We will try to invoke the LLM and see what happens
-        result_obj = structured_llm.invoke(classifier_prompt)
-        result_intent = result_obj.intent
-        print(f"LLM classified intent as: '{result_intent}'")
-        return {"intent": result_intent}
+        result_intent = await llm_intent(query_text(query))
+        log_event("intent", classifier="llm", intent=result_intent)
+        return {"intent": result_intent, "query": removed}
     except Exception as e:
-        # If there is any error (like an API key issue), we will log it
-        # and default to the 'general' path.
-        print(f"ERROR during intent classification: {e}")
-        print("Defaulting to 'general' intent due to error.")
-        return {"intent": "general"}
+        # Don't refuse clinical questions because the API failed: trust the local router instead
+        log_event("intent_error", error=str(e), fallback=local_intent)
+        return {"intent": local_intent, "query": removed}
 
 def general_query(state:ChatState):
     """Answer the general query"""
-    query=state['query']
-    result = "Hello! This Clinical Decision Support System is designed to answer questions strictly based on the 2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure. Your question does not appear to be related to this guideline, so I am unable to provide a response within the scope of this system."
+    names = guideline_names(state.get('guidelines'))
+    result = f"Hello! This Clinical Decision Support System is designed to answer questions strictly based on {guideline_scope(names)}. Your question does not appear to be related to {'this guideline' if len(names) == 1 else 'these guidelines'}, so I am unable to provide a response within the scope of this system."
+
+    # Replace rather than append, so a long chat thread doesn't accumulate canned replies.
+    # Candidates retrieved alongside the intent check are not needed
+    return {'messages': [AIMessage(content=result)], 'candidates': None}
 
-    # Preserve existing state if needed
-    state['messages'] = state.get('messages', []) + [AIMessage(content=result)]
-    return state
 
 
+def index_version(guideline_path: str) -> str:
+    """Cheap fingerprint of the guideline file and splitter settings."""
+    try:
+        stat = os.stat(guideline_path)
+        file_id = f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        file_id = "missing"
+    key = f"{guideline_path}|{file_id}|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
 
-def doc_loader(state: ChatState):
+async def doc_loader(state: ChatState):
     global _cached_docs
-    if _cached_docs is None:
-        guideline_path = state['guideline_path']
-        loader = PyMuPDFLoader(guideline_path)
-        _cached_docs = loader.load()
+    async with _ingest_lock:
+        record_cache("docs", _cached_docs is not None)
+        if _cached_docs is None:
+            # PyMuPDF, the splitter and Chroma are imported where they are used, so startup doesn't pay for them
+            from langchain_community.document_loaders import PyMuPDFLoader
+            guideline_path = state['guideline_path']
+            loader = PyMuPDFLoader(guideline_path)
+            # PDF parsing is CPU bound, keep it off the event loop
+            _cached_docs = await asyncio.to_thread(loader.load)
     return {'docs': _cached_docs}
 
 
@@ -79,116 +267,191 @@ def router(state: ChatState):
 
 
 
-def text_splitter(state: ChatState):
+async def text_splitter(state: ChatState):
     global _cached_chunks
-    if _cached_chunks is not None:
-        print("Using cached chunks")
-        return {'chunks': _cached_chunks}
-
-    docs = state['docs']
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-    )
-    chunks = splitter.split_documents(docs)
-    _cached_chunks = chunks
-    print("Created and cached chunks")
-    return {'chunks': chunks}
+    async with _ingest_lock:
+        record_cache("chunks", _cached_chunks is not None)
+        if _cached_chunks is not None:
+            return {'chunks': _cached_chunks}
+
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        docs = state['docs']
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+        chunks = await asyncio.to_thread(splitter.split_documents, docs)
+        _cached_chunks = chunks
+        log_event("chunks_created", chunks=len(chunks), chunk_size=CHUNK_SIZE)
+        return {'chunks': chunks}
+
+
+
+
+def invalidate_caches(version: str):
+    """Answers and cards computed against the old index may no longer match the new one."""
+    answer_cache.invalidate(version)
+    card_cache.invalidate()
+    card_store.open(version)
+
+
+def load_or_build_sparse_index(chunks, version: str) -> BM25Index:
+    """Load the persisted BM25 index if it matches the current index version, otherwise rebuild it."""
+    if os.path.exists(SPARSE_INDEX_PATH):
+        sparse_index = BM25Index.load(SPARSE_INDEX_PATH)
+        if sparse_index.version == version:
+            log_event("sparse_index_loaded", version=version, path=SPARSE_INDEX_PATH)
+            return sparse_index
+    sparse_index = BM25Index(chunks, version=version)
+    sparse_index.save(SPARSE_INDEX_PATH)
+    log_event("sparse_index_built", version=version, path=SPARSE_INDEX_PATH, chunks=len(chunks))
+    return sparse_index
+
+
+def load_or_build_numpy_store(chunks, version: str) -> tuple[NumpyVectorStore, bool]:
+    """Memory-map the saved NumPy store if it matches the current index version, otherwise rebuild it.
+    Returns the store and whether it was rebuilt."""
+    # Workers starting together take turns: the first one builds, the others map its build
+    with store_lock(NUMPY_STORE_DIRECTORY):
+        if NumpyVectorStore.saved_version(NUMPY_STORE_DIRECTORY) == version:
+            log_event("vector_store_loaded", backend="numpy", version=version)
+            return NumpyVectorStore.load(NUMPY_STORE_DIRECTORY, embedding_model), False
+        vector_store = NumpyVectorStore.from_documents(chunks, embedding_model, dtype=VECTOR_DTYPE, version=version)
+        # A new version directory: workers still mapping the old one are unaffected
+        vector_store.publish(NUMPY_STORE_DIRECTORY)
+        log_event("vector_store_built", backend="numpy", version=version, chunks=len(chunks))
+        # Reopen memory-mapped so this worker shares pages with the others
+        return NumpyVectorStore.load(NUMPY_STORE_DIRECTORY, embedding_model, documents=vector_store.documents), True
+
+
+async def vector_db(state: ChatState):
+    """Create or load vector database from chunks with lazy loading and caching"""
 
+    global _cached_vector_store, _cached_sparse_index
+    async with _ingest_lock:
+        if _cached_sparse_index is None and RETRIEVAL_MODE == "hybrid":
+            _cached_sparse_index = await asyncio.to_thread(
+                load_or_build_sparse_index, state['chunks'], index_version(state['guideline_path'])
+            )
+
+        record_cache("vector_store", _cached_vector_store is not None)
+        if _cached_vector_store is not None:
+            # Vector store already cached, reuse it
+            state['vector_store'] = _cached_vector_store
+            return state
+
+        if VECTOR_BACKEND == "numpy":
+            version = index_version(state['guideline_path'])
+            _cached_vector_store, built = await asyncio.to_thread(load_or_build_numpy_store, state['chunks'], version)
+            if built:
+                invalidate_caches(version)
+            state['vector_store'] = _cached_vector_store
+            return state
+
+        from langchain_chroma import Chroma
+        persist_directory = PERSIST_DIRECTORY
+
+        if os.path.exists(persist_directory) and os.listdir(persist_directory):
+            # Load existing vector store
+            _cached_vector_store = await asyncio.to_thread(
+                Chroma,
+                embedding_function=embedding_model,
+                persist_directory=persist_directory,
+                collection_name='sample'
+            )
+            log_event("vector_store_loaded", backend="chroma", path=persist_directory)
+        else:
+            # Create new vector store from chunks (embeds every chunk, so run it in a thread)
+            chunks = state['chunks']
+            _cached_vector_store = await asyncio.to_thread(
+                Chroma.from_documents,
+                documents=chunks,
+                embedding=embedding_model,
+                persist_directory=persist_directory,
+                collection_name='sample'
+            )
+            log_event("vector_store_built", backend="chroma", path=persist_directory, chunks=len(chunks))
+            # Answers cached against the old index may no longer match the new one
+            invalidate_caches(index_version(state['guideline_path']))
 
+    state['vector_store'] = _cached_vector_store
+    return state
 
 
-def vector_db(state: ChatState):
-    """Create or load vector database from chunks with lazy loading and caching"""
 
-    global _cached_vector_store
-    if _cached_vector_store is not None:
-        # Vector store already cached, reuse it
-        print("Using cached vector store")
-        state['vector_store'] = _cached_vector_store
-        return state
-
-    persist_directory = 'chroma_db'
-
-    if os.path.exists(persist_directory) and os.listdir(persist_directory):
-        # Load existing vector store
-        _cached_vector_store = Chroma(
-            embedding_function=embedding_model,
-            persist_directory=persist_directory,
-            collection_name='sample'
-        )
-        print("Loaded existing vector store")
-    else:
-        # Create new vector store from chunks
-        chunks = state['chunks']
-        _cached_vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embedding_model,
-            persist_directory=persist_directory,
-            collection_name='sample'
-        )
-        print("Created new vector store")
 
-    state['vector_store'] = _cached_vector_store
-    return state
+async def speculative_retrieval(state: ChatState):
+    """
+    Retrieve candidates while the intent is being classified, so a medical
+    query doesn't wait for classification and retrieval one after the other.
+    Skipped until the index is loaded: a general query shouldn't pay for the ingest.
+    """
+    if not index_ready():
+        return {'candidates': None}
+    indexes = await guideline_indexes(state.get('guidelines'))
+    pool = RERANK_CANDIDATES if RERANK_ENABLED else None
+    candidate_docs, sections = await retrieve_candidates(indexes, query_text(state['query']), pool)
+    return {'candidates': candidate_docs, 'candidate_sections': sections}
 
 
+async def retrieve_documents(state: ChatState):
+    """Retrieve relevant documents from the guidelines the query is routed to, then compress them."""
+    # Only the last HISTORY_WINDOW messages of the thread go into the retrieval query
+    query = query_text(state['query'])
+    indexes = await guideline_indexes(state.get('guidelines'))
 
+    # Retrieve documents (unless speculative_retrieval already did), then shrink them with the
+    # compression mode chosen for this request. Parent sections are already the focused context,
+    # and with the reranker on a wider pool is fetched for the rerank node to narrow down, so
+    # neither goes through compression
+    candidate_docs, sections = state.get('candidates'), state.get('candidate_sections')
+    speculative = candidate_docs is not None
+    if not speculative:
+        pool = RERANK_CANDIDATES if RERANK_ENABLED else None
+        candidate_docs, sections = await retrieve_candidates(indexes, query, pool)
+    mode = 'none' if sections or RERANK_ENABLED else state.get('compression') or COMPRESSION_MODE
+    retrieved_docs, compression_stats = await compress_documents(candidate_docs, query, mode)
+    log_event("retrieval", guidelines=[index.id for index in indexes], candidates=len(candidate_docs),
+              speculative=speculative, retrieved_docs=len(retrieved_docs), compression=compression_stats)
 
-def retrieve_documents(state: ChatState):
-    """Retrieve relevant documents based on query, with lazy loading and caching of the retriever."""
-    global _cached_retriever
+    return {"retrieved_docs": retrieved_docs, "compression_stats": compression_stats, "candidates": None}
 
-    query = state['query']
-    vector_store = state.get('vector_store')
 
-    # Extract plain query string from messages
-    if isinstance(query, list) and all(isinstance(msg, BaseMessage) for msg in query):
-        query = " ".join([msg.content for msg in query if hasattr(msg, 'content')])
-    else:
-        raise ValueError("Expected 'query' to be a list of BaseMessage with 'content'.")
-
-    # Load or reuse vector store
-    if not vector_store:
-        vector_store = Chroma(
-            embedding_function=embedding_model,
-            persist_directory='chroma_db',
-            collection_name='sample'
-        )
-        # Save vector_store in state for reuse
-        state['vector_store'] = vector_store
-
-    # Lazy load and cache retriever
-    if _cached_retriever is None:
-        base_retriever = vector_store.as_retriever(search_kwargs={'k': 7})
-        compressor = LLMChainExtractor.from_llm(llm)
-        _cached_retriever = ContextualCompressionRetriever(
-            base_retriever=base_retriever,
-            base_compressor=compressor
-        )
-        print("Retriever created and cached")
-    else:
-        print("Using cached retriever")
 
-    # Retrieve documents using cached retriever
-    retrieved_docs = _cached_retriever.invoke(query)
-    print(f"Retrieved {len(retrieved_docs)} relevant documents")
 
-    return {"retrieved_docs": retrieved_docs, "vector_store": vector_store}
+async def rerank(state: ChatState):
+    """Keep the RERANK_TOP_N retrieved chunks the cross-encoder scores highest (retrieval order when over budget)."""
+    query = query_text(state['query'])
+    docs, rerank_stats = await reranker.rerank(query, state['retrieved_docs'], RERANK_TOP_N, RERANK_BUDGET_MS)
+    log_event("rerank", **rerank_stats)
+    return {'retrieved_docs': docs, 'rerank_stats': rerank_stats}
 
 
+async def assemble_context(state: ChatState):
+    """Merge overlapping chunks, drop repeated sentences and fit the excerpts into the prompt-token budget."""
+    retrieved_docs = state['retrieved_docs']
+    if not CONTEXT_PACKING:
+        context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+        tokens = estimate_tokens(context)
+        return {'context': context, 'context_stats': {'tokens_before': tokens, 'tokens_after': tokens, 'reduction': 0.0}}
+    context, context_stats = await asyncio.to_thread(pack_context, retrieved_docs)
+    log_event("context", **context_stats)
+    return {'context': context, 'context_stats': context_stats}
 
 
-def generation(state: ChatState):
+async def generation(state: ChatState):
     """Generate response based on retrieved documents"""
-    query = state['query']
-    retrieved_docs = state['retrieved_docs']
-    context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+    query = query_text(state['query'])
+    context = state.get('context')
+    if context is None:
+        context = "\n\n".join([doc.page_content for doc in state['retrieved_docs']])
 
+    # Served guidelines, named from the manifest; braces would be read as template variables
+    scope = guideline_scope(guideline_names(state.get('guidelines'))).replace("{", "{{").replace("}", "}}")
     system_message = (
-        "You are a Clinical Decision Support Assistant trained on the 2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure.\n\n"
+        f"You are a Clinical Decision Support Assistant trained on {scope}.\n\n"
         "- Respond ONLY using the content retrieved from the guidelines.\n"
-        "- If the information is not available in the excerpts, respond with: This information is out of scope of the 2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure.\n"
+        f"- If the information is not available in the excerpts, respond with: This information is out of scope of {scope}.\n"
         "- Keep the response concise and clinically relevant."
     )
 
@@ -208,30 +471,6 @@ def generation(state: ChatState):
     chain = prompt | llm | parser
 
     # Invoke with proper inputs
-    result = chain.invoke({'context': context, 'query': query})
+    result = await chain.ainvoke({'context': context, 'query': query})
     return {'messages': [AIMessage(content=result)]}
 
-
-
-# state = {'guideline_path': 'data/HF_Guideline.pdf'}
-# doc_state = doc_loader({'guideline_path': 'data/HF_Guideline.pdf'})
-# split_state = text_splitter({'docs': doc_state['docs']})
-# chunks = split_state['chunks']
-# state = {'chunks': chunks}
-# vector_state = vector_db(state)
-# state.update({
-#     'query': 'What are the stages of heart failure?',
-# })
-# retrieved_state = retrieve_documents(state)
-# state.update(retrieved_state)
-# generated = generation(state)
-
-# print(doc_loader(state))
-# print(f"Chunks: {len(split_state['chunks'])}")
-# print(split_state['chunks'][0])
-# print(vector_state['vector_store'])  # Should show vector DB object
-# print(f"Retrieved: {len(retrieved_state['retrieved_docs'])}")
-# print(retrieved_state['retrieved_docs'][0].page_content)
-# print(generated['result'])
-
-
@@ -0,0 +1,216 @@
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Iterable, Optional
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_FILE = 'vectors.npy'
+DOCUMENTS_FILE = 'documents.json'
+META_FILE = 'meta.json'
+# A shared store directory holds one subdirectory per published version and CURRENT naming the live one
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = '.lock'
+# int8 stores round(v * 127); components of normalized vectors lie in [-1, 1]
+INT8_SCALE = 127.0
+# float16/int8 rows are converted to float32 this many at a time, so a query never copies the whole matrix
+SCORE_BLOCK_ROWS = 4096
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact top-k vector store over a (n_chunks, dim) matrix of normalized embeddings.
+
+    The matrix is saved as a .npy file and opened with mmap_mode='r', so every
+    uvicorn worker on the host shares the same pages through the OS page cache.
+    It can be stored as float32, float16 or int8. Search is one matrix-vector
+    product, and because the vectors are normalized the score is the cosine
+    similarity. float16 and int8 matrices are scored in blocks of rows, so a
+    query holds one float32 block at a time. The store is read-only once built.
+    """
+
+    def __init__(self, embedding: Embeddings, vectors: np.ndarray, documents: list[Document], version: str = ""):
+        if len(vectors) != len(documents):
+            raise ValueError(f"{len(vectors)} vectors but {len(documents)} documents")
+        self._embedding = embedding
+        self.vectors = vectors
+        self.documents = documents
+        self.version = version
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    # --- search ---
+
+    def _scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """Cosine scores of each query row against every stored vector: (n_queries, n_chunks)."""
+        if self.vectors.dtype == np.float32:
+            return query_vectors @ self.vectors.T
+        scores = np.empty((len(query_vectors), len(self.vectors)), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = query_vectors @ block.T
+        if self.vectors.dtype == np.int8:
+            scores /= INT8_SCALE
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, scores.shape[-1])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def similarity_search_by_vector_with_score(self, embedding: list[float], k: int = 4) -> list[tuple[Document, float]]:
+        query_vector = np.asarray(embedding, dtype=np.float32)[None, :]
+        scores = self._scores(query_vector)[0]
+        return [(self.documents[i], float(scores[i])) for i in self._top_k(scores, k)]
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4) -> list[list[Document]]:
+        """Top-k for a whole batch of query embeddings with a single matrix product."""
+        query_vectors = np.asarray(embeddings, dtype=np.float32)
+        scores = self._scores(query_vectors)
+        return [[self.documents[i] for i in self._top_k(row, k)] for row in scores]
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities in [-1, 1]
+        return lambda score: score
+
+    # --- building and persistence ---
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[list[dict]] = None, **kwargs: Any) -> list[str]:
+        raise NotImplementedError("NumpyVectorStore is read-only; rebuild it with from_documents")
+
+    @classmethod
+    def from_texts(cls, texts: list[str], embedding: Embeddings, metadatas: Optional[list[dict]] = None,
+                   dtype: str = "float32", version: str = "", **kwargs: Any) -> "NumpyVectorStore":
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        vectors = np.asarray(embedding.embed_documents(list(texts)), dtype=np.float32)
+        return cls.from_vectors(embedding, vectors, documents, dtype=dtype, version=version)
+
+    @classmethod
+    def from_vectors(cls, embedding: Embeddings, vectors: np.ndarray, documents: list[Document],
+                     dtype: str = "float32", version: str = "") -> "NumpyVectorStore":
+        """Build from precomputed embeddings, normalizing them and converting to the storage dtype."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if dtype == "int8":
+            vectors = np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+        elif dtype == "float16":
+            vectors = vectors.astype(np.float16)
+        elif dtype != "float32":
+            raise ValueError(f"Unsupported dtype: {dtype!r}")
+        return cls(embedding, vectors, documents, version=version)
+
+    def save(self, path: str, include_documents: bool = True):
+        """
+        Write the store into path, which must not hold one yet: other workers
+        may have the files memory-mapped, so they are never rewritten. Use
+        publish() for a directory that is reused across rebuilds.
+        """
+        if os.path.exists(os.path.join(path, META_FILE)):
+            raise FileExistsError(f"{path} already holds a vector store; publish() a new version instead")
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, VECTORS_FILE), np.ascontiguousarray(self.vectors))
+        if include_documents:
+            with open(os.path.join(path, DOCUMENTS_FILE), 'w', encoding='utf-8') as f:
+                json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents], f)
+        with open(os.path.join(path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"version": self.version, "dtype": str(self.vectors.dtype), "shape": list(self.vectors.shape)}, f)
+
+    def publish(self, path: str) -> str:
+        """
+        Save as a new version under path and point path/CURRENT at it. The
+        version is written to a scratch directory and renamed into place, so
+        workers that have the previous version mapped keep reading it intact.
+        The caller holds store_lock(path). Returns the version directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        name = self.version or "store"
+        target = os.path.join(path, name)
+        if os.path.exists(target):
+            # Published before (a version directory is never modified), e.g. when switching back to it
+            if NumpyVectorStore.saved_version(target) != self.version:
+                raise FileExistsError(f"{target} holds another version")
+        else:
+            partial_path = tempfile.mkdtemp(dir=path, prefix=f".{name}.")
+            try:
+                self.save(partial_path)
+                os.rename(partial_path, target)
+            except BaseException:
+                shutil.rmtree(partial_path, ignore_errors=True)
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=path, prefix=f".{CURRENT_FILE}.")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(name)
+            os.replace(tmp_path, os.path.join(path, CURRENT_FILE))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return target
+
+    @staticmethod
+    def _resolve(path: str) -> str:
+        """The live version directory of a published store, or path itself for a plain save()."""
+        try:
+            with open(os.path.join(path, CURRENT_FILE), 'r', encoding='utf-8') as f:
+                name = f.read().strip()
+        except OSError:
+            return path
+        return os.path.join(path, name) if name else path
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings, documents: Optional[list[Document]] = None,
+             mmap: bool = True) -> "NumpyVectorStore":
+        """
+        Open a saved (or the live published) store. Pass `documents` when the same chunks are already in
+        memory (e.g. from the BM25 index) to avoid holding a second copy.
+        """
+        path = cls._resolve(path)
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r' if mmap else None)
+        if documents is None:
+            with open(os.path.join(path, DOCUMENTS_FILE), 'r', encoding='utf-8') as f:
+                documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in json.load(f)]
+        return cls(embedding, vectors, documents, version=meta.get("version", ""))
+
+    @staticmethod
+    def saved_version(path: str) -> Optional[str]:
+        try:
+            with open(os.path.join(NumpyVectorStore._resolve(path), META_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f).get("version")
+        except OSError:
+            return None
+
+
+@contextmanager
+def store_lock(path: str):
+    """Exclusive lock on a shared store directory across processes, held while a worker checks and rebuilds it."""
+    import fcntl
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
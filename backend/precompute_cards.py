@@ -0,0 +1,166 @@
+"""
+Precompute CDS cards for a patient census before clinic opens.
+
+Reads a file of prefetch bundles: one JSON object per line (or a JSON array).
+Each object has the shape of the Prefetch model in main.py, i.e.
+{"patient": {...}, "conditions": {...}, "medications": {...}}; a full hook
+request with a "prefetch" field also works. Patients are de-duplicated by
+their normalized profile. Each distinct profile goes through the same
+prompt and RAG graph as the patient-view hook, on a bounded worker pool.
+The cards are appended to the card store (CARD_STORE_PATH) that
+handle_hook serves from.
+
+Profiles already in the store for the current index version are skipped
+while their cards are younger than --max-age (CARD_CACHE_TTL_SECONDS by
+default, the age at which the hook starts treating them as stale), so
+rerunning after a crash or interruption resumes where it stopped, and a
+scheduled run refreshes cards before they go stale.
+
+    python precompute_cards.py --census census.jsonl --workers 4
+"""
+import argparse
+import asyncio
+import json
+import time
+from config_state import INDEX_DIR, GUIDELINE_PATH, CARD_STORE_PATH, CARD_CACHE_TTL_SECONDS
+
+
+def read_census(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        items = json.loads(text)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [item.get("prefetch", item) for item in items]
+
+
+async def precompute(census_path: str, store_path: str, workers: int, retries: int, force: bool,
+                     max_age: float = CARD_CACHE_TTL_SECONDS) -> dict:
+    timings = {}
+    start = time.perf_counter()
+
+    step = time.perf_counter()
+    # Same profile and prompt code as the hook (format_query_from_fhir), so the keys match what handle_hook looks up
+    from main import Prefetch, prefetch_profile
+    from graph import build_rag_graph
+    from nodes import activate_index, index_version
+    from index_store import load_index
+    from card_cache import generate_cards, missing_cds_guidelines
+    from card_store import CardStore
+    from telemetry import LLM_CALLS, NODE_SECONDS
+    from llm_gateway import llm_lane_var
+
+    # Precomputing yields the LLM budget to live CDS hooks and chat on a shared worker
+    llm_lane_var.set("batch")
+
+    artifact = load_index(INDEX_DIR)
+    if artifact is not None:
+        activate_index(artifact)
+        missing = missing_cds_guidelines(artifact.guidelines)
+        if missing:
+            raise SystemExit(f"CDS_GUIDELINES names guidelines the index doesn't have: {', '.join(missing)}")
+    rag_app = build_rag_graph()
+    version = artifact.version if artifact else index_version(GUIDELINE_PATH)
+    # Only fresh records count as done; older ones would be served stale or dropped by the hook
+    store = CardStore(store_path, max_age_seconds=max_age)
+    store.open(version)
+    timings["startup_s"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    prefetches = read_census(census_path)
+    profiles = {}
+    invalid = 0
+    for item in prefetches:
+        try:
+            profile = prefetch_profile(Prefetch(**item))
+        except Exception as e:
+            invalid += 1
+            print(f"Skipping invalid prefetch: {e}")
+            continue
+        profiles.setdefault(profile.key, profile)
+    done_keys = set() if force else store.keys()
+    pending = [profile for key, profile in profiles.items() if key not in done_keys]
+    timings["dedup_s"] = time.perf_counter() - step
+    print(f"{len(prefetches)} patients, {len(profiles)} distinct profiles, "
+          f"{len(profiles) - len(pending)} already in the store, {len(pending)} to compute")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for profile in pending:
+        queue.put_nowait(profile)
+    computed, failed = 0, []
+    run_seconds = []
+
+    async def worker(worker_id: int):
+        nonlocal computed
+        while True:
+            try:
+                profile = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for attempt in range(retries + 1):
+                run_start = time.perf_counter()
+                try:
+                    cards = await generate_cards(rag_app, profile, thread_id=f"precompute-{profile.key}")
+                    break
+                except Exception as e:
+                    print(f"[worker {worker_id}] profile {profile.key} attempt {attempt + 1} failed: {e}")
+            else:
+                # Left out of the store, so the next run picks it up again
+                failed.append(profile.key)
+                continue
+            run_seconds.append(time.perf_counter() - run_start)
+            store.append(profile.key, cards)
+            computed += 1
+            if computed % 10 == 0 or computed == len(pending):
+                elapsed = time.perf_counter() - generation_start
+                print(f"{computed}/{len(pending)} profiles, {computed / elapsed * 60:.1f} profiles/min")
+
+    generation_start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(max(1, workers))))
+    timings["generation_s"] = time.perf_counter() - generation_start
+    wall = time.perf_counter() - start
+
+    llm_calls = int(sum(LLM_CALLS.values().values()))
+    calls_per_run = llm_calls / computed if computed else 0.0
+    covered = len(prefetches) - invalid
+    # Patients that shared a profile with another one would each have cost a graph run
+    duplicates = covered - len(profiles)
+    node_timings = {labels[0]: round(total, 3) for labels, (count, total) in NODE_SECONDS.totals().items()}
+    return {
+        "index_version": version,
+        "patients": len(prefetches),
+        "invalid": invalid,
+        "profiles": len(profiles),
+        "resumed": len(profiles) - len(pending),
+        "computed": computed,
+        "failed": len(failed),
+        "failed_keys": failed,
+        "patients_per_min": round(covered / wall * 60, 1) if wall else 0.0,
+        "profiles_per_min": round(computed / timings["generation_s"] * 60, 1) if timings["generation_s"] else 0.0,
+        "llm_calls": llm_calls,
+        "llm_calls_saved_by_dedup": round(duplicates * calls_per_run),
+        "graph_run_p50_s": round(sorted(run_seconds)[len(run_seconds) // 2], 3) if run_seconds else None,
+        "stage_s": {name: round(value, 3) for name, value in timings.items()},
+        "node_s": node_timings,
+        "total_s": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--census", required=True, help="JSON lines (or JSON array) of prefetch bundles")
+    parser.add_argument("--store", default=CARD_STORE_PATH or "card_store.jsonl", help="card store to append to")
+    parser.add_argument("--workers", type=int, default=4, help="graph runs in flight at once")
+    parser.add_argument("--retries", type=int, default=1, help="extra attempts per profile before giving up")
+    parser.add_argument("--force", action="store_true", help="recompute profiles already in the store")
+    parser.add_argument("--max-age", type=float, default=CARD_CACHE_TTL_SECONDS,
+                        help="seconds after which stored cards are recomputed (default CARD_CACHE_TTL_SECONDS)")
+    args = parser.parse_args()
+
+    report = asyncio.run(precompute(args.census, args.store, args.workers, args.retries, args.force, args.max_age))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
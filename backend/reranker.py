@@ -0,0 +1,109 @@
+"""
+Local cross-encoder reranking between retrieval and context packing (RERANK_ENABLED).
+
+Retrieval fetches a wider pool (RERANK_CANDIDATES). The cross-encoder
+scores every (question, chunk) pair in batched forward passes on the CPU,
+and the best RERANK_TOP_N chunks are kept. This replaces the per-chunk LLM
+compression calls. The pass has a time budget (RERANK_BUDGET_MS). When the
+budget runs out, or the model is busy with another request, the request goes
+on with the retrieval order. A late pass stops at the next batch boundary.
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+from langchain.schema import Document
+from config_state import RERANKER_MODEL, RERANK_BATCH_SIZE
+from telemetry import log_event
+
+
+class CrossEncoderReranker:
+    """Lazily loaded sentence-transformers CrossEncoder; load() can be called ahead of time (startup warm-up)."""
+
+    def __init__(self, model_name: str, max_length: int = 512, batch_size: int = RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.batch_size = max(1, batch_size)
+        self._model = None
+        self._load_lock = threading.Lock()
+        # One forward pass at a time: they are CPU bound and would only slow each other down
+        self._predict_lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.busy = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                    except ImportError as e:
+                        raise RuntimeError("RERANK_ENABLED needs sentence-transformers: pip install sentence-transformers") from e
+                    start = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device='cpu')
+                    log_event("reranker_loaded", model=self.model_name, seconds=round(time.perf_counter() - start, 3))
+        return self._model
+
+    def score(self, query: str, docs: list[Document], deadline: float = None) -> Optional[list[float]]:
+        """
+        Relevance of each doc to the query, from forward passes of batch_size pairs.
+        With a deadline (time.monotonic()), None when the model is busy with
+        another request or the deadline passes between batches.
+        """
+        model = self.load()
+        # Without a deadline, wait for the model; with one, waiting would only eat the budget
+        if not self._predict_lock.acquire(blocking=deadline is None):
+            self.busy += 1
+            return None
+        try:
+            pairs = [(query, doc.page_content) for doc in docs]
+            scores = []
+            for start in range(0, len(pairs), self.batch_size):
+                if deadline is not None and time.monotonic() > deadline:
+                    return None
+                batch = pairs[start:start + self.batch_size]
+                scores.extend(model.predict(batch, batch_size=len(batch), show_progress_bar=False))
+        finally:
+            self._predict_lock.release()
+        return [float(score) for score in scores]
+
+    async def rerank(self, query: str, docs: list[Document], top_n: int, budget_ms: float = 0) -> tuple[list[Document], dict]:
+        """Return the top_n docs by cross-encoder score (the first top_n as retrieved when over budget), and stats."""
+        start = time.perf_counter()
+        scores = None
+        if len(docs) > 1:
+            self.calls += 1
+            deadline = time.monotonic() + budget_ms / 1000 if budget_ms else None
+            try:
+                scores = await asyncio.wait_for(asyncio.to_thread(self.score, query, docs, deadline),
+                                                budget_ms / 1000 if budget_ms else None)
+            except asyncio.TimeoutError:
+                # The pass stops in its thread at the next batch; later ones skip reranking until it has
+                pass
+            if scores is None:
+                self.timeouts += 1
+        if scores is None:
+            kept = docs[:top_n]
+        else:
+            order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+            kept = [docs[i] for i in order[:top_n]]
+        stats = {
+            "model": self.model_name,
+            "candidates": len(docs),
+            "kept": len(kept),
+            "timed_out": len(docs) > 1 and scores is None,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        return kept, stats
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "loaded": self.loaded, "calls": self.calls, "timeouts": self.timeouts,
+                "busy": self.busy}
+
+
+reranker = CrossEncoderReranker(RERANKER_MODEL)
@@ -0,0 +1,154 @@
+"""
+Section-aware chunking for the parent-child index (CHUNKING=parent_child).
+
+The guideline is read as PyMuPDF text blocks. A heading starts a new parent
+section that runs until the next heading, or until PARENT_MAX_CHARS when a
+section is long. A heading is a short line set larger or bolder than the body
+text, such as "7.3.1. Diuretics and Decongestion Strategies". Running headers
+and footers repeated across pages are dropped.
+
+Every block of a parent is cut into children of at most CHILD_MAX_CHARS on
+sentence boundaries. Fragments shorter than CHILD_MIN_CHARS, such as the
+COR/LOE cells of a recommendation table, are glued to the block that follows,
+so a recommendation row stays one child. Children are embedded and searched,
+and retrieval hands their parent section to generation (see
+nodes.parent_sections).
+"""
+import re
+from collections import Counter
+from langchain.schema import Document
+from compression import split_sentences
+
+# Headings are short and don't end like a sentence
+HEADING_MAX_CHARS = 150
+# Points above the body font size that make a line a heading on size alone
+HEADING_SIZE_DELTA = 1.0
+# Shorter blocks (table cells, COR/LOE labels, list numbers) are joined to the next one
+CHILD_MIN_CHARS = 60
+# PyMuPDF span flag for bold text
+BOLD_FLAG = 16
+_PAGE_NUMBER = re.compile(r"^(page\s*)?\d+(\s*of\s*\d+)?$", re.IGNORECASE)
+
+
+def read_blocks(path: str) -> tuple[list[dict], int]:
+    """Text blocks in reading order with their page, mean font size and boldness; plus the page count."""
+    import pymupdf
+
+    blocks = []
+    with pymupdf.open(path) as doc:
+        pages = len(doc)
+        for page_number, page in enumerate(doc):
+            for block in page.get_text("dict")["blocks"]:
+                if block.get("type") != 0:
+                    continue
+                lines = [" ".join(span["text"].strip() for span in line["spans"] if span["text"].strip())
+                         for line in block["lines"]]
+                spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+                text = "\n".join(line for line in lines if line).strip()
+                if not text:
+                    continue
+                chars = sum(len(span["text"]) for span in spans)
+                blocks.append({
+                    "text": text,
+                    "page": page_number,
+                    "size": sum(span["size"] * len(span["text"]) for span in spans) / chars,
+                    "bold": sum(len(span["text"]) for span in spans if span["flags"] & BOLD_FLAG) * 2 > chars,
+                })
+    return blocks, pages
+
+
+def body_font_size(blocks: list[dict]) -> float:
+    """Font size of the bulk of the text (median weighted by characters)."""
+    weighted = sorted((block["size"], len(block["text"])) for block in blocks)
+    half, seen = sum(chars for _, chars in weighted) / 2, 0
+    for size, chars in weighted:
+        seen += chars
+        if seen >= half:
+            return size
+    return 0.0
+
+
+def is_heading(block: dict, body_size: float) -> bool:
+    text = block["text"]
+    if len(text) > HEADING_MAX_CHARS or text.count("\n") > 1 or text.endswith((".", ",", ";")):
+        return False
+    return block["size"] >= body_size + HEADING_SIZE_DELTA or (block["bold"] and len(text.split()) > 1)
+
+
+def drop_page_furniture(blocks: list[dict], pages: int) -> list[dict]:
+    """Remove page numbers and running headers/footers (the same text on a third of the pages or more)."""
+    counts = Counter(block["text"] for block in blocks)
+    repeated = {text for text, count in counts.items() if count >= max(3, pages // 3)}
+    return [block for block in blocks if block["text"] not in repeated and not _PAGE_NUMBER.match(block["text"])]
+
+
+def split_child(text: str, max_chars: int) -> list[str]:
+    """Cut a block into pieces of at most max_chars on sentence boundaries (a longer sentence stays whole)."""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return [text]
+    pieces, current = [], ""
+    for sentence in split_sentences(text):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sections(path: str, child_max_chars: int, parent_max_chars: int) -> tuple[list[str], list[Document], list[Document]]:
+    """
+    Parse a guideline PDF into (page texts, children, parents). Each child's
+    metadata holds the index of its parent in `parents` under "parent".
+    """
+    blocks, pages = read_blocks(path)
+    page_texts = ["" for _ in range(pages)]
+    for block in blocks:
+        page_texts[block["page"]] += block["text"] + "\n"
+    blocks = drop_page_furniture(blocks, pages)
+    body_size = body_font_size(blocks)
+
+    parents: list[Document] = []
+    children: list[Document] = []
+    section = {"title": "", "blocks": [], "continued": False}
+
+    def close_parent():
+        if not section["blocks"]:
+            return
+        parent_id = len(parents)
+        first_page = section["blocks"][0]["page"]
+        text = "\n".join(block["text"] for block in section["blocks"])
+        if section["continued"] and section["title"]:
+            text = f"{section['title']} (continued)\n{text}"
+        parents.append(Document(
+            page_content=text,
+            metadata={"source": path, "page": first_page, "end_page": section["blocks"][-1]["page"],
+                      "section": section["title"], "parent": parent_id},
+        ))
+        pending = ""
+        for block in section["blocks"]:
+            text = f"{pending} {block['text']}".strip() if pending else block["text"]
+            if len(text) < CHILD_MIN_CHARS and block is not section["blocks"][-1]:
+                pending = text
+                continue
+            pending = ""
+            for piece in split_child(text, child_max_chars):
+                children.append(Document(page_content=piece, metadata={
+                    "source": path, "page": block["page"], "section": section["title"], "parent": parent_id,
+                }))
+        section["blocks"] = []
+
+    for block in blocks:
+        if is_heading(block, body_size):
+            close_parent()
+            section.update(title=" ".join(block["text"].split()), continued=False)
+        elif section["blocks"] and sum(len(b["text"]) for b in section["blocks"]) + len(block["text"]) > parent_max_chars:
+            # Long section: continue it in another parent under the same title
+            close_parent()
+            section["continued"] = True
+        section["blocks"].append(block)
+    close_parent()
+    return page_texts, children, parents
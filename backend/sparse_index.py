@@ -0,0 +1,133 @@
+import asyncio
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+import numpy as np
+from langchain.schema import Document
+
+# Guideline text uses symbols that matter for matching ("LVEF ≤40%"); spell them out
+# so they survive tokenization and match queries typed with either form.
+_SYMBOLS = {"≤": " le", "≥": " ge", "<=": " le", ">=": " ge", "–": "-", "—": "-"}
+_TOKEN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*%?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has how in is it of on or should the to was were what when which with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase keyword tokens that keep clinical terms like sglt2i, nyha, le40% or class-iii intact."""
+    text = text.lower()
+    for symbol, replacement in _SYMBOLS.items():
+        text = text.replace(symbol, replacement)
+    # "le 40%" and "le40%" should be the same token
+    text = re.sub(r"\b(le|ge)\s+(?=\d)", r"\1", text)
+    tokens = []
+    for token in _TOKEN.findall(text):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        # "crt-d" or "sacubitril/valsartan" should also match "crt" or "valsartan"
+        if "-" in token or "/" in token:
+            tokens.extend(part for part in re.split(r"[-/]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 keyword index over the guideline chunks.
+
+    Postings are stored per term as parallel arrays of chunk ids and term
+    frequencies, so a query is a handful of vectorized NumPy updates.
+    """
+
+    def __init__(self, documents: list[Document], k1: float = 1.5, b: float = 0.75, version: str = ""):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.version = version
+        postings = defaultdict(lambda: ([], []))
+        lengths = []
+        for doc_id, doc in enumerate(documents):
+            counts = Counter(tokenize(doc.page_content))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                ids, tfs = postings[term]
+                ids.append(doc_id)
+                tfs.append(tf)
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if lengths else 0.0
+        n = len(documents)
+        self.postings = {}
+        self.idf = {}
+        for term, (ids, tfs) in postings.items():
+            self.postings[term] = (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            df = len(ids)
+            self.idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int) -> list[Document]:
+        """Return the top-k chunks by BM25 score (chunks without any query term are never returned)."""
+        if not self.documents:
+            return []
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            scores[ids] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        matched = np.flatnonzero(scores)
+        if matched.size == 0:
+            return []
+        k = min(k, matched.size)
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [self.documents[i] for i in top]
+
+    def save(self, path: str):
+        """Persist the chunks; postings are cheap to rebuild on load."""
+        data = {
+            "version": self.version,
+            "k1": self.k1,
+            "b": self.b,
+            "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in data["documents"]]
+        return cls(documents, k1=data["k1"], b=data["b"], version=data["version"])
+
+
+def doc_key(doc: Document) -> tuple:
+    """Identity of a chunk across retrievers (dense and sparse return separate Document objects)."""
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int = 60) -> list[Document]:
+    """Fuse several ranked lists: score(d) = sum over lists of 1 / (k + rank of d)."""
+    scores: dict[tuple, float] = {}
+    docs: dict[tuple, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+async def hybrid_search(vector_store, sparse_index: BM25Index, query: str, k: int, candidates: int,
+                        rrf_k: int = 60) -> list[Document]:
+    """Run the dense and BM25 retrievers concurrently and fuse their top `candidates` with RRF."""
+    dense, sparse = await asyncio.gather(
+        vector_store.asimilarity_search(query, k=candidates),
+        asyncio.to_thread(sparse_index.search, query, candidates),
+    )
+    return reciprocal_rank_fusion([dense, sparse], k=rrf_k)[:k]
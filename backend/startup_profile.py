@@ -0,0 +1,36 @@
+"""
+Import-time profile of main.py, shared by `benchmark.py startup` and the
+test that keeps the heavy libraries out of `import main`.
+"""
+import json
+import re
+import subprocess
+import sys
+
+# Must not be imported by `import main`: they load in the background warm-up or on first use
+LAZY_MODULES = ("torch", "sentence_transformers", "onnxruntime", "langchain_huggingface", "chromadb",
+                "langchain_chroma", "langchain_groq", "fitz", "langchain_community")
+
+
+def import_profile(env: dict) -> tuple[float, dict, list[str]]:
+    """
+    `python -X importtime -c "import main"` in a fresh interpreter. Returns the
+    seconds spent importing main, self time per top-level package and the
+    LAZY_MODULES that got imported anyway.
+    """
+    code = "import json, sys, main; print(json.dumps(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                          capture_output=True, text=True, check=True)
+    total, packages = 0.0, {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(4)
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_us / 1e6
+        if name == "main":
+            total = cumulative_us / 1e6
+    modules = json.loads(proc.stdout.strip().splitlines()[-1])
+    imported = sorted({m.split(".")[0] for m in modules} & set(LAZY_MODULES))
+    return total, packages, imported
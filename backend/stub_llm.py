@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, AsyncIterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Words that make the stub classify a query as "medical"
+MEDICAL_KEYWORDS = (
+    "heart", "cardi", "hf", "ejection", "patient", "guideline", "therapy", "drug",
+    "medication", "echocardiograph", "prognosis", "sodium", "fluid", "diabetes",
+    "crt", "nyha", "lvef", "sglt2", "diuretic", "beta", "arni", "mortality",
+)
+
+
+def stub_answer(text: str, words: int = 40) -> str:
+    """Short deterministic echo of the prompt, tagged with a digest of it."""
+    digest = hashlib.sha1(text.encode()).hexdigest()[:8]
+    return f"[stub {digest}] " + " ".join(text.split()[:words])
+
+
+def stub_intent(text: str) -> str:
+    """Keyword intent of the user query in an intent-classifier prompt."""
+    # Only look at the user query, not the instructions in the prompt
+    text = text.split("User query:")[-1].lower()
+    return "medical" if any(k in text for k in MEDICAL_KEYWORDS) else "general"
+
+
+def stub_usage(prompt: str, answer: str) -> dict:
+    """Rough token counts (~4 characters per token) so usage metrics have something to show."""
+    prompt_tokens = len(prompt) // 4 + 1
+    completion_tokens = len(answer) // 4 + 1
+    return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic offline stand-in for ChatGroq used by the benchmarks.
+    It sleeps for `latency` seconds to mimic a network round trip and answers
+    with a short echo of the last message, so runs are repeatable.
+    """
+    latency: float = 0.5
+    response_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        text = str(messages[-1].content) if messages else ""
+        return stub_answer(text, self.response_words)
+
+    def _usage(self, messages: List[BaseMessage], answer: str) -> dict:
+        return stub_usage("".join(str(m.content) for m in messages), answer)
+
+    def _message(self, messages: List[BaseMessage], tools: Optional[list] = None) -> AIMessage:
+        if tools:
+            # Structured output: call the first tool with the keyword intent, like Groq's tool calling
+            text = str(messages[-1].content) if messages else ""
+            name = tools[0]["function"]["name"]
+            tool_call = {"name": name, "args": {"intent": stub_intent(text)},
+                         "id": "call_" + hashlib.sha1(text.encode()).hexdigest()[:8]}
+            return AIMessage(content="", tool_calls=[tool_call], usage_metadata=self._usage(messages, name))
+        answer = self._respond(messages)
+        return AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, kwargs.get("tools")))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if kwargs.get("tools"):
+            # A tool call arrives whole, as one chunk, like Groq's streamed tool calls
+            await asyncio.sleep(self.latency)
+            message = self._message(messages, kwargs["tools"])
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=message.usage_metadata,
+                tool_call_chunks=[{"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": 0}
+                                  for c in message.tool_calls]))
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+            return
+        # Half the latency before the first token, the rest spread over the remaining words
+        answer = self._respond(messages)
+        words = answer.split(" ")
+        await asyncio.sleep(self.latency / 2)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.latency / 2 / len(words))
+            # Chunk usage is summed when chunks are merged, so report it once, on the last one
+            usage = self._usage(messages, answer) if i == len(words) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word, usage_metadata=usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools: list, *, tool_choice: Any = None, **kwargs: Any):
+        """Bind OpenAI-format tools; the default with_structured_output builds on this."""
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Optional
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Id of the HTTP request being served; set by RequestIdMiddleware and read by every log line
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50)
+
+
+def log_event(event: str, **fields):
+    """One JSON log line tagged with the current request id."""
+    record = {"ts": round(time.time(), 3), "event": event, "request_id": request_id_var.get(), **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+# --- Prometheus metrics ---
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {total:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def totals(self) -> dict[tuple, tuple[int, float]]:
+        """(count, sum) of the observations for each label set."""
+        with self._lock:
+            return {values: (series[len(self.buckets)], series[-1]) for values, series in self._series.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                labels = _format_labels(self.labels, values)
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = _format_labels(self.labels, values, 'le="%g"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                total = series[len(self.buckets)]
+                bucket_labels = _format_labels(self.labels, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {total}")
+                lines.append(f"{self.name}_sum{labels} {series[-1]:g}")
+                lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("cdss_request_duration_seconds", "HTTP request latency, including the streamed body",
+                            ("method", "path", "status"))
+NODE_SECONDS = Histogram("cdss_node_duration_seconds", "Wall time of each graph node", ("node",))
+NODE_ERRORS = Counter("cdss_node_errors_total", "Graph node invocations that raised", ("node",))
+LLM_CALLS = Counter("cdss_llm_calls_total", "LLM calls made by each graph node", ("node",))
+LLM_TOKENS = Counter("cdss_llm_tokens_total", "LLM tokens used by each graph node", ("node", "kind"))
+RETRIEVED_DOCS = Histogram("cdss_retrieved_docs", "Documents passed on to generation per query", ("node",),
+                           buckets=COUNT_BUCKETS)
+CACHE_EVENTS = Counter("cdss_cache_events_total", "Cache lookups by cache and result", ("cache", "result"))
+LLM_GATEWAY_EVENTS = Counter("cdss_llm_gateway_events_total",
+                             "LLM gateway attempts, retries, hedges, fallbacks and rate limits", ("model", "event"))
+LLM_QUEUE_SECONDS = Histogram("cdss_llm_queue_seconds", "Time LLM calls waited for a slot and rate budget", ("lane",))
+
+METRICS = (REQUEST_SECONDS, NODE_SECONDS, NODE_ERRORS, LLM_CALLS, LLM_TOKENS, RETRIEVED_DOCS, CACHE_EVENTS,
+           LLM_GATEWAY_EVENTS, LLM_QUEUE_SECONDS)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+# --- per-node tracing ---
+
+@dataclass
+class NodeTrace:
+    node: str
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache: dict = field(default_factory=dict)
+
+
+_node_trace: ContextVar[Optional[NodeTrace]] = ContextVar("node_trace", default=None)
+# Called with (node, seconds) after every traced node run, e.g. by benchmark.py for exact per-node percentiles
+node_listeners: list = []
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup and attach it to the node currently running, if any."""
+    result = "hit" if hit else "miss"
+    CACHE_EVENTS.inc(cache, result)
+    trace = _node_trace.get()
+    if trace is not None:
+        trace.cache[cache] = result
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """Counts LLM calls and token usage against the graph node that made them."""
+
+    # Run in the caller's context so the node's ContextVar is visible
+    run_inline = True
+
+    def on_llm_end(self, response, **kwargs):
+        trace = _node_trace.get()
+        node = trace.node if trace is not None else "none"
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+        if not (prompt_tokens or completion_tokens):
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+        LLM_CALLS.inc(node)
+        LLM_TOKENS.inc(node, "prompt", amount=prompt_tokens)
+        LLM_TOKENS.inc(node, "completion", amount=completion_tokens)
+        if trace is not None:
+            trace.llm_calls += 1
+            trace.prompt_tokens += prompt_tokens
+            trace.completion_tokens += completion_tokens
+
+
+llm_usage_callback = LLMUsageCallback()
+
+
+def traced_node(name: str, fn):
+    """
+    Wrap a graph node so each run records its wall time, LLM calls and tokens,
+    cache hits and retrieved-doc count, and logs them with the request id.
+    """
+
+    @wraps(fn)
+    async def node(state):
+        trace = NodeTrace(node=name)
+        token = _node_trace.set(trace)
+        start = time.perf_counter()
+        status = "ok"
+        update = None
+        try:
+            update = await fn(state) if asyncio.iscoroutinefunction(fn) else fn(state)
+            return update
+        except Exception:
+            status = "error"
+            NODE_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _node_trace.reset(token)
+            NODE_SECONDS.observe(elapsed, name)
+            for listener in node_listeners:
+                listener(name, elapsed)
+            fields = {"node": name, "status": status, "duration_ms": round(elapsed * 1000, 1)}
+            if trace.llm_calls:
+                fields.update(llm_calls=trace.llm_calls, prompt_tokens=trace.prompt_tokens,
+                              completion_tokens=trace.completion_tokens)
+            if trace.cache:
+                fields["cache"] = trace.cache
+            if isinstance(update, dict) and update.get("retrieved_docs") is not None:
+                RETRIEVED_DOCS.observe(len(update["retrieved_docs"]), name)
+                fields["retrieved_docs"] = len(update["retrieved_docs"])
+            log_event("node", **fields)
+
+    return node
+
+
+# --- request ids ---
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that gives each HTTP request an id (the X-Request-ID header
+    when the client sends one), echoes it in the response and times the request
+    until its last body chunk, so streamed responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Route template rather than the raw path keeps label cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(elapsed, scope["method"], path, str(status))
+            if path != "/metrics":
+                log_event("request", method=scope["method"], path=path, status=status,
+                          duration_ms=round(elapsed * 1000, 1))
+            request_id_var.reset(token)
@@ -1,6 +1,8 @@
 import streamlit as st
 import requests
 import os
+import json
+import uuid
 
 # --- Final Configuration ---
 # This code now ONLY uses an environment variable to find the backend.
@@ -8,6 +10,14 @@ import os
 # For local testing with docker-compose, the 'docker-compose.yml' can set this.
 # For Azure, the 'az containerapp' command sets this.
 BACKEND_URL = os.getenv("BACKEND_API_URL", "http://127.0.0.1:8000/bot")
+# Server-sent events variant of the same endpoint, used to render tokens as they arrive
+BACKEND_STREAM_URL = os.getenv("BACKEND_STREAM_URL", BACKEND_URL.rstrip("/") + "/stream")
+
+# Progress messages shown while the graph runs, keyed by the node that just finished
+NODE_STATUS = {
+    "intent_classifier": "Searching the guideline...",
+    "retrieve_documents": "Generating response...",
+}
 
 
 st.set_page_config(
@@ -25,10 +35,35 @@ st.title("Heart Failure Management CDSS - 2022 AHA/ACC/HFSA")
 if 'message_history' not in st.session_state:
     st.session_state['message_history'] = []
 
+# One backend conversation thread per browser session
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+
 for message in st.session_state['message_history']:
     with st.chat_message(message['role']):
         st.markdown(message['content'])
 
+def stream_answer(payload, status):
+    """
+    POST to the streaming endpoint and yield answer tokens as they arrive.
+    Node progress is shown in `status`.
+    """
+    with requests.post(BACKEND_STREAM_URL, json=payload, stream=True, timeout=(10, 300)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "token":
+                    yield data["text"]
+                elif event == "node" and data["node"] in NODE_STATUS:
+                    status.caption(NODE_STATUS[data["node"]])
+                elif event == "error":
+                    raise RuntimeError(data["error"])
+
+
 user_input = st.chat_input('Type here')
 
 if user_input:
@@ -36,16 +71,17 @@ if user_input:
     with st.chat_message('user'):
         st.markdown(user_input)
 
-    with st.spinner("Processing and generating response..."):
-        try:
-            payload = {"message": user_input}
-            response = requests.post(BACKEND_URL, json=payload)
-            response.raise_for_status()
-            bot_response_text = response.json()["output"]
-            with st.chat_message('assistant'):
-                st.markdown(bot_response_text)
-            st.session_state['message_history'].append({'role': 'assistant', 'content': bot_response_text})
-        except requests.exceptions.RequestException as e:
-            st.error(f"Failed to connect to the backend. Details: {e}")
-        except KeyError:
-            st.error("Error: Received an unexpected format from the backend.")
\ No newline at end of file
+    try:
+        payload = {"message": user_input, "session_id": st.session_state['session_id']}
+        with st.chat_message('assistant'):
+            status = st.empty()
+            status.caption("Processing...")
+            bot_response_text = st.write_stream(stream_answer(payload, status))
+            status.empty()
+        st.session_state['message_history'].append({'role': 'assistant', 'content': bot_response_text})
+    except requests.exceptions.RequestException as e:
+        st.error(f"Failed to connect to the backend. Details: {e}")
+    except (KeyError, ValueError):
+        st.error("Error: Received an unexpected format from the backend.")
+    except RuntimeError as e:
+        st.error(f"The backend failed to answer. Details: {e}")
\ No newline at end of file
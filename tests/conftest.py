@@ -0,0 +1,41 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+# Settings are read when config_state is imported, so they are set before any test module imports the backend.
+# The stub model keeps the tests offline, and no index, answer cache or card store on disk is picked up.
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("STUB_LLM_LATENCY", "0")
+os.environ.setdefault("INDEX_DIR", "")
+os.environ.setdefault("INDEX_RELOAD_SECONDS", "0")
+os.environ.setdefault("ANSWER_CACHE_PATH", "")
+os.environ.setdefault("CARD_STORE_PATH", "")
+
+# The backend modules import each other as top-level modules (uvicorn runs with backend/ as the working directory)
+sys.path.insert(0, BACKEND_DIR)
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic unit vectors: equal texts embed the same, different texts are nearly orthogonal."""
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+
+    def embed_query(self, text: str) -> list[float]:
+        rng = np.random.default_rng(int(hashlib.sha1(text.encode()).hexdigest()[:8], 16))
+        vector = rng.normal(size=self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def embeddings() -> HashEmbeddings:
+    return HashEmbeddings()
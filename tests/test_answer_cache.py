@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+import main
+from answer_cache import SemanticAnswerCache
+from config_state import HISTORY_WINDOW
+from graph import build_rag_graph
+
+
+@pytest.fixture
+def app_state(monkeypatch, embeddings):
+    monkeypatch.setattr(main, "rag_app", build_rag_graph())
+    monkeypatch.setattr(main, "embedding_model", embeddings)
+    monkeypatch.setattr(main, "answer_cache", SemanticAnswerCache())
+
+
+def thread(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id}}
+
+
+async def answer(session_id: str, message: str, output: str) -> tuple[str, object]:
+    """One /bot turn as far as the cache goes: look up, and on a miss store the answer and add the turn."""
+    query = await main.session_query(thread(session_id), message)
+    embedding, cached = await main.lookup_answer_cache(query)
+    if cached is None:
+        main.answer_cache.store(query, embedding, output)
+    await main.record_cached_turn(thread(session_id), message, cached.answer if cached else output)
+    return query, cached
+
+
+# --- SemanticAnswerCache ---
+
+def test_lookup_hits_only_above_the_threshold(embeddings):
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("What is HFrEF?", embeddings.embed_query("What is HFrEF?"), "about HFrEF")
+    assert cache.lookup(embeddings.embed_query("What is HFrEF?")).answer == "about HFrEF"
+    assert cache.lookup(embeddings.embed_query("What is HFpEF?")) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(embeddings):
+    cache = SemanticAnswerCache(max_entries=2)
+    for query in ("a", "b"):
+        cache.store(query, embeddings.embed_query(query), query)
+    cache.lookup(embeddings.embed_query("a"))
+    cache.store("c", embeddings.embed_query("c"), "c")
+    assert cache.lookup(embeddings.embed_query("b")) is None
+    assert cache.lookup(embeddings.embed_query("a")) is not None
+    assert cache.evictions == 1
+
+
+def test_entries_expire(embeddings):
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store("a", embeddings.embed_query("a"), "a")
+    next(iter(cache._entries.values())).created_at = time.time() - 61
+    assert cache.lookup(embeddings.embed_query("a")) is None
+    assert cache.expirations == 1
+
+
+def test_answer_generated_before_an_invalidate_is_not_stored(embeddings):
+    cache = SemanticAnswerCache()
+    generation = cache.generation
+    cache.invalidate("v2")
+    cache.store("a", embeddings.embed_query("a"), "answer from v1", generation=generation)
+    assert cache.lookup(embeddings.embed_query("a")) is None
+    cache.store("a", embeddings.embed_query("a"), "answer from v2", generation=cache.generation)
+    assert cache.lookup(embeddings.embed_query("a")).answer == "answer from v2"
+
+
+# --- session keys ---
+
+def test_first_turn_is_keyed_on_the_message(app_state):
+    assert asyncio.run(main.session_query(thread("new"), "What is HFrEF?")) == "What is HFrEF?"
+
+
+def test_follow_up_is_keyed_on_the_history_window(app_state):
+    async def run():
+        for i in range(HISTORY_WINDOW + 1):
+            await main.record_cached_turn(thread("a"), f"question {i}", f"answer {i}")
+        return await main.session_query(thread("a"), "and then?")
+
+    messages = [f"question {i}" for i in range(HISTORY_WINDOW + 1)] + ["and then?"]
+    assert asyncio.run(run()) == " ".join(messages[-HISTORY_WINDOW:])
+
+
+def test_follow_up_does_not_hit_another_sessions_answer(app_state):
+    async def run():
+        await answer("a", "What is HFrEF?", "about HFrEF")
+        await answer("a", "What is the first-line treatment?", "HFrEF treatment")
+        await answer("b", "What is HFpEF?", "about HFpEF")
+        return await answer("b", "What is the first-line treatment?", "HFpEF treatment")
+
+    query, cached = asyncio.run(run())
+    assert query == "What is HFpEF? What is the first-line treatment?"
+    assert cached is None
+
+
+def test_same_history_hits_and_records_the_turn(app_state):
+    async def run():
+        await answer("a", "What is HFrEF?", "about HFrEF")
+        await answer("a", "What is the first-line treatment?", "HFrEF treatment")
+        _, first = await answer("c", "What is HFrEF?", "unused")
+        _, second = await answer("c", "What is the first-line treatment?", "unused")
+        snapshot = await main.rag_app.aget_state(thread("c"))
+        return first, second, snapshot.values
+
+    first, second, values = asyncio.run(run())
+    # The second hit needs the first cached turn in session c's history
+    assert first.answer == "about HFrEF"
+    assert second.answer == "HFrEF treatment"
+    assert values["messages"][-1].content == "HFrEF treatment"
+
+
+# --- index swaps during a request ---
+
+class SwapDuringRun:
+    """The compiled graph, except that the run swaps the index (invalidating the caches) before it answers."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getattr__(self, name):
+        return getattr(self.graph, name)
+
+    async def ainvoke(self, input, config):
+        main.answer_cache.invalidate("v2")
+        return {"messages": [AIMessage(content="answer from v1")], "intent": "medical"}
+
+    async def astream(self, input, config, stream_mode):
+        yield "updates", {"intent_classifier": {"intent": "medical"}}
+        main.answer_cache.invalidate("v2")
+        yield "updates", {"generation": {"messages": [AIMessage(content="answer from v1")]}}
+
+
+@pytest.fixture
+def swapping_app(app_state, monkeypatch):
+    monkeypatch.setattr(main, "rag_app", SwapDuringRun(main.rag_app))
+
+
+def test_bot_does_not_cache_an_answer_from_a_swapped_out_index(swapping_app):
+    response = asyncio.run(main.bot(main.AskBot(message="What is HFrEF?")))
+    assert response["output"] == "answer from v1"
+    assert main.answer_cache.stats()["entries"] == 0
+
+
+def test_stream_does_not_cache_an_answer_from_a_swapped_out_index(swapping_app):
+    async def run():
+        response = await main.bot_stream(main.AskBot(message="What is HFrEF?"))
+        return [event async for event in response.body_iterator]
+
+    events = asyncio.run(run())
+    assert any(event.startswith("event: done") for event in events)
+    assert main.answer_cache.stats()["entries"] == 0
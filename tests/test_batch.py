@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+import batch
+from answer_cache import SemanticAnswerCache
+
+HF_TITLE = "2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure"
+
+
+@pytest.fixture
+def batch_state(monkeypatch, embeddings):
+    monkeypatch.setattr(batch, "embedding_model", embeddings)
+    monkeypatch.setattr(batch, "answer_cache", SemanticAnswerCache())
+
+
+def test_general_reply_names_only_the_requested_guidelines(batch_state, monkeypatch):
+    async def classify(messages, embeddings):
+        return ["general"] * len(messages)
+
+    monkeypatch.setattr(batch, "classify_batch", classify)
+    results, _ = asyncio.run(batch.answer_batch(["Tell me a joke"], guidelines=["ckd"]))
+    assert "the ckd guideline" in results[0]["output"]
+    assert HF_TITLE not in results[0]["output"]
+
+
+def test_batch_of_cache_hits_skips_classification(batch_state, embeddings, monkeypatch):
+    for question in ("What is HFrEF?", "What is HFpEF?"):
+        batch.answer_cache.store(question, embeddings.embed_query(question), f"cached {question}")
+
+    class Router:
+        def classify_embeddings(self, embeddings):
+            raise AssertionError("nothing left to classify")
+
+    monkeypatch.setattr(batch, "intent_router", Router())
+    results, _ = asyncio.run(batch.answer_batch(["What is HFrEF?", "What is HFpEF?"]))
+    assert [r["output"] for r in results] == ["cached What is HFrEF?", "cached What is HFpEF?"]
+    assert all(r["cached"] for r in results)
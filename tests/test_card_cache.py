@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+from card_cache import CardCache
+
+
+class Computation:
+    """Counts runs; each run waits until released and returns cards numbered by run."""
+
+    def __init__(self):
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> list[dict]:
+        self.runs += 1
+        run = self.runs
+        await self.release.wait()
+        return [{"summary": f"run {run}"}]
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = CardCache()
+
+    async def run():
+        compute = Computation()
+        callers = [asyncio.create_task(cache.get_or_compute("p", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        results = await asyncio.gather(*callers)
+        return compute.runs, results
+
+    runs, results = asyncio.run(run())
+    assert runs == 1
+    assert [status for _, status in results] == ["miss"] + ["coalesced"] * 4
+    assert all(cards == [{"summary": "run 1"}] for cards, _ in results)
+    assert cache.stats()["graph_runs_saved_rate"] == 0.8
+    assert cache.stats()["inflight"] == 0
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_computation():
+    cache = CardCache()
+
+    async def run():
+        compute = Computation()
+        first = asyncio.create_task(cache.get_or_compute("p", compute))
+        second = asyncio.create_task(cache.get_or_compute("p", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        compute.release.set()
+        return await second
+
+    cards, status = asyncio.run(run())
+    assert (cards, status) == ([{"summary": "run 1"}], "coalesced")
+    assert "p" in cache
+
+
+def test_fresh_stale_and_expired_entries():
+    cache = CardCache(ttl_seconds=60, stale_seconds=60)
+
+    async def run():
+        compute = Computation()
+        compute.release.set()
+        cache.put("fresh", [{"summary": "fresh"}])
+        cache.put("stale", [{"summary": "stale"}], created_at=time.time() - 90)
+        cache.put("expired", [{"summary": "expired"}], created_at=time.time() - 150)
+        results = [await cache.get_or_compute(key, compute) for key in ("fresh", "stale", "expired")]
+        # Let the background refresh of the stale entry finish
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return compute.runs, results
+
+    runs, results = asyncio.run(run())
+    assert results == [([{"summary": "fresh"}], "hit"), ([{"summary": "stale"}], "stale"),
+                       ([{"summary": "run 2"}], "miss")]
+    assert runs == 2
+    assert cache.refreshes == 1
+    assert asyncio.run(cache.get_or_compute("stale", Computation())) == ([{"summary": "run 1"}], "hit")
+
+
+def test_a_stale_entry_is_refreshed_once_at_a_time():
+    cache = CardCache(ttl_seconds=60, stale_seconds=60)
+
+    async def run():
+        compute = Computation()
+        cache.put("p", [{"summary": "old"}], created_at=time.time() - 90)
+        statuses = [(await cache.get_or_compute("p", compute))[1] for _ in range(3)]
+        compute.release.set()
+        await asyncio.sleep(0)
+        return compute.runs, statuses
+
+    runs, statuses = asyncio.run(run())
+    assert statuses == ["stale"] * 3
+    assert runs == 1 and cache.refreshes == 1
+
+
+def test_a_failed_refresh_keeps_serving_the_stale_card():
+    cache = CardCache(ttl_seconds=60, stale_seconds=60)
+
+    async def fail():
+        raise RuntimeError("graph failed")
+
+    async def run():
+        cache.put("p", [{"summary": "old"}], created_at=time.time() - 90)
+        first = await cache.get_or_compute("p", fail)
+        await asyncio.sleep(0)
+        # The failed refresh is no longer in flight, so the next hit tries again
+        second = await cache.get_or_compute("p", fail)
+        await asyncio.sleep(0)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == ([{"summary": "old"}], "stale")
+    assert cache.refreshes == cache.refresh_errors == 2
+
+
+def test_invalidate_detaches_running_computations():
+    cache = CardCache()
+
+    async def run():
+        old = Computation()
+        before = asyncio.create_task(cache.get_or_compute("p", old))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        # A request after the index swap must not join the computation on the old index
+        new = Computation()
+        after = asyncio.create_task(cache.get_or_compute("p", new))
+        await asyncio.sleep(0)
+        old.release.set()
+        old_result = await before
+        # The old result is returned to its caller, but not cached
+        assert "p" not in cache
+        new.release.set()
+        return old_result, await after, new.runs
+
+    (_, old_status), (_, new_status), new_runs = asyncio.run(run())
+    assert (old_status, new_status) == ("miss", "miss")
+    assert new_runs == 1
+    assert "p" in cache
+    assert cache.stats()["inflight"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = CardCache(max_entries=2)
+    cache.put("a", [])
+    cache.put("b", [])
+    asyncio.run(cache.get_or_compute("a", Computation()))
+    cache.put("c", [])
+    assert ("a" in cache, "b" in cache, "c" in cache) == (True, False, True)
+    assert cache.evictions == 1
+
+
+def test_disabled_cache_always_computes():
+    cache = CardCache(enabled=False)
+
+    async def run():
+        compute = Computation()
+        compute.release.set()
+        return [await cache.get_or_compute("p", compute) for _ in range(2)], compute.runs
+
+    results, runs = asyncio.run(run())
+    assert [status for _, status in results] == ["disabled", "disabled"]
+    assert runs == 2 and "p" not in cache
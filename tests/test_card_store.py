@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import card_cache
+import precompute_cards
+from card_store import CardStore
+
+CENSUS = [
+    {"patient": {"resourceType": "Patient", "gender": "female", "birthDate": "1950-03-02"},
+     "conditions": {"resourceType": "Bundle", "entry": [
+         {"resource": {"resourceType": "Condition", "code": {"text": "Heart failure"}}}]}},
+    {"patient": {"resourceType": "Patient", "gender": "male", "birthDate": "1962-07-19"},
+     "conditions": {"resourceType": "Bundle", "entry": [
+         {"resource": {"resourceType": "Condition", "code": {"text": "Atrial fibrillation"}}}]}},
+]
+
+
+def test_keys_and_get_skip_expired_records(tmp_path):
+    store = CardStore(str(tmp_path / "cards.jsonl"), max_age_seconds=60)
+    store.open("v1")
+    store.append("fresh", [{"summary": "fresh"}])
+    store.append("old", [{"summary": "old"}], created_at=time.time() - 120)
+    assert store.keys() == {"fresh"}
+    assert store.get("old") is None
+    assert store.get("fresh").cards == [{"summary": "fresh"}]
+
+
+def test_later_record_replaces_an_expired_one(tmp_path):
+    store = CardStore(str(tmp_path / "cards.jsonl"), max_age_seconds=60)
+    store.open("v1")
+    store.append("key", [{"summary": "old"}], created_at=time.time() - 120)
+    store.append("key", [{"summary": "new"}])
+    assert store.keys() == {"key"}
+    assert store.get("key").cards == [{"summary": "new"}]
+
+
+def test_other_index_versions_and_partial_lines_are_ignored(tmp_path):
+    path = tmp_path / "cards.jsonl"
+    CardStore(str(path), index_version="v0").append("other-version", [])
+    store = CardStore(str(path))
+    store.open("v1")
+    line = json.dumps({"key": "late", "index_version": "v1", "created_at": time.time(), "cards": []}) + "\n"
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+    assert store.keys() == set()
+    # The writer finishes the line: the record is picked up on the next read
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[20:])
+    assert store.keys() == {"late"}
+
+
+@pytest.fixture
+def census(tmp_path):
+    path = tmp_path / "census.jsonl"
+    path.write_text("".join(json.dumps(item) + "\n" for item in CENSUS), encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def graph_runs(monkeypatch):
+    runs = []
+
+    async def generate_cards(rag_app, profile, thread_id):
+        runs.append(profile.key)
+        return [{"summary": profile.key}]
+
+    monkeypatch.setattr(card_cache, "generate_cards", generate_cards)
+    return runs
+
+
+def test_precompute_resumes_and_recomputes_expired_cards(tmp_path, census, graph_runs):
+    store_path = str(tmp_path / "cards.jsonl")
+
+    first = asyncio.run(precompute_cards.precompute(census, store_path, workers=2, retries=0, force=False))
+    assert (first["computed"], first["resumed"]) == (2, 0)
+
+    second = asyncio.run(precompute_cards.precompute(census, store_path, workers=2, retries=0, force=False))
+    assert (second["computed"], second["resumed"]) == (0, 2)
+
+    # Cards that are due to go stale count as missing
+    expired = asyncio.run(precompute_cards.precompute(census, store_path, workers=2, retries=0, force=False,
+                                                      max_age=0))
+    assert (expired["computed"], expired["resumed"]) == (2, 0)
+    assert len(graph_runs) == 4
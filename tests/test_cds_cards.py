@@ -0,0 +1,65 @@
+import asyncio
+from datetime import date
+
+import pytest
+from langchain_core.messages import AIMessage
+
+import card_cache
+from fhir_profile import UNKNOWN_AGE, age_band, patient_profile, profile_query
+
+HF_TITLE = "2022 AHA/ACC/HFSA Guideline for the Management of Heart Failure"
+
+
+class FakeGraph:
+    """Records the state a hook runs the graph with and answers with a fixed recommendation."""
+
+    class Checkpointer:
+        def delete_thread(self, thread_id):
+            pass
+
+    def __init__(self):
+        self.states = []
+        self.checkpointer = self.Checkpointer()
+
+    async def ainvoke(self, input, config):
+        self.states.append(input)
+        return {"messages": [AIMessage(content="Start an SGLT2 inhibitor.")]}
+
+
+def test_age_is_banded_and_unknown_without_a_valid_birth_date():
+    assert age_band("1960-06-15", today=date(2025, 6, 1), band_years=10) == "60-69"
+    assert age_band("not a date") == UNKNOWN_AGE
+
+
+def test_prompt_names_the_guidelines_and_renders_unknown_age():
+    profile = patient_profile({"gender": "Female", "birthDate": "unknown"}, None, None)
+    query = profile_query(profile, [HF_TITLE, "ckd guideline"])
+    assert query.startswith(f"Based on the {HF_TITLE} and the ckd guideline, what are the key recommendations")
+    assert "A female patient of unknown age" in query
+    assert "year-old" not in query
+
+
+def test_card_names_the_single_served_guideline():
+    graph = FakeGraph()
+    profile = patient_profile({"gender": "male", "birthDate": "1950-01-01"}, None, None)
+    [card] = asyncio.run(card_cache.generate_cards(graph, profile, thread_id="hook"))
+    assert card["source"] == {"label": HF_TITLE, "url": card_cache.GUIDELINE_URLS["hf"]}
+    assert card["detail"] == "Start an SGLT2 inhibitor."
+    assert HF_TITLE in graph.states[0]["query"][0].content
+
+
+def test_card_lists_every_cds_guideline(monkeypatch):
+    monkeypatch.setattr(card_cache, "CDS_GUIDELINES", ["hf", "ckd"])
+    graph = FakeGraph()
+    profile = patient_profile({"gender": "male", "birthDate": "1950-01-01"}, None, None)
+    [card] = asyncio.run(card_cache.generate_cards(graph, profile, thread_id="hook"))
+    # No single source link for a card drawn from several guidelines
+    assert card["source"] == {"label": f"{HF_TITLE}; ckd guideline"}
+    assert graph.states[0]["guidelines"] == ["hf", "ckd"]
+    assert "and the ckd guideline" in graph.states[0]["query"][0].content
+
+
+@pytest.mark.parametrize("index_guidelines, missing", [(["hf", "ckd"], []), (["ckd"], ["hf"])])
+def test_cds_guidelines_missing_from_the_index(monkeypatch, index_guidelines, missing):
+    monkeypatch.setattr(card_cache, "CDS_GUIDELINES", ["hf"])
+    assert card_cache.missing_cds_guidelines(index_guidelines) == missing
@@ -0,0 +1,58 @@
+import asyncio
+
+from langchain.schema import Document
+
+import compression
+from llm_gateway import GatewayChatModel, LLMGateway, ModelPool
+from stub_llm import StubChatModel
+
+
+class CountingModel(StubChatModel):
+    """Stub model that records how many of its calls overlap."""
+    latency: float = 0.02
+    in_flight: int = 0
+    peak: int = 0
+    calls: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+def docs(n: int) -> list[Document]:
+    return [Document(page_content=f"Recommendation {i} on loop diuretics.") for i in range(n)]
+
+
+def test_llm_extract_takes_a_gateway_slot_per_call(monkeypatch):
+    from langchain.retrievers.document_compressors import LLMChainExtractor
+
+    model = CountingModel()
+    gateway = LLMGateway([ModelPool("stub", [model])], max_in_flight=2, hedging=False)
+    monkeypatch.setattr(compression, "_cached_extractor", LLMChainExtractor.from_llm(GatewayChatModel(gateway=gateway)))
+
+    async def run():
+        # Two queries whose fan-out together is well over the limit
+        return await asyncio.gather(compression.llm_extract(docs(6), "diuretics", fan_out=4),
+                                    compression.llm_extract(docs(3), "diuretics", fan_out=4))
+
+    first, second = asyncio.run(run())
+    assert (len(first), len(second)) == (6, 3)
+    assert model.calls == 9
+    # Every extraction is admitted on its own, so the limit holds across queries and is used in full
+    assert model.peak == 2
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_compression_stats_count_one_llm_call_per_document(monkeypatch):
+    async def extract(documents, query):
+        return documents[:1]
+
+    monkeypatch.setattr(compression, "llm_extract", extract)
+    compressed, stats = asyncio.run(compression.compress_documents(docs(4), "diuretics", "llm"))
+    assert len(compressed) == 1
+    assert (stats["llm_calls"], stats["docs_in"], stats["docs_out"]) == (4, 4, 1)
@@ -0,0 +1,77 @@
+from langchain.schema import Document
+
+from compression import estimate_tokens
+from context_packing import drop_duplicate_sentences, merge_chunks, pack_context
+
+PAGE = ("In patients with HFrEF, SGLT2i are recommended to reduce hospitalization. "
+        "Loop diuretics are recommended for patients with fluid retention. "
+        "Beta blockers reduce mortality in patients with current or previous symptoms. "
+        "ARNi is recommended in NYHA class II to III to reduce morbidity.")
+
+
+def chunk(text: str, page=1, source: str = "hf.pdf") -> Document:
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_overlapping_chunks_of_a_page_are_joined():
+    # Split like the text splitter would, with 60 characters repeated between neighbours
+    first, second = chunk(PAGE[:150]), chunk(PAGE[90:])
+    (block,) = merge_chunks([second, first])
+    assert block.text == PAGE
+    assert (block.chunks, block.rank) == (2, 0)
+
+
+def test_contained_chunks_are_dropped():
+    (block,) = merge_chunks([chunk(PAGE), chunk(PAGE[20:120])])
+    assert block.text == PAGE and block.chunks == 2
+
+
+def test_a_chunk_bridging_two_blocks_merges_all_three():
+    left, middle, right = chunk(PAGE[:100]), chunk(PAGE[50:200]), chunk(PAGE[150:])
+    (block,) = merge_chunks([left, right, middle])
+    assert block.text == PAGE and block.chunks == 3
+
+
+def test_chunks_of_other_pages_or_without_a_page_stay_apart():
+    blocks = merge_chunks([chunk(PAGE[:150], page=1), chunk(PAGE[90:], page=2),
+                           chunk(PAGE[:150], page=None), chunk(PAGE[90:], page=None)])
+    assert [b.rank for b in blocks] == [0, 1, 2, 3]
+    assert all(b.chunks == 1 for b in blocks)
+
+
+def test_blocks_keep_relevance_order():
+    blocks = merge_chunks([chunk("Unrelated first chunk about sodium intake.", page=2),
+                           chunk(PAGE[:150]), chunk(PAGE[90:])])
+    assert [b.page for b in blocks] == [2, 1]
+
+
+def test_near_duplicate_sentences_are_dropped_from_less_relevant_blocks():
+    blocks = merge_chunks([chunk(PAGE, page=1),
+                           chunk("Loop diuretics are recommended for patients with fluid retention! "
+                                 "Potassium should be monitored.", page=5)])
+    assert drop_duplicate_sentences(blocks, threshold=0.8) == 1
+    assert blocks[1].sentences == ["Potassium should be monitored."]
+
+
+def test_pack_context_stays_within_the_budget():
+    docs = [chunk(PAGE, page=1), chunk(PAGE.replace("HFrEF", "HFpEF"), page=2, source="other.pdf")]
+    context, stats = pack_context(docs, budget=50, threshold=0.9)
+    assert estimate_tokens(context) <= 50
+    assert context.startswith("In patients with HFrEF")
+    assert stats["truncated_blocks"] == 1
+    assert stats["blocks"] == 1 and stats["skipped_blocks"] == 1
+    assert stats["tokens_saved"] > 0
+
+
+def test_pack_context_always_keeps_the_best_sentence():
+    context, stats = pack_context([chunk(PAGE)], budget=1)
+    assert context == PAGE.split(". ")[0] + "."
+    assert stats["blocks"] == 1
+
+
+def test_pack_context_without_budget_merges_and_dedups_only():
+    context, stats = pack_context([chunk(PAGE[:150]), chunk(PAGE[90:]), chunk(PAGE, page=3)], budget=0)
+    assert context == PAGE
+    assert stats["merged_chunks"] == 1
+    # Page 3 repeats page 1 word for word
+    assert stats["duplicate_sentences"] == 4 and stats["blocks"] == 1
@@ -0,0 +1,83 @@
+import operator
+import os
+import subprocess
+import sys
+from typing import Annotated, TypedDict
+
+from langchain_core.messages import HumanMessage
+from langgraph.graph import END, START, StateGraph
+
+import nodes
+from checkpointer import BoundedInMemorySaver
+from nodes import query_text, trim_history
+
+
+def thread_messages(n: int) -> list[HumanMessage]:
+    return [HumanMessage(content=f"q{i}", id=f"m{i}") for i in range(n)]
+
+
+def test_query_text_joins_the_window():
+    messages = thread_messages(4)
+    assert query_text(messages, window=2) == "q2 q3"
+    assert query_text(messages, window=1) == "q3"
+    assert query_text(messages, window=10) == "q0 q1 q2 q3"
+
+
+def test_trim_history_removes_messages_before_the_window():
+    messages = thread_messages(4)
+    assert [m.id for m in trim_history(messages, window=2)] == ["m0", "m1"]
+    assert [m.id for m in trim_history(messages, window=1)] == ["m0", "m1", "m2"]
+    assert trim_history(messages, window=10) == []
+
+
+def test_history_window_below_one_is_refused_at_startup():
+    backend_dir = os.path.dirname(os.path.abspath(nodes.__file__))
+    env = dict(os.environ, HISTORY_WINDOW="0",
+               PYTHONPATH=os.pathsep.join(p for p in (backend_dir, os.environ.get("PYTHONPATH")) if p))
+    result = subprocess.run([sys.executable, "-c", "import config_state"], env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "HISTORY_WINDOW must be at least 1" in result.stderr
+
+
+class CounterState(TypedDict):
+    turns: Annotated[list[int], operator.add]
+
+
+def counter_graph(checkpointer: BoundedInMemorySaver):
+    graph = StateGraph(CounterState)
+    graph.add_node("turn", lambda state: {"turns": [len(state["turns"])]})
+    graph.add_edge(START, "turn")
+    graph.add_edge("turn", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def test_checkpoints_per_thread_are_capped():
+    saver = BoundedInMemorySaver(max_threads=10, max_checkpoints=2)
+    app = counter_graph(saver)
+    for _ in range(5):
+        app.invoke({"turns": []}, config("a"))
+    # The latest checkpoint still carries the whole state
+    assert app.get_state(config("a")).values["turns"] == [0, 1, 2, 3, 4]
+    assert len(saver.storage["a"][""]) == 2
+    # Only blobs the kept checkpoints reference remain
+    live = {("a", "", channel, version) for checkpoint in saver.storage["a"][""]
+            for channel, version in saver._channel_versions[("a", "", checkpoint)].items()}
+    assert set(saver.blobs) <= live
+
+
+def test_least_recently_written_thread_is_evicted():
+    saver = BoundedInMemorySaver(max_threads=2, max_checkpoints=2)
+    app = counter_graph(saver)
+    for thread_id in ("a", "b", "a", "c"):
+        app.invoke({"turns": []}, config(thread_id))
+
+    assert saver.stats()["threads"] == 2
+    assert saver.evicted_threads == 1
+    assert set(saver.storage) == {"a", "c"}
+    assert all(key[0] != "b" for key in saver.blobs)
+    assert app.get_state(config("b")).values == {}
+    assert app.get_state(config("a")).values["turns"] == [0, 1]
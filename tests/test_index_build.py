@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import index_store
+from config_state import EMBEDDING_MODEL_NAME
+from index_store import build_index, current_version
+
+
+@pytest.fixture
+def guidelines(tmp_path):
+    path = tmp_path / "hf.pdf"
+    path.write_bytes(b"%PDF-1.4 guideline")
+    return {"hf": str(path)}
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Replace parsing and embedding with a manifest-only artifact; records the scratch path of each build."""
+    builds = []
+
+    def write_artifact(guidelines, partial_path, version, *args):
+        builds.append(partial_path)
+        time.sleep(0.05)
+        manifest = {"version": version, "format": index_store.ARTIFACT_FORMAT, "guidelines": {},
+                    "embedding_model": EMBEDDING_MODEL_NAME}
+        with open(os.path.join(partial_path, index_store.MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    monkeypatch.setattr(index_store, "_write_artifact", write_artifact)
+    return builds
+
+
+def entries(index_dir) -> set[str]:
+    return set(os.listdir(index_dir)) - {index_store.LOCK_FILE}
+
+
+def test_build_publishes_version_without_scratch_files(tmp_path, guidelines, written):
+    index_dir = str(tmp_path / "index")
+    manifest = build_index(guidelines, index_dir)
+    assert current_version(index_dir) == manifest["version"]
+    assert entries(index_dir) == {manifest["version"], index_store.CURRENT_FILE}
+    assert not os.path.exists(written[0])
+
+
+def test_unchanged_sources_reuse_the_build(tmp_path, guidelines, written):
+    index_dir = str(tmp_path / "index")
+    first = build_index(guidelines, index_dir)
+    assert build_index(guidelines, index_dir)["version"] == first["version"]
+    assert len(written) == 1
+
+
+def test_forced_rebuild_leaves_the_served_version_alone(tmp_path, guidelines, written):
+    index_dir = str(tmp_path / "index")
+    version = build_index(guidelines, index_dir)["version"]
+    # A worker has this version open
+    marker = os.path.join(index_dir, version, "in-use")
+    open(marker, "w").close()
+
+    rebuilt = build_index(guidelines, index_dir, force=True)["version"]
+    assert rebuilt == f"{version}-1"
+    assert os.path.exists(marker)
+    assert current_version(index_dir) == rebuilt
+    # The forced build is what later unforced builds reuse
+    assert build_index(guidelines, index_dir)["version"] == rebuilt
+    assert len(written) == 2
+
+
+def test_failed_build_keeps_current(tmp_path, guidelines, written, monkeypatch):
+    index_dir = str(tmp_path / "index")
+    version = build_index(guidelines, index_dir)["version"]
+
+    def fail(*args):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(index_store, "_write_artifact", fail)
+    with pytest.raises(RuntimeError):
+        build_index(guidelines, index_dir, force=True)
+    assert current_version(index_dir) == version
+    assert entries(index_dir) == {version, index_store.CURRENT_FILE}
+
+
+@pytest.mark.parametrize("force", [False, True])
+def test_concurrent_builds_take_turns(tmp_path, guidelines, written, force):
+    index_dir = str(tmp_path / "index")
+    results, errors = [], []
+
+    def build():
+        try:
+            results.append(build_index(guidelines, index_dir, force=force)["version"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    if force:
+        # Every forced build gets a directory of its own
+        assert len(set(results)) == 3
+        assert len(set(written)) == 3
+    else:
+        assert len(set(results)) == 1
+        assert len(written) == 1
+    assert current_version(index_dir) in results
+    assert entries(index_dir) == set(results) | {index_store.CURRENT_FILE}
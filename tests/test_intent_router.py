@@ -0,0 +1,131 @@
+import asyncio
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import HumanMessage
+
+import intent_router
+import nodes
+from intent_router import IntentRouter
+
+VECTORS = {
+    "heart failure therapy": [1.0, 0.0, 0.0],
+    "diuretic dosing": [0.8, 0.0, 0.6],
+    "hello": [0.0, 1.0, 0.0],
+    "tell me a joke": [0.0, 0.8, 0.6],
+}
+
+
+class TableEmbeddings(Embeddings):
+    """Fixed vectors for the exemplars, so centroids and margins are known exactly."""
+
+    def embed_query(self, text: str) -> list[float]:
+        return VECTORS[text]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def router(monkeypatch) -> IntentRouter:
+    monkeypatch.setattr(intent_router, "embedding_model", TableEmbeddings())
+    return IntentRouter({"medical": ["heart failure therapy", "diuretic dosing"],
+                         "general": ["hello", "tell me a joke"]})
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_nearest_centroid_and_margin(router):
+    medical, general = unit(0.9, 0.0, 0.3), unit(0.0, 0.9, 0.3)
+    label, margin = router.classify_embedding(unit(1.0, 0.0, 0.0))
+    assert label == "medical"
+    assert margin == pytest.approx(medical[0] - general[0], abs=1e-6)
+
+    label, margin = router.classify_embedding(unit(0.0, 1.0, 0.0))
+    assert label == "general" and margin > 0.5
+
+
+def test_query_between_the_centroids_has_no_margin(router):
+    label, margin = router.classify_embedding(unit(1.0, 1.0, 0.0))
+    assert margin == pytest.approx(0.0, abs=1e-6)
+    assert label in ("medical", "general")
+
+
+def test_batch_matches_single_queries(router):
+    queries = [unit(1.0, 0.1, 0.0), unit(0.1, 1.0, 0.2), unit(0.5, 0.4, 0.8)]
+    batch = router.classify_embeddings(queries)
+    for query, (label, margin) in zip(queries, batch):
+        single_label, single_margin = router.classify_embedding(query)
+        assert label == single_label
+        assert margin == pytest.approx(single_margin, abs=1e-6)
+
+
+def test_classify_embeds_the_query(router):
+    assert router.classify("diuretic dosing")[0] == "medical"
+    assert router.classify("tell me a joke")[0] == "general"
+
+
+class FixedRouter:
+    def __init__(self, label: str, margin: float):
+        self.result = (label, margin)
+
+    def classify(self, query: str) -> tuple[str, float]:
+        return self.result
+
+
+class LLMIntent:
+    """Stands in for nodes.llm_intent: records the queries escalated to it."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.queries = []
+
+    async def __call__(self, query: str) -> str:
+        self.queries.append(query)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+@pytest.fixture
+def escalate(monkeypatch):
+    """Run intent_classifier with a router result; returns (intent, queries escalated to the LLM)."""
+    monkeypatch.setattr(nodes, "INTENT_CLASSIFIER", "embedding")
+    monkeypatch.setattr(nodes, "INTENT_MIN_MARGIN", 0.05)
+    monkeypatch.setattr(nodes, "INTENT_LLM_ESCALATION", True)
+
+    def run(label: str, margin: float, llm_answer="medical") -> tuple[str, list[str]]:
+        llm = LLMIntent(llm_answer)
+        monkeypatch.setattr(nodes, "intent_router", FixedRouter(label, margin))
+        monkeypatch.setattr(nodes, "llm_intent", llm)
+        state = {"query": [HumanMessage(content="Is digoxin still used?", id="m1")]}
+        return asyncio.run(nodes.intent_classifier(state))["intent"], llm.queries
+
+    return run
+
+
+def test_confident_router_decision_skips_the_llm(escalate):
+    assert escalate("general", 0.05) == ("general", [])
+
+
+def test_unsure_router_decision_is_escalated(escalate):
+    assert escalate("general", 0.01) == ("medical", ["Is digoxin still used?"])
+
+
+def test_failed_escalation_falls_back_to_the_router(escalate):
+    intent, queries = escalate("general", 0.01, llm_answer=RuntimeError("429"))
+    assert intent == "general" and len(queries) == 1
+
+
+def test_escalation_can_be_turned_off(escalate, monkeypatch):
+    monkeypatch.setattr(nodes, "INTENT_LLM_ESCALATION", False)
+    assert escalate("general", 0.01) == ("general", [])
+
+
+def test_llm_classifier_always_asks_the_llm(escalate, monkeypatch):
+    monkeypatch.setattr(nodes, "INTENT_CLASSIFIER", "llm")
+    assert escalate("general", 0.9) == ("medical", ["Is digoxin still used?"])
@@ -0,0 +1,12 @@
+import os
+
+import main
+from startup_profile import LAZY_MODULES, import_profile
+
+
+def test_importing_main_leaves_heavy_modules_unloaded():
+    # A fresh interpreter, since this one may have imported them for other tests
+    backend_dir = os.path.dirname(os.path.abspath(main.__file__))
+    pythonpath = os.pathsep.join(p for p in (backend_dir, os.environ.get("PYTHONPATH")) if p)
+    _, _, imported = import_profile(dict(os.environ, PYTHONPATH=pythonpath))
+    assert imported == [], f"importing main pulled in {imported} (of {', '.join(LAZY_MODULES)})"
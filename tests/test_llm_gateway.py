@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import HumanMessage
+
+import fake_llm_server
+from llm_gateway import MIN_HEDGE_SAMPLES, LLMGateway, ModelPool, llm_lane_var
+from stub_llm import StubChatModel
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ScriptedModel(StubChatModel):
+    """Stub model that raises the scripted errors first and records every call it starts."""
+    latency: float = 0.0
+    errors: list = []
+    calls: list = []
+    cancelled: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(str(messages[-1].content))
+        if self.errors:
+            raise self.errors.pop(0)
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        except asyncio.CancelledError:
+            self.cancelled.append(str(messages[-1].content))
+            raise
+
+
+def gateway(*pools: ModelPool, **kwargs) -> LLMGateway:
+    kwargs.setdefault("backoff_seconds", 0.0)
+    return LLMGateway(list(pools), **kwargs)
+
+
+async def ask(gw: LLMGateway, text: str, lane: str = "chat") -> str:
+    llm_lane_var.set(lane)
+    result = await gw.agenerate([HumanMessage(content=text)])
+    return result.generations[0].message.content
+
+
+def test_queued_calls_are_admitted_in_lane_order():
+    model = ScriptedModel(latency=0.05)
+    gw = gateway(ModelPool("primary", [model]), max_in_flight=1)
+
+    async def run():
+        first = asyncio.create_task(ask(gw, "first"))
+        await asyncio.sleep(0.01)
+        batch = asyncio.create_task(ask(gw, "batch", "batch"))
+        chat = asyncio.create_task(ask(gw, "chat", "chat"))
+        cds = asyncio.create_task(ask(gw, "cds", "cds"))
+        await asyncio.sleep(0.01)
+        assert gw.stats()["waiting"] == {"cds": 1, "chat": 1, "batch": 1}
+        await asyncio.gather(first, batch, chat, cds)
+
+    asyncio.run(run())
+    assert model.calls == ["first", "cds", "chat", "batch"]
+    assert gw.stats()["in_flight"] == 0
+
+
+def test_request_budget_holds_calls_back():
+    model = ScriptedModel()
+    pool = ModelPool("primary", [model], rpm=2)
+    gw = gateway(pool)
+
+    async def run():
+        tasks = [asyncio.create_task(ask(gw, str(i))) for i in range(3)]
+        await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+    assert model.calls == ["0", "1"]
+    assert gw.stats()["waiting"]["chat"] == 0
+
+
+def test_retryable_errors_are_retried():
+    model = ScriptedModel(errors=[APIError(503), APIError(429)])
+    pool = ModelPool("primary", [model])
+    answer = asyncio.run(ask(gateway(pool), "retry me"))
+    assert answer.endswith("retry me")
+    assert len(model.calls) == 3
+    assert pool.events["retry"] == 2
+    assert (pool.events["error"], pool.events["rate_limited"]) == (1, 1)
+
+
+def test_other_errors_are_raised_at_once():
+    model = ScriptedModel(errors=[APIError(400)])
+    gw = gateway(ModelPool("primary", [model]))
+    try:
+        asyncio.run(ask(gw, "bad request"))
+    except APIError as e:
+        assert e.status_code == 400
+    else:
+        raise AssertionError("expected the 400 to be raised")
+    assert len(model.calls) == 1
+    assert gw.stats()["in_flight"] == 0
+
+
+def test_failing_primary_falls_over_to_the_next_model():
+    primary = ScriptedModel(errors=[APIError(503)] * 2)
+    fallback = ScriptedModel()
+    primary_pool, fallback_pool = ModelPool("primary", [primary]), ModelPool("fallback", [fallback])
+    answer = asyncio.run(ask(gateway(primary_pool, fallback_pool, max_retries=1), "fall over"))
+    assert answer.endswith("fall over")
+    assert len(primary.calls) == 2 and len(fallback.calls) == 1
+    assert primary_pool.events["fallback"] == 1
+
+
+def test_exhausted_primary_budget_falls_over_after_the_queue_timeout():
+    primary = ScriptedModel()
+    primary_pool = ModelPool("primary", [primary], rpm=1)
+    primary_pool.take(1, 0)
+    fallback = ScriptedModel()
+    gw = gateway(primary_pool, ModelPool("fallback", [fallback]), max_queue_seconds=0.05)
+    assert asyncio.run(ask(gw, "too busy")).endswith("too busy")
+    assert primary.calls == [] and fallback.calls == ["too busy"]
+    assert primary_pool.events["queue_timeout"] == 1
+
+
+def hedging_pool(model: StubChatModel) -> ModelPool:
+    pool = ModelPool("primary", [model, model])
+    pool.latencies.extend([0.01] * MIN_HEDGE_SAMPLES)
+    return pool
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    model = ScriptedModel(latency=0.2)
+    pool = hedging_pool(model)
+    gw = gateway(pool, hedge_min_seconds=0.05)
+    assert asyncio.run(ask(gw, "hedge")).endswith("hedge")
+    assert pool.events["hedge"] == 1
+    assert model.calls == ["hedge", "hedge"]
+    assert model.cancelled == ["hedge"]
+    assert gw.stats()["in_flight"] == 0
+
+
+def test_cancelled_caller_cancels_the_calls_it_started():
+    for hedge_min_seconds in (10.0, 0.01):
+        # Cancelled before the hedge delay, and while racing the hedge
+        model = ScriptedModel(latency=10.0)
+        pool = hedging_pool(model)
+        gw = gateway(pool, hedge_min_seconds=hedge_min_seconds)
+
+        async def run():
+            task = asyncio.create_task(ask(gw, "abandoned"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            # Checked before asyncio.run cancels whatever is left over
+            assert len(model.cancelled) == len(model.calls) > 0
+            assert gw.stats()["in_flight"] == 0
+            assert sum(pool.in_flight.values()) == 0
+
+        asyncio.run(run())
+
+
+def sse_events(response) -> list:
+    lines = [line for line in response.text.splitlines() if line.startswith("data: ")]
+    assert lines[-1] == "data: [DONE]"
+    return [json.loads(line[len("data: "):]) for line in lines[:-1]]
+
+
+def test_fake_server_streams_tool_calls():
+    client = TestClient(fake_llm_server.create_app(latency=0.0, tail_share=0.0, seed=0))
+    tool = {"type": "function", "function": {"name": "RouteQuery", "parameters": {}}}
+    response = client.post("/openai/v1/chat/completions", json={
+        "model": "m", "stream": True, "tools": [tool],
+        "messages": [{"role": "user", "content": "User query: heart failure therapy"}]})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response)
+    (call,) = events[0]["choices"][0]["delta"]["tool_calls"]
+    assert call["index"] == 0 and call["function"]["name"] == "RouteQuery"
+    assert json.loads(call["function"]["arguments"]) == {"intent": "medical"}
+    assert events[-1]["choices"][0]["finish_reason"] == "tool_calls"
+    assert events[-1]["x_groq"]["usage"]["total_tokens"] > 0
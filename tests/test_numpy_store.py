@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+import nodes
+import numpy_store
+from numpy_store import NumpyVectorStore
+
+
+@pytest.fixture
+def chunks() -> list[Document]:
+    return [Document(page_content=f"chunk {i}", metadata={"page": i}) for i in range(50)]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_scores_match_float32_in_every_block_size(embeddings, chunks, dtype, monkeypatch):
+    vectors = embeddings.embed_documents([c.page_content for c in chunks])
+    exact = NumpyVectorStore.from_vectors(embeddings, vectors, chunks)
+    store = NumpyVectorStore.from_vectors(embeddings, vectors, chunks, dtype=dtype)
+    query = np.asarray(embeddings.embed_documents(["chunk 7", "chunk 31"]), dtype=np.float32)
+    # Blocks that don't divide the row count
+    monkeypatch.setattr(numpy_store, "SCORE_BLOCK_ROWS", 7)
+    tolerance = {"float32": 1e-6, "float16": 2e-3, "int8": 2e-2}[dtype]
+    np.testing.assert_allclose(store._scores(query), exact._scores(query), atol=tolerance)
+
+
+def test_search_ranks_the_matching_chunk_first(embeddings, chunks):
+    store = NumpyVectorStore.from_documents(chunks, embeddings, dtype="int8")
+    results = store.similarity_search_with_score("chunk 12", k=3)
+    assert results[0][0].page_content == "chunk 12"
+    assert results[0][1] == pytest.approx(1.0, abs=0.02)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_save_refuses_to_overwrite_a_store(tmp_path, embeddings, chunks):
+    store = NumpyVectorStore.from_documents(chunks, embeddings, version="v1")
+    store.save(str(tmp_path))
+    with pytest.raises(FileExistsError):
+        store.save(str(tmp_path))
+
+
+def test_publish_leaves_mapped_versions_intact(tmp_path, embeddings, chunks):
+    path = str(tmp_path / "store")
+    NumpyVectorStore.from_documents(chunks, embeddings, version="v1").publish(path)
+    mapped = NumpyVectorStore.load(path, embeddings)
+    before = np.array(mapped.vectors)
+
+    rebuilt = [Document(page_content=f"edited {i}") for i in range(80)]
+    NumpyVectorStore.from_documents(rebuilt, embeddings, version="v2").publish(path)
+
+    # The first worker's mapping still reads the old matrix; new loads get the new version
+    np.testing.assert_array_equal(np.array(mapped.vectors), before)
+    assert NumpyVectorStore.saved_version(path) == "v2"
+    assert len(NumpyVectorStore.load(path, embeddings).documents) == 80
+    # Switching back reuses the v1 directory rather than rewriting it
+    NumpyVectorStore.from_documents(chunks, embeddings, version="v1").publish(path)
+    assert NumpyVectorStore.saved_version(path) == "v1"
+
+
+def test_workers_building_together_embed_once(tmp_path, embeddings, chunks, monkeypatch):
+    monkeypatch.setattr(nodes, "NUMPY_STORE_DIRECTORY", str(tmp_path / "store"))
+    monkeypatch.setattr(nodes, "embedding_model", embeddings)
+    results = []
+
+    def worker():
+        results.append(nodes.load_or_build_numpy_store(chunks, "v1"))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(built for _, built in results) == [False, False, False, True]
+    assert all(store.version == "v1" and len(store.documents) == 50 for store, _ in results)
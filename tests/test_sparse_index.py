@@ -0,0 +1,78 @@
+import asyncio
+
+from langchain.schema import Document
+
+from sparse_index import BM25Index, hybrid_search, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    "SGLT2i are recommended in patients with HFrEF to reduce hospitalization.",
+    "In patients with LVEF ≤40%, sacubitril/valsartan is recommended over an ACEi.",
+    "CRT-D is reasonable for patients with NYHA class III symptoms.",
+    "Loop diuretics relieve congestion; dosing follows the patient's weight.",
+]
+
+
+def chunk(text: str, page: int = 1) -> Document:
+    return Document(page_content=text, metadata={"source": "hf.pdf", "page": page})
+
+
+def test_tokenize_keeps_clinical_terms():
+    assert tokenize("LVEF ≤ 40%") == ["lvef", "le40%"]
+    assert tokenize("LVEF <=40%") == ["lvef", "le40%"]
+    assert tokenize("CRT-D for the patient") == ["crt-d", "crt", "d", "patient"]
+    assert tokenize("sacubitril/valsartan") == ["sacubitril/valsartan", "sacubitril", "valsartan"]
+
+
+def test_bm25_ranks_matching_chunks_and_skips_the_rest():
+    index = BM25Index([chunk(text, page) for page, text in enumerate(CHUNKS)])
+    assert [d.page_content for d in index.search("valsartan in LVEF ≤40%", k=3)] == [CHUNKS[1]]
+    assert index.search("crt", k=3)[0].page_content == CHUNKS[2]
+    assert index.search("echocardiography", k=3) == []
+    assert BM25Index([]).search("hfref", k=3) == []
+
+
+def test_bm25_prefers_rarer_terms():
+    index = BM25Index([chunk(text, page) for page, text in enumerate(CHUNKS)])
+    # "patients" is in three chunks, "diuretics" in one
+    assert index.search("patients diuretics", k=1)[0].page_content == CHUNKS[3]
+
+
+def test_bm25_round_trips_through_save(tmp_path):
+    index = BM25Index([chunk(text, page) for page, text in enumerate(CHUNKS)], version="v1")
+    path = str(tmp_path / "bm25.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.version == "v1"
+    assert loaded.search("nyha class iii", k=2) == index.search("nyha class iii", k=2)
+
+
+def test_rrf_rewards_documents_both_retrievers_found():
+    a, b, c, d = (chunk(text, page) for page, text in enumerate(CHUNKS))
+    fused = reciprocal_rank_fusion([[a, b, c], [c, d, b]], k=60)
+    # b and c are in both lists; c's ranks (3, 1) beat b's (2, 3)
+    assert fused == [c, b, a, d]
+
+
+def test_rrf_matches_equal_chunks_from_different_retrievers():
+    dense = [chunk(CHUNKS[0], 1), chunk(CHUNKS[1], 2)]
+    sparse = [chunk(CHUNKS[1], 2), chunk(CHUNKS[1], 3)]
+    fused = reciprocal_rank_fusion([dense, sparse])
+    # Same text and page is one chunk; the same text on another page is not
+    assert len(fused) == 3
+    assert fused[0] is dense[1]
+
+
+class ListStore:
+    def __init__(self, docs: list[Document]):
+        self.docs = docs
+
+    async def asimilarity_search(self, query: str, k: int) -> list[Document]:
+        return self.docs[:k]
+
+
+def test_hybrid_search_fuses_both_retrievers():
+    docs = [chunk(text, page) for page, text in enumerate(CHUNKS)]
+    dense = ListStore([docs[0], docs[3], docs[2]])
+    result = asyncio.run(hybrid_search(dense, BM25Index(docs), "crt-d nyha", k=2, candidates=3))
+    # docs[2] is the only chunk both retrievers found, so it outranks the dense top hit
+    assert result == [docs[2], docs[0]]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from card_cache import CardCache
+from telemetry import (
+    Counter, Histogram, log_event, record_cache, request_id_var, traced_node, NODE_ERRORS,
+)
+
+
+def events(capsys) -> list[dict]:
+    lines = capsys.readouterr().out.splitlines()
+    return [json.loads(line) for line in lines if line.startswith("{")]
+
+
+def test_log_event_is_one_json_line_with_the_request_id(capsys):
+    token = request_id_var.set("req-1")
+    try:
+        log_event("index_swapped", version="v2")
+    finally:
+        request_id_var.reset(token)
+    [record] = events(capsys)
+    assert record["event"] == "index_swapped"
+    assert record["request_id"] == "req-1"
+    assert record["version"] == "v2"
+
+
+def test_traced_node_logs_duration_and_cache_lookups(capsys):
+    async def retrieve(state):
+        record_cache("embedding", True)
+        return {"retrieved_docs": ["a", "b"]}
+
+    asyncio.run(traced_node("retrieve_documents", retrieve)({}))
+    [record] = events(capsys)
+    assert record["event"] == "node"
+    assert record["node"] == "retrieve_documents"
+    assert record["status"] == "ok"
+    assert record["cache"] == {"embedding": "hit"}
+    assert record["retrieved_docs"] == 2
+
+
+def test_traced_node_counts_errors(capsys):
+    def fail(state):
+        raise ValueError("boom")
+
+    before = NODE_ERRORS.values().get(("failing",), 0)
+    with pytest.raises(ValueError):
+        asyncio.run(traced_node("failing", fail)({}))
+    assert NODE_ERRORS.values()[("failing",)] == before + 1
+    assert events(capsys)[0]["status"] == "error"
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "test", ("node",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{node="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{node="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{node="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{node="a"} 3' in lines
+
+
+def test_counter_escapes_label_values():
+    counter = Counter("test_total", "test", ("cache",))
+    counter.inc('a"b')
+    assert 'test_total{cache="a\\"b"} 1' in counter.render()
+
+
+def test_failed_card_refresh_is_logged_with_the_hooks_request_id(capsys):
+    async def run():
+        cache = CardCache(ttl_seconds=60, stale_seconds=3600)
+        cache.put("profile", [{"summary": "old"}], created_at=time.time() - 120)
+
+        async def compute():
+            raise RuntimeError("LLM down")
+
+        token = request_id_var.set("hook-7")
+        try:
+            cards, status = await cache.get_or_compute("profile", compute)
+        finally:
+            request_id_var.reset(token)
+        await asyncio.sleep(0.01)
+        return cards, status, cache.refresh_errors
+
+    cards, status, errors = asyncio.run(run())
+    assert (cards, status, errors) == ([{"summary": "old"}], "stale", 1)
+    [record] = [e for e in events(capsys) if e["event"] == "card_refresh_failed"]
+    assert record["request_id"] == "hook-7"
+    assert record["key"] == "profile"
+    assert record["error"] == "RuntimeError: LLM down"